@@ -30,6 +30,54 @@ SPOTIPY_CLIENT_ID = os.environ.get("SPOTIPY_CLIENT_ID")
 SPOTIPY_CLIENT_SECRET = os.environ.get("SPOTIPY_CLIENT_SECRET")
 SPOTIPY_REDIRECT_URI = os.environ.get("SPOTIPY_REDIRECT_URI")
 
+# Base URL of the Spotify Web API; pointed at the local fake server
+# (spotify_integration.fake_spotify) by the sync benchmark
+SPOTIFY_API_URL = os.environ.get("SPOTIFY_API_URL", "https://api.spotify.com/v1/")
+
+# Number of parallel requests a single sync may issue to the Spotify API
+SPOTIFY_API_CONCURRENCY = int(os.environ.get("SPOTIFY_API_CONCURRENCY", "4"))
+
+# App-wide Spotify request budget shared by every sync, view and command in
+# a process, and how often a 429 is retried after its Retry-After delay
+SPOTIFY_API_RATE_PER_SECOND = float(
+    os.environ.get("SPOTIFY_API_RATE_PER_SECOND", "10")
+)
+SPOTIFY_API_BURST = int(os.environ.get("SPOTIFY_API_BURST", "20"))
+SPOTIFY_API_MAX_RETRIES = int(os.environ.get("SPOTIFY_API_MAX_RETRIES", "3"))
+
+# Artist genres fetched by any user's sync are reused for this many hours
+SPOTIFY_ARTIST_GENRE_TTL_HOURS = int(
+    os.environ.get("SPOTIFY_ARTIST_GENRE_TTL_HOURS", "168")
+)
+
+# A running sync job whose worker has not reported progress for this many
+# minutes is considered dead and marked failed, so the user can sync again
+SYNC_JOB_STALE_MINUTES = int(os.environ.get("SYNC_JOB_STALE_MINUTES", "15"))
+
+# Versioned specific -> broad genre mapping; apply edits with remap_genres
+GENRE_MAPPING_FILE = os.environ.get(
+    "GENRE_MAPPING_FILE",
+    os.path.join(BASE_DIR, "spotify_integration", "genre_mapping.json"),
+)
+
+# Prepared liked songs data per user (see spotify_integration.library_cache).
+# Entries are keyed by a library version the sync bumps, so they never go
+# stale; the least recently used ones are evicted past MAX_ENTRIES. Use a
+# shared backend (e.g. Redis) to share entries between server processes.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "library": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "echosorter-library",
+        "TIMEOUT": int(os.environ.get("LIBRARY_CACHE_TIMEOUT", "86400")),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("LIBRARY_CACHE_MAX_ENTRIES", "2000"))
+        },
+    },
+}
+
 # Check if Spotify credentials are provided
 if not all([SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET, SPOTIPY_REDIRECT_URI]):
     raise ValueError(
@@ -86,6 +134,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Sync workers in separate processes (sync_all_users) write
+        # concurrently; take the write lock up front and wait for it
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 30},
     }
 }
 
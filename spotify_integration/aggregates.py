@@ -0,0 +1,19 @@
+from django.db.models import Aggregate, TextField, Value
+
+
+class GroupConcat(Aggregate):
+    """
+    Concatenates the non-null values of a group into one string with
+    `separator` between them: GROUP_CONCAT on SQLite, STRING_AGG on
+    PostgreSQL. The order of the values is unspecified, unless the
+    aggregate is run as a Window with an order_by.
+    """
+
+    function = "GROUP_CONCAT"
+    output_field = TextField()
+
+    def __init__(self, expression, separator=",", **extra):
+        super().__init__(expression, Value(separator), **extra)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function="STRING_AGG", **extra_context)
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import math
+
+import httpx
+import spotipy
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import LibrarySyncState
+from .spotify_api import ARTIST_BATCH_SIZE, SAVED_TRACKS_PAGE_SIZE, split_at_watermark
+from .sync import (
+    LibrarySync,
+    needs_full_sync,
+    newest_added_at,
+    refresh_genre_mapping,
+)
+from .transport import endpoint_key, get_rate_limiter, get_transport, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSpotifyClient:
+    """
+    Minimal asyncio Spotify Web API client for the sync endpoints. Requests
+    are capped by a semaphore and share the process-wide token bucket,
+    Retry-After handling and endpoint counters with the threaded transport.
+    Errors are raised as spotipy.exceptions.SpotifyException so callers can
+    handle both clients the same way.
+    """
+
+    def __init__(self, access_token, concurrency=None):
+        self.concurrency = concurrency or settings.SPOTIFY_API_CONCURRENCY
+        self.max_retries = settings.SPOTIFY_API_MAX_RETRIES
+        self._limiter = get_rate_limiter()
+        self._stats = get_transport().stats
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=settings.SPOTIFY_API_URL,
+            headers={"Authorization": f"Bearer {access_token}"},
+            timeout=10,
+            limits=httpx.Limits(max_connections=self.concurrency),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+
+    async def _get(self, path, params):
+        endpoint = endpoint_key("GET", settings.SPOTIFY_API_URL + path)
+        loop = asyncio.get_running_loop()
+
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                while True:
+                    wait = self._limiter.try_acquire()
+                    if not wait:
+                        break
+                    await asyncio.sleep(wait)
+
+                started = loop.time()
+                response = await self._client.get(path, params=params)
+                self._stats.record(
+                    endpoint, response.status_code, loop.time() - started
+                )
+                if response.status_code != 429 or attempt == self.max_retries:
+                    break
+
+                retry_after = parse_retry_after(response)
+                logger.warning(
+                    f"[ASYNC_SYNC] 429 on {endpoint}; backing off {retry_after:.1f}s "
+                    f"(attempt {attempt + 1}/{self.max_retries})."
+                )
+                self._limiter.pause(retry_after)
+
+        if response.status_code >= 400:
+            raise spotipy.exceptions.SpotifyException(
+                response.status_code,
+                -1,
+                f"{response.url}:\n {response.text}",
+                headers=response.headers,
+            )
+        return response.json()
+
+    async def current_user_saved_tracks(self, limit=SAVED_TRACKS_PAGE_SIZE, offset=0):
+        return await self._get("me/tracks", {"limit": limit, "offset": offset})
+
+    async def artists(self, artist_ids):
+        return await self._get("artists", {"ids": ",".join(artist_ids)})
+
+
+async def fetch_artist_details_async(client, artist_ids):
+    """
+    Async counterpart of spotify_api.fetch_artist_details(): all 50-ID
+    batches are requested with asyncio.gather, a failing batch is logged and
+    skipped (a 401 is re-raised) and results are merged in batch order.
+    """
+    artist_ids_list = sorted(set(artist_ids))
+    batches = [
+        artist_ids_list[i : i + ARTIST_BATCH_SIZE]
+        for i in range(0, len(artist_ids_list), ARTIST_BATCH_SIZE)
+    ]
+    responses = await asyncio.gather(
+        *(client.artists(batch) for batch in batches), return_exceptions=True
+    )
+
+    artist_details = {}
+    for i, response in enumerate(responses):
+        if isinstance(response, spotipy.exceptions.SpotifyException):
+            if response.http_status == 401:
+                raise response
+            logger.warning(
+                f"Spotify API error fetching artist details for batch {i} (skipping): {response}"
+            )
+            continue
+        if isinstance(response, Exception):
+            logger.error(
+                f"Unexpected error fetching artist details for batch {i} (skipping): {response}"
+            )
+            continue
+        for artist_detail in response["artists"]:
+            if artist_detail:  # Ensure artist_detail is not None
+                artist_details[artist_detail["id"]] = artist_detail
+    return artist_details
+
+
+async def _sync_page(client, library_sync, items):
+    records, unseen_artist_ids = await sync_to_async(library_sync.prepare_page)(items)
+    artist_details = await fetch_artist_details_async(client, unseen_artist_ids)
+    return await sync_to_async(library_sync.save_page)(records, artist_details)
+
+
+async def async_sync_user_library(
+    user_id, access_token, force_full=False, progress=None
+):
+    """
+    asyncio version of sync.sync_user_library() with the same incremental
+    and full-reconcile rules and `progress` callback, which is run through
+    sync_to_async. On a full pass, saved-track pages are fetched a window
+    of SPOTIFY_API_CONCURRENCY pages at a time, and the next window is
+    requested while the current one is written to the DB through
+    sync_to_async. Returns (songs synced, songs removed from the user's
+    library).
+    """
+
+    async def report(phase, pages_done=None, pages_total=None):
+        if progress:
+            await sync_to_async(progress)(phase, pages_done, pages_total)
+
+    await sync_to_async(refresh_genre_mapping)()
+    sync_state = await sync_to_async(
+        LibrarySyncState.objects.filter(user_id=user_id).first
+    )()
+    full_sync = force_full or await sync_to_async(needs_full_sync)(user_id, sync_state)
+    library_sync = LibrarySync(user_id)
+    tracks_synced = 0
+    total = 0
+    last_added_at = None
+
+    try:
+        async with AsyncSpotifyClient(access_token) as client:
+            if not full_sync:
+                last_added_at = sync_state.last_added_at
+                new_items_count = 0
+                offset = 0
+                reached_watermark = False
+                await report("fetching_new_tracks")
+                while not reached_watermark:
+                    page = await client.current_user_saved_tracks(offset=offset)
+                    total = page.get("total") or 0
+                    new_items, reached_watermark = split_at_watermark(
+                        page["items"], sync_state.last_added_at
+                    )
+                    new_items_count += len(new_items)
+                    last_added_at = newest_added_at(new_items, last_added_at)
+                    tracks_synced += await _sync_page(client, library_sync, new_items)
+                    offset += SAVED_TRACKS_PAGE_SIZE
+                    reached_watermark = reached_watermark or offset >= total
+                    await report(
+                        "fetching_new_tracks", offset // SAVED_TRACKS_PAGE_SIZE
+                    )
+
+                if sync_state.library_total + new_items_count != total:
+                    logger.info(
+                        f"[ASYNC_SYNC] Library total for user {user_id} is {total}, expected "
+                        f"{sync_state.library_total + new_items_count}. Falling back to a full reconcile."
+                    )
+                    full_sync = True
+
+            if full_sync:
+                tracks_synced = 0
+                first_page = await client.current_user_saved_tracks(offset=0)
+                total = first_page.get("total") or 0
+                offsets = list(
+                    range(SAVED_TRACKS_PAGE_SIZE, total, SAVED_TRACKS_PAGE_SIZE)
+                )
+                windows = [
+                    offsets[i : i + client.concurrency]
+                    for i in range(0, len(offsets), client.concurrency)
+                ]
+
+                def fetch_window(window):
+                    return asyncio.ensure_future(
+                        asyncio.gather(
+                            *(
+                                client.current_user_saved_tracks(offset=o)
+                                for o in window
+                            )
+                        )
+                    )
+
+                pages_total = max(math.ceil(total / SAVED_TRACKS_PAGE_SIZE), 1)
+                pages_done = 0
+                pages = [first_page]
+                remaining_windows = iter(windows)
+                while pages:
+                    window = next(remaining_windows, None)
+                    pending = fetch_window(window) if window else None
+                    try:
+                        for page in pages:
+                            last_added_at = newest_added_at(
+                                page["items"], last_added_at
+                            )
+                            tracks_synced += await _sync_page(
+                                client, library_sync, page["items"]
+                            )
+                            pages_done += 1
+                            await report("syncing_pages", pages_done, pages_total)
+                    except BaseException:
+                        # Don't leave the prefetched window running (or its
+                        # errors unretrieved) once the sync has failed
+                        if pending:
+                            pending.cancel()
+                            await asyncio.gather(pending, return_exceptions=True)
+                        raise
+                    pages = await pending if pending else []
+
+            if library_sync.stale_artist_ids:
+                await report("refreshing_artists")
+                artist_details = await fetch_artist_details_async(
+                    client, library_sync.stale_artist_ids
+                )
+                await sync_to_async(library_sync.save_page)([], artist_details)
+                library_sync.stale_artist_ids.clear()
+
+        if full_sync:
+            await report("removing_unliked")
+        tracks_removed = await sync_to_async(library_sync.finish)(
+            full_sync, last_added_at, total
+        )
+        logger.info(
+            f"[ASYNC_SYNC] Synced {tracks_synced} liked songs for user {user_id}, "
+            f"removed {tracks_removed}."
+        )
+        return tracks_synced, tracks_removed
+    finally:
+        await sync_to_async(library_sync.clear_staged_songs)()
@@ -0,0 +1,364 @@
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urljoin, urlsplit
+from urllib.request import urlopen
+
+from django.conf import settings
+
+from .genre_utils import BROAD_GENRE_MAPPING
+
+logger = logging.getLogger(__name__)
+
+# Request counters of the server, not counted as a request themselves
+STATS_PATH = "/_fake/stats"
+
+# Spotify genres the synthetic artists draw from: every mapped genre plus a
+# tail of unmapped ones so "no category" songs show up as well.
+FAKE_GENRES = sorted(
+    {genre for genres in BROAD_GENRE_MAPPING.values() for genre in genres}
+) + [f"unmapped genre {i}" for i in range(50)]
+
+
+class SyntheticLibrary:
+    """
+    Deterministic liked-songs library of `track_count` tracks. Artists and
+    genres are drawn from Zipf distributions (a few very popular artists
+    and genres, a long tail of rare ones). Tracks and artists are generated
+    from their index on demand, so even a 100k-track library costs no memory.
+    """
+
+    def __init__(self, track_count, artist_count=None, zipf_s=1.1, seed=0):
+        self.track_count = track_count
+        self.artist_count = artist_count or max(track_count // 10, 1)
+        self.seed = seed
+        self.album_count = max(track_count // 8, 1)
+        self.newest_added_at = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+        self._artist_weights = self._zipf_cum_weights(self.artist_count, zipf_s)
+        self._genre_weights = self._zipf_cum_weights(len(FAKE_GENRES), zipf_s)
+
+    @staticmethod
+    def _zipf_cum_weights(n, s):
+        return list(itertools.accumulate(1 / (k**s) for k in range(1, n + 1)))
+
+    def _rng(self, kind, index):
+        return random.Random(f"{self.seed}:{kind}:{index}")
+
+    def artist(self, index):
+        rng = self._rng("artist", index)
+        genre_indexes = rng.choices(
+            range(len(FAKE_GENRES)),
+            cum_weights=self._genre_weights,
+            k=rng.randint(0, 3),
+        )
+        return {
+            "id": f"fakeartist{index:07d}",
+            "name": f"Artist {index}",
+            "genres": sorted({FAKE_GENRES[i] for i in genre_indexes}),
+        }
+
+    def track_item(self, position):
+        """
+        Saved-track item at `position`, newest first, as returned by
+        GET /me/tracks.
+        """
+        rng = self._rng("track", position)
+        artist_indexes = rng.choices(
+            range(self.artist_count),
+            cum_weights=self._artist_weights,
+            k=rng.choice((1, 1, 1, 2)),
+        )
+        album_index = rng.randrange(self.album_count)
+        return {
+            "added_at": (self.newest_added_at - timedelta(minutes=position)).strftime(
+                "%Y-%m-%dT%H:%M:%SZ"
+            ),
+            "track": {
+                "id": f"faketrack{position:07d}",
+                "name": f"Track {position}",
+                "preview_url": None,
+                "album": {
+                    "id": f"fakealbum{album_index:07d}",
+                    "name": f"Album {album_index}",
+                    "images": [{"url": f"https://example.com/album/{album_index}.jpg"}],
+                },
+                "artists": [
+                    {"id": f"fakeartist{i:07d}", "name": f"Artist {i}"}
+                    for i in dict.fromkeys(artist_indexes)
+                ],
+            },
+        }
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    server_version = "FakeSpotify/1.0"
+
+    ROUTES = [
+        ("GET", re.compile(r"^/v1/me/?$"), "current_user"),
+        ("GET", re.compile(r"^/v1/me/tracks/?$"), "saved_tracks"),
+        ("GET", re.compile(r"^/v1/artists/?$"), "artists"),
+        (
+            "POST",
+            re.compile(r"^/v1/users/(?P<user_id>[^/]+)/playlists/?$"),
+            "create_playlist",
+        ),
+        (
+            "POST",
+            re.compile(r"^/v1/playlists/(?P<playlist_id>[^/]+)/tracks/?$"),
+            "add_items",
+        ),
+    ]
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def log_message(self, format, *args):
+        logger.debug(f"[FAKE_SPOTIFY] {format % args}")
+
+    def _dispatch(self, method):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        if method == "GET" and url.path == STATS_PATH:
+            return self._send(
+                200, {"requests": fake.requests, "rate_limited": fake.rate_limited}
+            )
+        fake.count_request()
+
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.rate_limit_ratio and fake.random() < fake.rate_limit_ratio:
+            fake.count_rate_limited()
+            return self._send(
+                429,
+                {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                headers={"Retry-After": str(fake.retry_after)},
+            )
+
+        for route_method, pattern, handler_name in self.ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                status, body = getattr(self, handler_name)(query, **match.groupdict())
+                return self._send(status, body)
+
+        self._send(404, {"error": {"status": 404, "message": "Service not found"}})
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def current_user(self, query):
+        return 200, {"id": self.server.fake.user_id, "display_name": "Fake User"}
+
+    def saved_tracks(self, query):
+        library = self.server.fake.library
+        limit = min(int(query.get("limit", 20)), 50)
+        offset = int(query.get("offset", 0))
+        end = min(offset + limit, library.track_count)
+        base = self.server.fake.base_url
+        return 200, {
+            "href": f"{base}me/tracks?offset={offset}&limit={limit}",
+            "items": [library.track_item(i) for i in range(offset, end)],
+            "limit": limit,
+            "offset": offset,
+            "total": library.track_count,
+            "next": (
+                f"{base}me/tracks?offset={end}&limit={limit}"
+                if end < library.track_count
+                else None
+            ),
+            "previous": None,
+        }
+
+    def artists(self, query):
+        library = self.server.fake.library
+        artists = []
+        for artist_id in query.get("ids", "").split(",")[:50]:
+            match = re.fullmatch(r"fakeartist(\d+)", artist_id)
+            index = int(match.group(1)) if match else -1
+            artists.append(
+                library.artist(index) if 0 <= index < library.artist_count else None
+            )
+        return 200, {"artists": artists}
+
+    def create_playlist(self, query, user_id):
+        body = self._read_json()
+        playlist_id = self.server.fake.next_playlist_id()
+        return 201, {
+            "id": playlist_id,
+            "name": body.get("name"),
+            "public": body.get("public"),
+            "owner": {"id": user_id},
+            "external_urls": {
+                "spotify": f"https://open.spotify.com/playlist/{playlist_id}"
+            },
+        }
+
+    def add_items(self, query, playlist_id):
+        # Like Spotify, take the URIs from a bare JSON list (what spotipy
+        # sends), a {"uris": [...]} object or a comma-separated ?uris=
+        body = self._read_json()
+        if isinstance(body, list):
+            uris = body
+        elif body.get("uris"):
+            uris = body["uris"]
+        else:
+            uris = [uri for uri in query.get("uris", "").split(",") if uri]
+        if len(uris) > 100:
+            return 400, {"error": {"status": 400, "message": "Too many ids requested"}}
+        self.server.fake.add_playlist_items(playlist_id, uris)
+        return 201, {"snapshot_id": f"{playlist_id}-{len(uris)}"}
+
+
+class FakeSpotifyServer:
+    """
+    Local stand-in for the Spotify Web API endpoints the project uses, with
+    optional per-request latency and a random share of 429 responses. Point
+    SPOTIFY_API_URL at `base_url` to send the project's clients here.
+    """
+
+    def __init__(
+        self,
+        library,
+        host="127.0.0.1",
+        port=0,
+        latency_ms=0,
+        rate_limit_ratio=0.0,
+        retry_after=1,
+        user_id="fake-user",
+        seed=0,
+    ):
+        self.library = library
+        self.latency = latency_ms / 1000
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.user_id = user_id
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._playlist_ids = itertools.count(1)
+        self.playlist_items = {}  # playlist_id -> [track URI, ...]
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.httpd = ThreadingHTTPServer((host, port), FakeSpotifyHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_rate_limited(self):
+        with self._lock:
+            self.rate_limited += 1
+
+    def next_playlist_id(self):
+        with self._lock:
+            return f"fakeplaylist{next(self._playlist_ids)}"
+
+    def add_playlist_items(self, playlist_id, uris):
+        with self._lock:
+            self.playlist_items.setdefault(playlist_id, []).extend(uris)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeSpotifyProcess:
+    """
+    Runs the run_fake_spotify command in a child process, so serving the
+    fake API does not count towards the time and memory measured in the
+    benchmarking process. Keyword arguments are run_fake_spotify options,
+    e.g. tracks=1000, latency_ms=50. Same base_url, requests, rate_limited
+    and stop() as FakeSpotifyServer.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.base_url = None
+        self._process = None
+
+    def start(self):
+        command = [sys.executable, "-m", "django", "run_fake_spotify", "--port", "0"]
+        for name, value in self.options.items():
+            if value is not None:
+                command += [f"--{name.replace('_', '-')}", str(value)]
+        self._process = subprocess.Popen(
+            command,
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                "DJANGO_SETTINGS_MODULE": os.environ.get(
+                    "DJANGO_SETTINGS_MODULE", "echosorter_project.settings"
+                ),
+            },
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        # The command prints the URL it serves at once it is listening
+        for line in self._process.stdout:
+            match = re.search(r"(http://\S+/v1/)", line)
+            if match:
+                self.base_url = match.group(1)
+                return self
+        self.stop()
+        raise RuntimeError("run_fake_spotify exited before serving.")
+
+    def _stats(self):
+        with urlopen(urljoin(self.base_url, STATS_PATH)) as response:
+            return json.load(response)
+
+    @property
+    def requests(self):
+        return self._stats()["requests"]
+
+    @property
+    def rate_limited(self):
+        return self._stats()["rate_limited"]
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+            self._process.stdout.close()
@@ -1,405 +1,230 @@
-BROAD_GENRE_MAPPING = {
-    "Rock": [
-        "acid rock",
-        "alt country",
-        "alternative rock",
-        "aor",
-        "art rock",
-        "britpop",
-        "celtic rock",
-        "christian alternative rock",
-        "christian rock",
-        "classic rock",
-        "country rock",
-        "funk rock",
-        "glam rock",
-        "garage rock",
-        "grunge",
-        "hard rock",
-        "indie rock",
-        "j-rock",
-        "math rock",
-        "neo-psychedelic",
-        "nu metal",
-        "pop punk",
-        "post-grunge",
-        "post-hardcore",
-        "post-rock",
-        "progressive rock",
-        "proto-punk",
-        "psychedelic rock",
-        "punk",
-        "rap rock",
-        "rock",
-        "rock and roll",
-        "roots rock",
-        "screamo",
-        "shoegaze",
-        "soft rock",
-        "southern rock",
-        "stoner rock",
-        "visual kei",
-        "yacht rock",
-    ],
-    "Pop": [
-        "acoustic pop",
-        "adult standards",
-        "afropop",
-        "alt-pop",
-        "anime",
-        "art pop",
-        "bangla pop",
-        "baroque pop",
-        "bedroom pop",
-        "c-pop",
-        "canzone napoletana",
-        "christian pop",
-        "city pop",
-        "country pop",
-        "dream pop",
-        "eurodance",
-        "europop",
-        "folk pop",
-        "glitch",
-        "gufeng",
-        "gujarati pop",
-        "harana",
-        "haryanvi pop",
-        "hindi pop",
-        "hyperpop",
-        "indie pop",
-        "indonesian pop",
-        "j-pop",
-        "kayokyoku",
-        "k-pop",
-        "kannada pop",
-        "kollywood",
-        "kundiman",
-        "lo-fi",
-        "malayalam pop",
-        "mandopop",
-        "marathi pop",
-        "moroccan pop",
-        "new wave",
-        "nightcore",
-        "norwegian pop",
-        "opm",
-        "p-pop",
-        "pinoy indie",
-        "pop",
-        "pop country",
-        "punjabi pop",
-        "soft pop",
-        "synthpop",
-        "t-pop",
-        "taiwanese pop",
-        "telugu pop",
-        "thai indie pop",
-        "thai pop",
-        "tollywood",
-        "v-pop",
-        "variété française",
-        "vocaloid",
-    ],
-    "Hip Hop / Rap": [
-        "anime rap",
-        "brooklyn drill",
-        "chinese hip hop",
-        "cloud rap",
-        "crunk",
-        "desi hip hop",
-        "drill",
-        "east coast hip hop",
-        "g-funk",
-        "gangster rap",
-        "grime",
-        "hardcore hip hop",
-        "hindi hip hop",
-        "hip hop",
-        "horrorcore",
-        "hyphy",
-        "j-rap",
-        "k-rap",
-        "latin hip hop",
-        "malayalam hip hop",
-        "melodic rap",
-        "mexican hip hop",
-        "new york drill",
-        "old school hip hop",
-        "phonk",
-        "rage rap",
-        "rap",
-        "rap metal",
-        "rap rock",
-        "southern hip hop",
-        "tamil hip hop",
-        "thai hip hop",
-        "thai trap",
-        "trap",
-        "trap latino",
-        "trap metal",
-        "turkish hip hop",
-        "uk drill",
-        "uk grime",
-        "underground hip hop",
-        "west coast hip hop",
-    ],
-    "Electronic / Dance": [
-        "afro house",
-        "ambient",
-        "alternative dance",
-        "big beat",
-        "big room",
-        "breakbeat",
-        "dark ambient",
-        "deathstep",
-        "disco",
-        "drift phonk",
-        "dubstep",
-        "edm",
-        "edm trap",
-        "electro",
-        "electro house",
-        "electronic",
-        "electronica",
-        "eurodance",
-        "future bass",
-        "future house",
-        "french house",
-        "glitch",
-        "hardcore techno",
-        "hardstyle",
-        "house",
-        "idm",
-        "italo dance",
-        "jersey club",
-        "liquid funk",
-        "madchester",
-        "melodic bass",
-        "moombahton",
-        "new age",
-        "progressive house",
-        "psytrance",
-        "slap house",
-        "stutter house",
-        "synthwave",
-        "tamil dance",
-        "trance",
-        "tropical house",
-        "vinahouse",
-    ],
-    "R&B / Soul": [
-        "afro r&b",
-        "afro soul",
-        "alternative r&b",
-        "classic soul",
-        "dark r&b",
-        "doo-wop",
-        "gospel r&b",
-        "j-r&b",
-        "latin r&b",
-        "motown",
-        "neo soul",
-        "new jack swing",
-        "pinoy r&b",
-        "qawwali",
-        "quiet storm",
-        "r&b",
-        "soul",
-        "soul blues",
-        "soul jazz",
-        "trap soul",
-        "worship",
-    ],
-    "Metal": [
-        "alternative metal",
-        "doom metal",
-        "folk metal",
-        "glam metal",
-        "groove metal",
-        "heavy metal",
-        "metal",
-        "metalcore",
-        "nu metal",
-        "symphonic metal",
-        "thrash metal",
-        "trap metal",
-    ],
-    "Country / Folk": [
-        "acoustic country",
-        "alt country",
-        "country",
-        "classic country",
-        "folk",
-        "folk pop",
-        "folk rock",
-        "outlaw country",
-        "pop country",
-        "roots rock",
-        "singer-songwriter",
-        "southern gothic",
-        "traditional folk",
-    ],
-    "Jazz / Blues": [
-        "big band",
-        "blues",
-        "boogie-woogie",
-        "free jazz",
-        "french jazz",
-        "jazz",
-        "jazz blues",
-        "jazz rap",
-        "smooth jazz",
-        "soul jazz",
-        "swing music",
-        "vocal jazz",
-    ],
-    "World": [
-        "afrobeat",
-        "afrobeats",
-        "afropiano",
-        "afropop",
-        "afroswing",
-        "bachata",
-        "bangla pop",
-        "bhangra",
-        "bollywood",
-        "c-pop",
-        "canzone napoletana",
-        "chinese hip hop",
-        "chinese indie",
-        "chinese r&b",
-        "chinese rock",
-        "desi",
-        "desi hip hop",
-        "desi pop",
-        "ghazal",
-        "gufeng",
-        "gujarati garba",
-        "gujarati pop",
-        "harana",
-        "haryanvi pop",
-        "hindi hip hop",
-        "hindi indie",
-        "hindi pop",
-        "indonesian indie",
-        "indonesian pop",
-        "j-pop",
-        "j-r&b",
-        "j-rap",
-        "j-rock",
-        "japanese indie",
-        "k-ballad",
-        "k-pop",
-        "k-rap",
-        "k-rock",
-        "kannada pop",
-        "kayokyoku",
-        "kollywood",
-        "kundiman",
-        "latin",
-        "latin hip hop",
-        "latin r&b",
-        "malayalam hip hop",
-        "malayalam pop",
-        "mandopop",
-        "marathi pop",
-        "mexican hip hop",
-        "mollywood",
-        "moroccan pop",
-        "opm",
-        "p-pop",
-        "pinoy indie",
-        "pinoy r&b",
-        "punjabi pop",
-        "qawwali",
-        "reggaeton",
-        "reggaeton mexa",
-        "sandalwood",
-        "spanish-language reggae",
-        "sufi",
-        "t-pop",
-        "taiwanese indie",
-        "taiwanese pop",
-        "tamil dance",
-        "tamil hip hop",
-        "tamil indie",
-        "tamil pop",
-        "telugu pop",
-        "thai hip hop",
-        "thai indie pop",
-        "thai pop",
-        "thai trap",
-        "tollywood",
-        "turkish hip hop",
-        "urbano latino",
-        "v-pop",
-        "variété française",
-        "vinahouse",
-    ],
-    "Classical / Ambient": [
-        "ambient",
-        "chamber music",
-        "choral",
-        "classical",
-        "classical piano",
-        "dark ambient",
-        "devotional",
-        "gregorian chant",
-        "medieval",
-        "minimalism",
-        "neoclassical",
-        "new age",
-        "opera",
-        "orchestra",
-        "requiem",
-    ],
-    "Soundtrack / Musical": [
-        "musicals",
-        "soundtrack",
-        "japanese vgm",
-    ],
-    "Indie": [
-        "chinese indie",
-        "german indie",
-        "hindi indie",
-        "indie",
-        "indie folk",
-        "indie pop",
-        "indie rock",
-        "indonesian indie",
-        "jangle pop",
-        "japanese indie",
-        "pinoy indie",
-        "taiwanese indie",
-        "tamil indie",
-        "thai indie pop",
-    ],
-    "Miscellaneous": [
-        "emo",
-        "noise music",
-        "shibuya-kei",
-    ],
-}
+import json
+import re
+from collections import deque
+from functools import lru_cache
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
-def map_specific_genres_to_broad(specific_genres):
+
+def build_genre_index(mapping):
+    """
+    Inverts a broad -> [specific, ...] mapping into a lowercased
+    specific -> frozenset(broad) lookup table.
+    """
+    index = {}
+    for broad_category, specific_genre_list in mapping.items():
+        for specific_genre in specific_genre_list:
+            index.setdefault(specific_genre.lower(), set()).add(broad_category)
+    return {genre: frozenset(broads) for genre, broads in index.items()}
+
+
+_GENRE_TOKEN_RE = re.compile(r"[a-z0-9&']+")
+
+
+def tokenize_genre(name):
+    """
+    Splits a genre name into lowercase word tokens ("K-Pop" -> ("k", "pop")).
+    """
+    return tuple(_GENRE_TOKEN_RE.findall(name.lower()))
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over genre tokens. Keywords are token tuples, so
+    they only match whole words: "rock" matches "modern rock" but not
+    "rockabilly". find() scans a genre once, however many keywords there are.
+    """
+
+    def __init__(self, keywords):
+        # Trie of keyword tokens; output holds (keyword length, value) pairs
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for tokens, value in keywords.items():
+            node = 0
+            for token in tokens:
+                if token not in self._goto[node]:
+                    self._goto[node][token] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = self._goto[node][token]
+            self._output[node].append((len(tokens), value))
+
+        # Failure links point at the longest proper suffix that is also a
+        # trie path; outputs of that suffix are inherited.
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(token, 0)
+                self._output[child] = (
+                    self._output[child] + self._output[self._fail[child]]
+                )
+
+    def find(self, tokens):
+        """
+        Returns (start, end, value) for every keyword occurring in `tokens`.
+        """
+        matches = []
+        node = 0
+        for position, token in enumerate(tokens, start=1):
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            for length, value in self._output[node]:
+                matches.append((position - length, position, value))
+        return matches
+
+
+def build_genre_matcher(genre_index):
+    keywords = {}
+    for genre, broads in genre_index.items():
+        tokens = tokenize_genre(genre)
+        if tokens:
+            keywords[tokens] = keywords.get(tokens, frozenset()) | broads
+    return KeywordMatcher(keywords)
+
+
+def read_genre_mapping_file(path=None):
+    """
+    Reads a genre mapping file (settings.GENRE_MAPPING_FILE by default):
+    {"version": N, "broad_genres": {name: {"bit": B, "genres": [...]}}}.
+    Returns (version, {broad: [specific, ...]}, {broad: bit flag}).
+
+    Each broad genre's bit is its flag in Song.broad_genre_mask, so stored
+    masks depend on it: give new categories unused bits and never reassign
+    the bit of an existing one.
+    """
+    path = path or settings.GENRE_MAPPING_FILE
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    try:
+        version = int(data["version"])
+        mapping = {
+            name: list(entry["genres"]) for name, entry in data["broad_genres"].items()
+        }
+        bits = {
+            name: 1 << int(entry["bit"]) for name, entry in data["broad_genres"].items()
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        raise ImproperlyConfigured(f"Invalid genre mapping file {path}: {e!r}")
+    if len(set(bits.values())) != len(bits):
+        raise ImproperlyConfigured(
+            f"Invalid genre mapping file {path}: broad genre bits must be unique."
+        )
+    return version, mapping, bits
+
+
+def load_genre_mapping(path=None):
+    """
+    (Re)loads the genre mapping file into the module-level lookup tables and
+    clears the memoised results. Returns the mapping version.
     """
-    Maps a list of specific Spotify genres to a list of broad genres
-    using the BROAD_GENRE_MAPPING.
+    return install_genre_mapping(*read_genre_mapping_file(path))
+
+
+def install_genre_mapping(version, mapping, bits):
+    """
+    Makes a mapping as returned by read_genre_mapping_file the one used by
+    the module-level lookup tables and clears the memoised results.
+    Returns the mapping version.
+    """
+    global GENRE_MAPPING_VERSION, BROAD_GENRE_MAPPING, BROAD_GENRE_BITS
+    global GENRE_INDEX, GENRE_MATCHER, _BROAD_GENRE_BITS_LOWER
+
+    GENRE_MAPPING_VERSION = version
+    BROAD_GENRE_MAPPING = mapping
+    BROAD_GENRE_BITS = bits
+    GENRE_INDEX = build_genre_index(mapping)
+    GENRE_MATCHER = build_genre_matcher(GENRE_INDEX)
+    _BROAD_GENRE_BITS_LOWER = {name.lower(): bit for name, bit in bits.items()}
+
+    resolve_genre.cache_clear()
+    return version
+
+
+@lru_cache(maxsize=8192)
+def resolve_genre(name):
+    """
+    Resolves one Spotify genre to a sorted list of broad genres, including
+    genres that are not in BROAD_GENRE_MAPPING. Precedence:
+    1. an exact (case-insensitive) mapping entry;
+    2. otherwise every mapped genre found as whole words in the name, where
+       a match inside a longer match is dropped ("modern alternative rock"
+       uses "alternative rock", not "rock"), and the rest are combined.
+    Returns an empty list when nothing matches.
     """
+    exact = GENRE_INDEX.get(name.lower())
+    if exact:
+        return sorted(exact)
+
+    matches = GENRE_MATCHER.find(tokenize_genre(name))
     broad_genres = set()
-    # converting specific genres to lowercase for case-insensitive matching
-    specific_genres_lower = [g.lower() for g in specific_genres]
-
-    # Iterate through the BROAD_GENRE_MAPPING
-    for broad_category, specific_genre_list in BROAD_GENRE_MAPPING.items():
-        # check for existing specific genres in the broad category list
-        normalized_specific_genre_list = [g.lower() for g in specific_genre_list]
-
-        for sg in specific_genres_lower:
-            if sg in normalized_specific_genre_list:
-                broad_genres.add(broad_category)
-                # move on if it already exists
-                break
-    return sorted(list(broad_genres))
+    for start, end, broads in matches:
+        covered = any(
+            other_start <= start
+            and end <= other_end
+            and other_end - other_start > end - start
+            for other_start, other_end, _ in matches
+        )
+        if not covered:
+            broad_genres |= broads
+    return sorted(broad_genres)
+
+
+def map_specific_genres_to_broad(specific_genres):
+    """
+    Maps an iterable of specific Spotify genres to the sorted union of their
+    broad genres, each resolved by resolve_genre().
+    """
+    return sorted(
+        {broad for genre in specific_genres for broad in resolve_genre(genre)}
+    )
+
+
+_GENRE_OPERATOR_RE = re.compile(r"\s+(and|or)\s+", re.IGNORECASE)
+
+
+def broad_genre_mask(broad_genres):
+    """
+    Returns the Song.broad_genre_mask bits for an iterable of broad genre
+    names. Names without a bit are ignored.
+    """
+    mask = 0
+    for name in broad_genres:
+        mask |= BROAD_GENRE_BITS.get(name, 0)
+    return mask
+
+
+def parse_genre_expression(expression):
+    """
+    Parses a broad genre or a combination such as "Rock AND Metal" or
+    "Pop OR Indie" (case-insensitive) into (mask, match_all). match_all is
+    True for AND, i.e. a song needs every genre in the mask. Raises
+    ValueError for unknown genres or for AND and OR in the same expression.
+    """
+    parts = _GENRE_OPERATOR_RE.split(expression.strip())
+    names, operators = parts[::2], {op.lower() for op in parts[1::2]}
+    if len(operators) > 1:
+        raise ValueError("Use either AND or OR between genres, not both.")
+
+    mask = 0
+    for name in names:
+        bit = _BROAD_GENRE_BITS_LOWER.get(name.strip().lower())
+        if bit is None:
+            raise ValueError(f"Unknown genre: '{name.strip()}'")
+        mask |= bit
+    return mask, operators == {"and"}
+
+
+# Compiled once at import; every lookup is a single dict access. Long-running
+# processes reload it when remap_genres applies a new version (see
+# sync.refresh_genre_mapping).
+load_genre_mapping()
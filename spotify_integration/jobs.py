@@ -0,0 +1,184 @@
+import logging
+from datetime import timedelta
+
+import spotipy
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import SyncJob, SpotifyToken
+from .spotify_api import forget_user_spotify_client, get_user_spotify_client
+from .sync import sync_user_library
+from .transport import get_endpoint_stats
+
+logger = logging.getLogger(__name__)
+
+
+def fail_stale_jobs():
+    """
+    Marks running jobs without a heartbeat for SYNC_JOB_STALE_MINUTES as
+    failed: their worker was killed or crashed mid-sync. Returns how many.
+    """
+    cutoff = timezone.now() - timedelta(minutes=settings.SYNC_JOB_STALE_MINUTES)
+    stale_count = (
+        SyncJob.objects.filter(status=SyncJob.STATUS_RUNNING)
+        .filter(
+            # Jobs claimed before heartbeats were recorded only have started_at
+            Q(heartbeat_at__lt=cutoff)
+            | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+        )
+        .update(
+            status=SyncJob.STATUS_FAILED,
+            error="The sync worker stopped responding.",
+            finished_at=timezone.now(),
+        )
+    )
+    if stale_count:
+        logger.warning(f"[SYNC_JOB] Marked {stale_count} stale running jobs as failed.")
+    return stale_count
+
+
+def enqueue_sync(user_id, force_full=False):
+    """
+    Queues a library sync for `user_id` and returns the job. If the user
+    already has a queued or running job, that job is returned instead.
+    """
+    fail_stale_jobs()
+    with transaction.atomic():
+        job = (
+            SyncJob.objects.filter(user_id=user_id, status__in=SyncJob.ACTIVE_STATUSES)
+            .order_by("-created_at")
+            .first()
+        )
+        if job:
+            if (
+                force_full
+                and not job.force_full
+                and job.status == SyncJob.STATUS_QUEUED
+            ):
+                job.force_full = True
+                job.save(update_fields=["force_full"])
+            return job
+        return SyncJob.objects.create(user_id=user_id, force_full=force_full)
+
+
+def start_job(user_id, force_full=False):
+    """
+    Records a sync the caller runs itself (sync_library_async) as a running
+    job, so sync_status reports it and workers leave the user alone, and
+    returns the job. Returns None if the user already has a queued or
+    running job.
+    """
+    fail_stale_jobs()
+    with transaction.atomic():
+        if SyncJob.objects.filter(
+            user_id=user_id, status__in=SyncJob.ACTIVE_STATUSES
+        ).exists():
+            return None
+        started_at = timezone.now()
+        return SyncJob.objects.create(
+            user_id=user_id,
+            force_full=force_full,
+            status=SyncJob.STATUS_RUNNING,
+            started_at=started_at,
+            heartbeat_at=started_at,
+        )
+
+
+def job_progress(job):
+    """
+    Returns a sync progress callback that records the phase, page counts
+    and a heartbeat on the job row.
+    """
+
+    def progress(phase, pages_done, pages_total):
+        fields = {"phase": phase, "heartbeat_at": timezone.now()}
+        if pages_done is not None:
+            fields.update(pages_done=pages_done, pages_total=pages_total)
+        SyncJob.objects.filter(pk=job.pk).update(**fields)
+
+    return progress
+
+
+def finish_job(job, tracks_synced=0, tracks_removed=0, error=None):
+    """
+    Records the final status of a running job: failed with `error` if one
+    is given, succeeded otherwise.
+    """
+    if error is not None:
+        SyncJob.objects.filter(pk=job.pk).update(
+            status=SyncJob.STATUS_FAILED,
+            error=str(error) or type(error).__name__,
+            finished_at=timezone.now(),
+        )
+        return
+    SyncJob.objects.filter(pk=job.pk).update(
+        status=SyncJob.STATUS_SUCCEEDED,
+        phase="done",
+        tracks_synced=tracks_synced,
+        tracks_removed=tracks_removed,
+        finished_at=timezone.now(),
+    )
+
+
+def claim_next_job():
+    """
+    Marks the oldest queued job as running and returns it, or None if the
+    queue is empty. The status-guarded UPDATE makes sure two workers never
+    claim the same job, also on SQLite where select_for_update is a no-op.
+    """
+    fail_stale_jobs()
+    while True:
+        job = (
+            SyncJob.objects.filter(status=SyncJob.STATUS_QUEUED)
+            .order_by("created_at")
+            .first()
+        )
+        if job is None:
+            return None
+
+        started_at = timezone.now()
+        claimed = SyncJob.objects.filter(
+            pk=job.pk, status=SyncJob.STATUS_QUEUED
+        ).update(
+            status=SyncJob.STATUS_RUNNING,
+            started_at=started_at,
+            heartbeat_at=started_at,
+        )
+        if claimed:
+            job.status = SyncJob.STATUS_RUNNING
+            job.started_at = started_at
+            return job
+
+
+def run_job(job):
+    """
+    Runs a claimed job to completion, recording progress on the job row as
+    the sync advances and the final status when it ends.
+    """
+    logger.info(f"[SYNC_JOB] Running job {job.pk} for user {job.user_id}.")
+    try:
+        sp = get_user_spotify_client(job.user_id)
+        if not sp:
+            raise RuntimeError("No stored Spotify token for this user.")
+        tracks_synced, tracks_removed = sync_user_library(
+            job.user_id, sp, force_full=job.force_full, progress=job_progress(job)
+        )
+    except Exception as e:
+        logger.error(f"[SYNC_JOB] Job {job.pk} failed: {e}", exc_info=True)
+        if isinstance(e, spotipy.exceptions.SpotifyException) and e.http_status == 401:
+            logger.warning("Token expired or invalid. Removing stored token.")
+            SpotifyToken.objects.filter(user_id=job.user_id).delete()
+            forget_user_spotify_client(job.user_id)
+        finish_job(job, error=e)
+        return False
+
+    finish_job(job, tracks_synced, tracks_removed)
+    logger.info(
+        f"[SYNC_JOB] Job {job.pk} finished: {tracks_synced} tracks synced, "
+        f"{tracks_removed} removed."
+    )
+    for endpoint, counters in sorted(get_endpoint_stats().items()):
+        logger.info(f"[SYNC_JOB] {endpoint}: {counters}")
+    return True
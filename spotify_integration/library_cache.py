@@ -0,0 +1,72 @@
+import hashlib
+import logging
+
+from django.core.cache import caches
+from django.db.models import F
+
+from .models import LibrarySyncState, UserLibraryEntry
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_CACHE_ALIAS = "library"
+
+
+def get_library_version(user_id):
+    """
+    Returns the current library version of the user, or None before their
+    first sync has finished.
+    """
+    return (
+        LibrarySyncState.objects.filter(user_id=user_id)
+        .values_list("library_version", flat=True)
+        .first()
+    )
+
+
+def bump_library_version(user_id=None):
+    """
+    Invalidates the cached library data of the user, or of every user if
+    `user_id` is None, by moving them to a new version. Old entries are
+    never read again and age out of the cache.
+    """
+    states = LibrarySyncState.objects.all()
+    if user_id is not None:
+        states = states.filter(user_id=user_id)
+    states.update(library_version=F("library_version") + 1)
+
+
+def bump_song_library_versions(song_pks):
+    """
+    Invalidates the cached library data of every user with one of
+    `song_pks` in their library, e.g. after the songs' genres changed.
+    """
+    if not song_pks:
+        return
+    LibrarySyncState.objects.filter(
+        user_id__in=UserLibraryEntry.objects.filter(song_id__in=song_pks).values(
+            "user_id"
+        )
+    ).update(library_version=F("library_version") + 1)
+
+
+def cached_library_data(user_id, key, build):
+    """
+    Returns the value cached for `key` at the user's current library
+    version, calling `build()` and caching its result on a miss. `key` is
+    any string identifying the data within the library, e.g. request
+    parameters. Nothing is cached until the user's first sync finishes,
+    since its pages are committed without a version to bump.
+    """
+    version = get_library_version(user_id)
+    if version is None:
+        return build()
+    digest = hashlib.sha1(f"{user_id}\0{key}".encode()).hexdigest()
+    cache_key = f"library:{version}:{digest}"
+
+    cache = caches[LIBRARY_CACHE_ALIAS]
+    data = cache.get(cache_key)
+    if data is None:
+        logger.debug(f"[LIBRARY_CACHE] Miss for user {user_id} v{version}: {key}")
+        data = build()
+        cache.set(cache_key, data)
+    return data
@@ -0,0 +1,85 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from spotify_integration.genre_utils import (
+    BROAD_GENRE_MAPPING,
+    map_specific_genres_to_broad,
+    resolve_genre,
+)
+
+
+def list_scan_map_specific_genres_to_broad(specific_genres):
+    """
+    The original implementation, kept as the baseline: lowercases every
+    category list on every call and checks list membership.
+    """
+    broad_genres = set()
+    specific_genres_lower = [g.lower() for g in specific_genres]
+    for broad_category, specific_genre_list in BROAD_GENRE_MAPPING.items():
+        normalized_specific_genre_list = [g.lower() for g in specific_genre_list]
+        for sg in specific_genres_lower:
+            if sg in normalized_specific_genre_list:
+                broad_genres.add(broad_category)
+                break
+    return sorted(list(broad_genres))
+
+
+class Command(BaseCommand):
+    help = (
+        "Times map_specific_genres_to_broad, which resolves each genre with "
+        "resolve_genre as the sync does, against the original list-scan "
+        "implementation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--calls", type=int, default=20000, help="Calls per implementation."
+        )
+        parser.add_argument(
+            "--distinct-sets",
+            type=int,
+            default=500,
+            help="Distinct genre sets the calls are drawn from.",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        known_genres = [g for genres in BROAD_GENRE_MAPPING.values() for g in genres]
+        genre_pool = known_genres + [f"unmapped genre {i}" for i in range(100)]
+        genre_sets = [
+            rng.sample(genre_pool, rng.randint(1, 6))
+            for _ in range(options["distinct_sets"])
+        ]
+        calls = [rng.choice(genre_sets) for _ in range(options["calls"])]
+
+        # The baseline only knows exact mapping entries, which resolve_genre
+        # must resolve the same way
+        for genres in genre_sets:
+            expected = list_scan_map_specific_genres_to_broad(genres)
+            resolved = map_specific_genres_to_broad(genres)
+            if resolved != expected:
+                raise CommandError(
+                    f"resolve_genre gives {resolved} for {genres}, "
+                    f"the list scan {expected}."
+                )
+
+        def run(mapper):
+            return min(
+                timeit.repeat(
+                    lambda: [mapper(genres) for genres in calls], number=1, repeat=3
+                )
+            )
+
+        baseline = run(list_scan_map_specific_genres_to_broad)
+        resolve_genre.cache_clear()
+        indexed = run(map_specific_genres_to_broad)
+
+        per_call = 1e6 / options["calls"]
+        self.stdout.write(
+            f"list scan:     {baseline * per_call:8.2f} us/call\n"
+            f"resolve_genre: {indexed * per_call:8.2f} us/call "
+            f"({baseline / indexed:.0f}x faster, {resolve_genre.cache_info().hits} cache hits)"
+        )
@@ -0,0 +1,180 @@
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from spotify_integration.fake_spotify import FakeSpotifyProcess
+from spotify_integration.jobs import claim_next_job, enqueue_sync, run_job
+from spotify_integration.models import SpotifyToken, SyncJob
+from spotify_integration.views import (
+    LIKED_SONGS_MAX_PAGE_SIZE,
+    library_songs,
+    song_listing_rows,
+    song_row_to_dict,
+)
+
+BENCHMARK_USER_ID = "benchmark-user"
+
+
+def model_instance_page(songs, limit):
+    """
+    The previous listing path, kept as the baseline: builds Song, Album,
+    Artist and BroadGenre instances through select_related/prefetch_related
+    and joins the names in Python. Returns (song dicts, last (title, id)).
+    """
+    page = list(
+        songs.select_related("album")
+        .prefetch_related("artists", "broad_genre_set")
+        .order_by("title", "pk")[:limit]
+    )
+    song_dicts = []
+    for song_obj in page:
+        artists_names = [artist.name for artist in song_obj.artists.all()]
+        song_dicts.append(
+            {
+                "title": song_obj.title,
+                "artist": (
+                    ", ".join(artists_names) if artists_names else "Various Artists"
+                ),
+                "album": song_obj.album.name if song_obj.album else "N/A",
+                "id": song_obj.spotify_id,
+                "preview_url": song_obj.preview_url,
+                "image_url": (
+                    song_obj.album.image_url
+                    if song_obj.album and song_obj.album.image_url
+                    else "/static/default_album_art.png"
+                ),
+                "broad_genres": song_obj.broad_genres,
+            }
+        )
+    return song_dicts, (page[-1].title, page[-1].pk) if page else None
+
+
+def values_page(songs, limit):
+    """
+    The current listing path: song_listing_rows tuples with the names
+    aggregated in SQL. Returns (song dicts, last (title, id)).
+    """
+    rows = list(song_listing_rows(songs.order_by("title", "pk")[:limit]))
+    return [song_row_to_dict(row) for row in rows], rows[-1][:2] if rows else None
+
+
+class Command(BaseCommand):
+    help = (
+        "Syncs a synthetic liked-songs library from a local fake Spotify API "
+        "into a throwaway test database, then lists it page by page with the "
+        "previous model-instance query path and with the values()-based one, "
+        "reporting wall time, SQL queries and memory allocated by each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tracks",
+            type=int,
+            default=10000,
+            help="Size of the synthetic liked-songs library.",
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=LIKED_SONGS_MAX_PAGE_SIZE,
+            help="Songs per page; 0 lists the whole library in one page, as "
+            "liked_songs used to.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed for the synthetic library.",
+        )
+
+    def handle(self, *args, **options):
+        server = FakeSpotifyProcess(
+            tracks=options["tracks"], seed=options["seed"]
+        ).start()
+        page_size = options["page_size"] or options["tracks"]
+
+        old_database_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(
+                SPOTIFY_API_URL=server.base_url,
+                SPOTIFY_API_RATE_PER_SECOND=1000,
+                SPOTIFY_API_BURST=1000,
+            ):
+                self.build_fixture(options["tracks"])
+            for label, fetch_page in [
+                ("model instances", model_instance_page),
+                ("values() rows", values_page),
+            ]:
+                self.run_benchmark(label, fetch_page, page_size)
+        finally:
+            server.stop()
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+    def build_fixture(self, track_count):
+        SpotifyToken.objects.create(
+            user_id=BENCHMARK_USER_ID,
+            access_token="fake-access-token",
+            refresh_token="fake-refresh-token",
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        enqueue_sync(BENCHMARK_USER_ID)
+        started = time.perf_counter()
+        job = claim_next_job()
+        if not run_job(job):
+            raise CommandError(
+                f"Fixture sync failed: {SyncJob.objects.get(pk=job.pk).error}"
+            )
+        self.stdout.write(
+            f"Synced {track_count} tracks as the fixture in "
+            f"{time.perf_counter() - started:.1f}s."
+        )
+
+    def run_benchmark(self, label, fetch_page, page_size):
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        songs = library_songs(BENCHMARK_USER_ID)
+        song_count = pages = 0
+        after = None
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            while True:
+                page_songs = songs
+                if after:
+                    after_title, after_pk = after
+                    page_songs = songs.filter(
+                        Q(title__gt=after_title) | Q(title=after_title, pk__gt=after_pk)
+                    )
+                song_dicts, after = fetch_page(page_songs, page_size)
+                if not song_dicts:
+                    break
+                song_count += len(song_dicts)
+                pages += 1
+                if len(song_dicts) < page_size:
+                    break
+        wall_time = time.perf_counter() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{label}: {song_count} songs in {pages} pages, {wall_time:.2f}s, "
+                f"{queries} SQL queries ({queries / max(pages, 1):.1f} per page), "
+                f"peak memory {peak_memory / 2**20:.1f} MiB"
+            )
+        )
@@ -0,0 +1,170 @@
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from spotify_integration.fake_spotify import FakeSpotifyProcess, SyntheticLibrary
+from spotify_integration.jobs import claim_next_job, enqueue_sync, run_job
+from spotify_integration.models import SyncJob, SpotifyToken
+from spotify_integration.transport import get_endpoint_stats
+
+BENCHMARK_USER_ID = "benchmark-user"
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the library sync queued by the Spotify callback against a local "
+        "fake Spotify API and reports wall time, SQL queries and peak memory. "
+        "Uses a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tracks",
+            type=int,
+            default=1000,
+            help="Size of the synthetic liked-songs library (e.g. 1000, 10000, 100000).",
+        )
+        parser.add_argument(
+            "--artists",
+            type=int,
+            default=None,
+            help="Number of distinct artists (default: tracks / 10).",
+        )
+        parser.add_argument(
+            "--zipf-s",
+            type=float,
+            default=1.1,
+            help="Zipf exponent for artist and genre popularity.",
+        )
+        parser.add_argument(
+            "--latency-ms",
+            type=float,
+            default=0,
+            help="Latency added to every fake API response.",
+        )
+        parser.add_argument(
+            "--rate-limit-ratio",
+            type=float,
+            default=0.0,
+            help="Share of fake API requests answered with a 429 (0-1).",
+        )
+        parser.add_argument(
+            "--retry-after",
+            type=int,
+            default=1,
+            help="Retry-After seconds sent with injected 429 responses.",
+        )
+        parser.add_argument(
+            "--rate-per-second",
+            type=float,
+            default=settings.SPOTIFY_API_RATE_PER_SECOND,
+            help="Client-side request budget (SPOTIFY_API_RATE_PER_SECOND).",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed for the synthetic library and 429 injection.",
+        )
+        parser.add_argument(
+            "--initial-only",
+            action="store_true",
+            help="Skip the second, unchanged-library sync.",
+        )
+
+    def handle(self, *args, **options):
+        library = SyntheticLibrary(
+            options["tracks"],
+            artist_count=options["artists"],
+            zipf_s=options["zipf_s"],
+            seed=options["seed"],
+        )
+        # Served from a child process so the fake API's own work is not
+        # part of the measured time and memory
+        server = FakeSpotifyProcess(
+            tracks=options["tracks"],
+            artists=options["artists"],
+            zipf_s=options["zipf_s"],
+            latency_ms=options["latency_ms"],
+            rate_limit_ratio=options["rate_limit_ratio"],
+            retry_after=options["retry_after"],
+            seed=options["seed"],
+        ).start()
+        self.stdout.write(
+            f"Fake Spotify API at {server.base_url}: {library.track_count} tracks, "
+            f"{library.artist_count} artists."
+        )
+
+        old_database_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(
+                SPOTIFY_API_URL=server.base_url,
+                SPOTIFY_API_RATE_PER_SECOND=options["rate_per_second"],
+                SPOTIFY_API_BURST=max(int(options["rate_per_second"]), 1),
+            ):
+                SpotifyToken.objects.create(
+                    user_id=BENCHMARK_USER_ID,
+                    access_token="fake-access-token",
+                    refresh_token="fake-refresh-token",
+                    expires_at=timezone.now() + timedelta(days=1),
+                )
+                runs = ["initial sync"] + (
+                    [] if options["initial_only"] else ["re-sync"]
+                )
+                for label in runs:
+                    self.run_benchmark(label, server)
+        finally:
+            server.stop()
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+        self.stdout.write("API requests per endpoint (client side):")
+        for endpoint, counters in sorted(get_endpoint_stats().items()):
+            self.stdout.write(
+                f"  {endpoint}: {counters['requests']} requests, "
+                f"{counters['rate_limited']} rate limited, {counters['errors']} errors, "
+                f"{counters['seconds']:.2f}s"
+            )
+
+    def run_benchmark(self, label, server):
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        requests_before = server.requests
+        rate_limited_before = server.rate_limited
+        enqueue_sync(BENCHMARK_USER_ID)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            job = claim_next_job()
+            succeeded = run_job(job)
+        wall_time = time.perf_counter() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        job = SyncJob.objects.get(pk=job.pk)
+        if not succeeded:
+            self.stderr.write(self.style.ERROR(f"{label} failed: {job.error}"))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{label}: {job.tracks_synced} tracks in {wall_time:.2f}s, "
+                f"{queries} SQL queries, peak memory {peak_memory / 2**20:.1f} MiB, "
+                f"{server.requests - requests_before} API requests "
+                f"({server.rate_limited - rate_limited_before} rate limited)"
+            )
+        )
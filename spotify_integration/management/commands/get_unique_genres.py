@@ -1,117 +1,183 @@
+import csv
+import json
+
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-import os
+from django.db.models import Count
+
+from spotify_integration.genre_utils import GENRE_INDEX, resolve_genre
+from spotify_integration.models import SpecificGenre, SpotifyToken
+from spotify_integration.spotify_api import (
+    fetch_artist_details,
+    get_user_spotify_client,
+    iter_saved_track_pages,
+)
+
+FIELDS = ["genre", "artists", "songs", "mapped", "broad_genres"]
 
 
 class Command(BaseCommand):
-    help = "Fetches all unique genres from artists associated with liked songs and prints them."
+    help = (
+        "Lists the unique specific genres of stored artists with artist and song "
+        "counts, whether each is in the genre mapping and the broad genres it "
+        "resolves to. Reads the local DB unless --from-api is given."
+    )
 
-    def handle(self, *args, **options):
-        self.stdout.write(
-            self.style.WARNING(
-                "Ensure you have authenticated with Spotify via the web interface at least once."
-            )
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            help="Only count this Spotify user's liked songs (required for --from-api "
+            "when more than one user has a stored token).",
         )
-        self.stdout.write(
-            self.style.WARNING(
-                "This command requires a cached token ('local_tokes.json')."
-            )
+        parser.add_argument(
+            "--format",
+            choices=["text", "json", "csv"],
+            default="text",
+            help="Output format.",
         )
-
-        sp_oauth = SpotifyOAuth(
-            client_id=settings.SPOTIPY_CLIENT_ID,
-            client_secret=settings.SPOTIPY_CLIENT_SECRET,
-            redirect_uri=settings.SPOTIPY_REDIRECT_URI,
-            scope="user-library-read",  # Only need this scope
-            cache_path="local_tokes.json",  # Ensure this matches where your token is saved
+        parser.add_argument(
+            "--from-api",
+            action="store_true",
+            help="Fetch the liked songs and artists from Spotify with the user's "
+            "stored token instead of reading the local DB.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.SPOTIFY_API_CONCURRENCY,
+            help="Number of Spotify requests (track pages, artist batches) issued in parallel.",
         )
 
-        token_info = sp_oauth.get_cached_token()
+    def handle(self, *args, **options):
+        if options["from_api"]:
+            counts = self.count_from_api(options["user"], options["concurrency"])
+        else:
+            counts = self.count_from_db(options["user"])
 
-        if not token_info:
-            raise CommandError(
-                "No cached Spotify token found. Please run your Django app in the browser, "
-                "connect with Spotify, and complete the authentication flow first. "
-                f"Then run this command again. Authorization URL: {sp_oauth.get_authorize_url()}"
-            )
+        rows = [
+            {
+                "genre": genre,
+                "artists": artists,
+                "songs": songs,
+                "mapped": genre.lower() in GENRE_INDEX,
+                "broad_genres": resolve_genre(genre),
+            }
+            for genre, (artists, songs) in sorted(counts.items())
+        ]
+        getattr(self, f"write_{options['format']}")(rows)
 
-        sp = spotipy.Spotify(auth_manager=sp_oauth)
+    def count_from_db(self, user_id):
+        """
+        Returns {genre: (artist_count, song_count)} from the local tables,
+        limited to the user's library if `user_id` is given.
+        """
+        genres = SpecificGenre.objects.all()
+        if user_id:
+            genres = genres.filter(
+                artists_link__songs_link__library_entries__user_id=user_id
+            )
+        return {
+            name: (artist_count, song_count)
+            for name, artist_count, song_count in genres.annotate(
+                artist_count=Count("artists_link", distinct=True),
+                song_count=Count("artists_link__songs_link", distinct=True),
+            ).values_list("name", "artist_count", "song_count")
+        }
 
-        self.stdout.write(
-            self.style.SUCCESS("Fetching liked songs and collecting artist IDs...")
-        )
-        all_unique_artist_ids = set()
-
-        results = sp.current_user_saved_tracks(limit=50)  # Start with 50 tracks
-        while results:
-            for item in results["items"]:
-                track = item["track"]
-                for artist in track["artists"]:
-                    all_unique_artist_ids.add(artist["id"])
-            if results["next"]:
-                results = sp.next(results)  # Go to next page of results
-            else:
-                results = None  # No more pages
+    def count_from_api(self, user_id, concurrency):
+        """
+        Returns {genre: (artist_count, song_count)} for the user's liked
+        songs as currently on Spotify, using their stored SpotifyToken.
+        """
+        if not user_id:
+            user_ids = list(SpotifyToken.objects.values_list("user_id", flat=True)[:2])
+            if len(user_ids) != 1:
+                raise CommandError(
+                    "Pass --user: --from-api needs exactly one user with a stored token."
+                )
+            user_id = user_ids[0]
 
-        self.stdout.write(
-            self.style.SUCCESS(
-                f"Found {len(all_unique_artist_ids)} unique artists from your liked songs."
+        sp = get_user_spotify_client(user_id)
+        if not sp:
+            raise CommandError(
+                f"No stored Spotify token for user '{user_id}'. Log in through the web "
+                "interface first."
             )
-        )
-        self.stdout.write(
-            self.style.SUCCESS(
-                "Fetching genres for these artists (this might take a moment if you have many unique artists)..."
+
+        self.stderr.write(f"Fetching liked songs of user {user_id} from Spotify...")
+        track_artist_ids = []
+        try:
+            for page in iter_saved_track_pages(sp, max_workers=concurrency):
+                for item in page["items"]:
+                    if item["track"]:
+                        track_artist_ids.append(
+                            {artist["id"] for artist in item["track"]["artists"]}
+                        )
+
+            all_artist_ids = set().union(*track_artist_ids)
+            self.stderr.write(f"Fetching genres for {len(all_artist_ids)} artists...")
+            artist_fetch = fetch_artist_details(
+                sp, all_artist_ids, max_workers=concurrency
             )
-        )
+        except spotipy.exceptions.SpotifyException as e:
+            raise CommandError(
+                f"Spotify API error: {e}. If the token was revoked, log in through "
+                "the web interface again."
+            ) from e
 
-        all_unique_genres = set()
-        artist_ids_list = list(all_unique_artist_ids)
-        batch_size = 50  # Spotify API allows up to 50 artists per request
-
-        for i in range(0, len(artist_ids_list), batch_size):
-            batch = artist_ids_list[i : i + batch_size]
-            try:
-                artists_details = sp.artists(batch)
-                for artist_detail in artists_details["artists"]:
-                    if artist_detail and "genres" in artist_detail:
-                        for genre in artist_detail["genres"]:
-                            all_unique_genres.add(genre)
-            except spotipy.exceptions.SpotifyException as e:
-                self.stderr.write(
-                    self.style.ERROR(
-                        f"Error fetching artist details for batch (index {i}): {e}"
-                    )
-                )
-                if e.http_status == 401:
-                    raise CommandError(
-                        "Spotify token expired or invalid during artist fetch. Please re-authenticate your app in the browser and try again."
-                    )
-                # Continue processing other batches even if one fails
-            except Exception as e:
-                self.stderr.write(
-                    self.style.ERROR(
-                        f"An unexpected error occurred while processing artist batch (index {i}): {e}"
-                    )
+        # Continue processing other batches even if one fails
+        for batch_start, error in artist_fetch.failed_batches:
+            self.stderr.write(
+                self.style.ERROR(
+                    f"Error fetching artist details for batch (index {batch_start}): {error}"
                 )
+            )
 
-        self.stdout.write(
-            self.style.SUCCESS(
-                f"\n--- Found {len(all_unique_genres)} Unique Specific Genres ---"
+        genres_by_artist = {
+            artist_id: set(detail.get("genres", []))
+            for artist_id, detail in artist_fetch.artists.items()
+        }
+        artist_counts = {}
+        for genres in genres_by_artist.values():
+            for genre in genres:
+                artist_counts[genre] = artist_counts.get(genre, 0) + 1
+        song_counts = {}
+        for artist_ids in track_artist_ids:
+            for genre in set().union(
+                *(genres_by_artist.get(a, ()) for a in artist_ids)
+            ):
+                song_counts[genre] = song_counts.get(genre, 0) + 1
+
+        return {
+            genre: (artist_count, song_counts.get(genre, 0))
+            for genre, artist_count in artist_counts.items()
+        }
+
+    def write_json(self, rows):
+        self.stdout.write(json.dumps(rows, indent=2))
+
+    def write_csv(self, rows):
+        writer = csv.DictWriter(self.stdout, fieldnames=FIELDS, lineterminator="\n")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, "broad_genres": "; ".join(row["broad_genres"])})
+
+    def write_text(self, rows):
+        for row in rows:
+            mark = "=" if row["mapped"] else ("~" if row["broad_genres"] else " ")
+            self.stdout.write(
+                f"{mark} {row['genre']:<40} {row['artists']:>6} artists "
+                f"{row['songs']:>7} songs  {', '.join(row['broad_genres']) or '-'}"
             )
-        )
-        sorted_genres = sorted(list(all_unique_genres))
-        for genre in sorted_genres:
-            self.stdout.write(genre)
 
+        mapped = sum(row["mapped"] for row in rows)
+        matched = sum(bool(row["broad_genres"]) and not row["mapped"] for row in rows)
         self.stdout.write(
             self.style.SUCCESS(
-                "\nCopy the list above. Use it to manually define your BROAD_GENRE_MAPPING dictionary."
-            )
-        )
-        self.stdout.write(
-            self.style.WARNING(
-                "Remember to turn your firewall back on after getting the genres!"
+                f"\n{len(rows)} unique specific genres: {mapped} in the mapping (=), "
+                f"{matched} matched by keyword (~), {len(rows) - mapped - matched} "
+                "unmapped. Add unmapped genres to the genre mapping file and run "
+                "remap_genres."
             )
         )
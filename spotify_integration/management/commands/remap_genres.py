@@ -0,0 +1,124 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from spotify_integration import genre_utils
+from spotify_integration.library_cache import bump_library_version
+from spotify_integration.models import GenreMappingVersion, Song, SpecificGenre
+from spotify_integration.sync import (
+    chunked,
+    link_specific_genres,
+    materialize_song_genres,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Applies the genre mapping file (GENRE_MAPPING_FILE) to the stored "
+        "genres. Only specific genres whose broad genres change are re-linked "
+        "and only songs by artists with those genres are recomputed. Makes no "
+        "Spotify calls."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-check every stored genre even if this version is already applied.",
+        )
+
+    def handle(self, *args, **options):
+        version = genre_utils.load_genre_mapping()
+        applied = GenreMappingVersion.objects.order_by("-applied_at").first()
+        if applied and not options["force"]:
+            if applied.version == version:
+                self.stdout.write(
+                    f"Genre mapping v{version} is already applied. "
+                    "Use --force to re-check every genre anyway."
+                )
+                return
+            if applied.version > version:
+                raise CommandError(
+                    f"The mapping file is v{version} but v{applied.version} is "
+                    "applied. Use --force to apply the older mapping."
+                )
+
+        if applied:
+            self.stdout.write(
+                f"Applying genre mapping v{applied.version} -> v{version}:"
+            )
+            self.write_mapping_diff(applied.mapping, genre_utils.BROAD_GENRE_MAPPING)
+        else:
+            self.stdout.write(f"Applying genre mapping v{version}.")
+
+        # Diff each stored genre's links against its new resolution
+        stored_links = {
+            name: set() for name in SpecificGenre.objects.values_list("name", flat=True)
+        }
+        for name, broad_name in SpecificGenre.broad_genres.through.objects.values_list(
+            "specificgenre__name", "broadgenre__name"
+        ):
+            stored_links[name].add(broad_name)
+        changed_genres = [
+            name
+            for name, broad_names in stored_links.items()
+            if set(genre_utils.resolve_genre(name)) != broad_names
+        ]
+
+        for batch in chunked(changed_genres):
+            with transaction.atomic():
+                link_specific_genres(batch, relink=True)
+        self.stdout.write(
+            f"Re-linked {len(changed_genres)} of {len(stored_links)} specific genres."
+        )
+
+        # Masks of every song depend on the bits of existing broad genres
+        bits_changed = applied is not None and any(
+            applied.bits.get(name, bit) != bit
+            for name, bit in genre_utils.BROAD_GENRE_BITS.items()
+        )
+        if bits_changed:
+            song_pks = Song.objects.values_list("pk", flat=True)
+        else:
+            song_pks = set()
+            for batch in chunked(changed_genres):
+                song_pks.update(
+                    Song.artists.through.objects.filter(
+                        artist__genres__name__in=batch
+                    ).values_list("song_id", flat=True)
+                )
+
+        added_count = removed_count = 0
+        for batch in chunked(song_pks):
+            with transaction.atomic():
+                added, removed, _ = materialize_song_genres(batch)
+            added_count += added
+            removed_count += removed
+
+        GenreMappingVersion.objects.filter(version=version).delete()
+        GenreMappingVersion.objects.create(
+            version=version,
+            mapping=genre_utils.BROAD_GENRE_MAPPING,
+            bits=genre_utils.BROAD_GENRE_BITS,
+        )
+        # Cached liked songs pages show the old genres
+        bump_library_version()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Genre mapping v{version} applied. Song broad genres updated: "
+                f"{added_count} added, {removed_count} removed."
+            )
+        )
+
+    def write_mapping_diff(self, old_mapping, new_mapping):
+        for name in sorted(old_mapping.keys() | new_mapping.keys()):
+            old_genres = set(old_mapping.get(name, []))
+            new_genres = set(new_mapping.get(name, []))
+            if name not in old_mapping:
+                self.stdout.write(f"  + {name} ({len(new_genres)} genres)")
+            elif name not in new_mapping:
+                self.stdout.write(f"  - {name}")
+            elif old_genres != new_genres:
+                self.stdout.write(
+                    f"  ~ {name}: +{len(new_genres - old_genres)} "
+                    f"-{len(old_genres - new_genres)} genres"
+                )
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from spotify_integration.fake_spotify import FakeSpotifyServer, SyntheticLibrary
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves a synthetic Spotify Web API locally. Set SPOTIFY_API_URL to the "
+        "printed URL to run the app or the sync worker against it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--tracks", type=int, default=1000)
+        parser.add_argument("--artists", type=int, default=None)
+        parser.add_argument("--zipf-s", type=float, default=1.1)
+        parser.add_argument("--latency-ms", type=float, default=0)
+        parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+        parser.add_argument("--retry-after", type=int, default=1)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        library = SyntheticLibrary(
+            options["tracks"],
+            artist_count=options["artists"],
+            zipf_s=options["zipf_s"],
+            seed=options["seed"],
+        )
+        server = FakeSpotifyServer(
+            library,
+            port=options["port"],
+            latency_ms=options["latency_ms"],
+            rate_limit_ratio=options["rate_limit_ratio"],
+            retry_after=options["retry_after"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Fake Spotify API serving {library.track_count} tracks at "
+                f"{server.base_url} (Ctrl+C to stop)."
+            )
+        )
+        # FakeSpotifyProcess reads the URL from a pipe
+        self.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
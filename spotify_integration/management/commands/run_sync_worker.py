@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from spotify_integration.jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Claims and runs queued library sync jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS("Sync worker started."))
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(f"Running sync job {job.pk} for user {job.user_id}...")
+            if run_job(job):
+                self.stdout.write(self.style.SUCCESS(f"Job {job.pk} succeeded."))
+            else:
+                self.stderr.write(self.style.ERROR(f"Job {job.pk} failed."))
+
+        self.stdout.write(self.style.SUCCESS("Sync queue is empty. Exiting."))
@@ -0,0 +1,164 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from spotify_integration.jobs import claim_next_job, enqueue_sync, run_job
+from spotify_integration.models import LibrarySyncState, SpotifyToken
+from spotify_integration.transport import SharedWindowBudget, install_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker(budget):
+    django.setup()
+    install_rate_limiter(budget)
+
+
+def _run_queued_jobs():
+    """
+    Runs in a pool process: claims and runs queued sync jobs until the queue
+    is empty. Returns (succeeded, failed).
+    """
+    succeeded = failed = 0
+    while True:
+        job = claim_next_job()
+        if job is None:
+            break
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+    connections.close_all()
+    return succeeded, failed
+
+
+def stale_user_ids(max_age, limit=None):
+    """
+    Returns the IDs of users with a stored token whose library was last
+    synced more than `max_age` ago, never-synced users first, then the
+    stalest.
+    """
+    synced_at = LibrarySyncState.objects.filter(user_id=OuterRef("user_id")).values(
+        "synced_at"
+    )[:1]
+    users = (
+        SpotifyToken.objects.annotate(synced_at=Subquery(synced_at))
+        .filter(Q(synced_at__isnull=True) | Q(synced_at__lt=timezone.now() - max_age))
+        .order_by(F("synced_at").asc(nulls_first=True), "user_id")
+        .values_list("user_id", flat=True)
+    )
+    return list(users[:limit] if limit else users)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-syncs the libraries of all users with a stored Spotify token, "
+        "stalest first, across a pool of worker processes that share one "
+        "Spotify request budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="Number of worker processes running syncs in parallel.",
+        )
+        parser.add_argument(
+            "--max-age-hours",
+            type=float,
+            default=12,
+            help="Only sync libraries last synced longer ago than this.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Sync at most this many users per round.",
+        )
+        parser.add_argument(
+            "--budget-window",
+            type=float,
+            default=30,
+            help="Length in seconds of the shared request budget window.",
+        )
+        parser.add_argument(
+            "--budget",
+            type=int,
+            default=None,
+            help="Spotify requests allowed per window across all workers "
+            "(default: SPOTIFY_API_RATE_PER_SECOND x window).",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, starting a new round every --interval seconds.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=900,
+            help="Seconds between rounds with --loop.",
+        )
+
+    def handle(self, *args, **options):
+        window = options["budget_window"]
+        budget = SharedWindowBudget(
+            options["budget"] or int(settings.SPOTIFY_API_RATE_PER_SECOND * window),
+            window,
+        )
+        self.stdout.write(
+            f"Shared budget: {budget.limit} Spotify requests per {window:g}s "
+            f"across {options['workers']} workers."
+        )
+
+        while True:
+            self.run_round(options, budget)
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
+
+    def run_round(self, options, budget):
+        user_ids = stale_user_ids(
+            timedelta(hours=options["max_age_hours"]), options["limit"]
+        )
+        if not user_ids:
+            self.stdout.write("All libraries are fresh.")
+            return
+
+        for user_id in user_ids:
+            enqueue_sync(user_id)
+        self.stdout.write(f"Queued syncs for {len(user_ids)} users, stalest first.")
+
+        # Pool processes must open their own DB connections
+        connections.close_all()
+        started = time.monotonic()
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            initializer=_init_worker,
+            initargs=(budget,),
+        ) as pool:
+            results = [
+                future.result()
+                for future in [
+                    pool.submit(_run_queued_jobs) for _ in range(options["workers"])
+                ]
+            ]
+
+        succeeded = sum(r[0] for r in results)
+        failed = sum(r[1] for r in results)
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(
+            style(
+                f"Round finished in {time.monotonic() - started:.1f}s: "
+                f"{succeeded} syncs succeeded, {failed} failed."
+            )
+        )
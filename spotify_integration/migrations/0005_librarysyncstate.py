@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0004_spotifytoken"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LibrarySyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("user_id", models.CharField(max_length=255, unique=True)),
+                ("last_added_at", models.DateTimeField(blank=True, null=True)),
+                ("library_total", models.PositiveIntegerField(default=0)),
+                ("synced_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
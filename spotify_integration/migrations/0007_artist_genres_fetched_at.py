@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0006_syncjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artist",
+            name="genres_fetched_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
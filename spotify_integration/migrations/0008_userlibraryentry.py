@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_song_owners(apps, schema_editor):
+    # Songs were owned through Song.user_id; keep them in that user's library
+    Song = apps.get_model("spotify_integration", "Song")
+    UserLibraryEntry = apps.get_model("spotify_integration", "UserLibraryEntry")
+    UserLibraryEntry.objects.bulk_create(
+        [
+            UserLibraryEntry(user_id=user_id, song_id=song_id)
+            for song_id, user_id in Song.objects.exclude(user_id__isnull=True)
+            .exclude(user_id="")
+            .values_list("pk", "user_id")
+            .iterator()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0007_artist_genres_fetched_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserLibraryEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("user_id", models.CharField(max_length=255)),
+                ("added_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "song",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="library_entries",
+                        to="spotify_integration.song",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user_id", "song"), name="unique_user_library_entry"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(copy_song_owners, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="song",
+            name="user_id",
+        ),
+    ]
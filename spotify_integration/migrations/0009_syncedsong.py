@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0008_userlibraryentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncedSong",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sync_id", models.UUIDField()),
+                (
+                    "song",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="spotify_integration.song",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("sync_id", "song"), name="unique_synced_song"
+                    )
+                ],
+            },
+        ),
+    ]
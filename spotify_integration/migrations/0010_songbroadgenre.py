@@ -0,0 +1,78 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def materialize_song_genres(apps, schema_editor):
+    # Same derivation as sync.materialize_song_genres() for existing songs
+    Song = apps.get_model("spotify_integration", "Song")
+    SongBroadGenre = apps.get_model("spotify_integration", "SongBroadGenre")
+    pairs = (
+        Song.artists.through.objects.filter(artist__genres__broad_genres__isnull=False)
+        .values_list("song_id", "artist__genres__broad_genres")
+        .distinct()
+        .iterator()
+    )
+    SongBroadGenre.objects.bulk_create(
+        [
+            SongBroadGenre(song_id=song_id, broad_genre_id=broad_genre_id)
+            for song_id, broad_genre_id in pairs
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0009_syncedsong"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SongBroadGenre",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "broad_genre",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="spotify_integration.broadgenre",
+                    ),
+                ),
+                (
+                    "song",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="spotify_integration.song",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="song",
+            name="broad_genre_set",
+            field=models.ManyToManyField(
+                related_name="songs",
+                through="spotify_integration.SongBroadGenre",
+                to="spotify_integration.broadgenre",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="songbroadgenre",
+            constraint=models.UniqueConstraint(
+                fields=("song", "broad_genre"), name="unique_song_broad_genre"
+            ),
+        ),
+        migrations.RunPython(materialize_song_genres, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:55
+
+from django.db import migrations, models
+
+# Bits of the broad genres when this migration was written; later mappings
+# are applied by the remap_genres command
+BROAD_GENRE_BITS = {
+    name: 1 << bit
+    for bit, name in enumerate(
+        [
+            "Rock",
+            "Pop",
+            "Hip Hop / Rap",
+            "Electronic / Dance",
+            "R&B / Soul",
+            "Metal",
+            "Country / Folk",
+            "Jazz / Blues",
+            "World",
+            "Classical / Ambient",
+            "Soundtrack / Musical",
+            "Indie",
+            "Miscellaneous",
+        ]
+    )
+}
+
+
+def fill_broad_genre_masks(apps, schema_editor):
+    Song = apps.get_model("spotify_integration", "Song")
+    SongBroadGenre = apps.get_model("spotify_integration", "SongBroadGenre")
+    masks = {}
+    for song_id, name in SongBroadGenre.objects.values_list(
+        "song_id", "broad_genre__name"
+    ).iterator():
+        masks[song_id] = masks.get(song_id, 0) | BROAD_GENRE_BITS.get(name, 0)
+    Song.objects.bulk_update(
+        [Song(pk=song_id, broad_genre_mask=mask) for song_id, mask in masks.items()],
+        ["broad_genre_mask"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0010_songbroadgenre"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="song",
+            name="broad_genre_mask",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_broad_genre_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-16 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0011_song_broad_genre_mask"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GenreMappingVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField(unique=True)),
+                ("mapping", models.JSONField()),
+                ("bits", models.JSONField()),
+                ("applied_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
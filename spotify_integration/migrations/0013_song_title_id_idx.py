@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-16 21:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0012_genremappingversion"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="song",
+            index=models.Index(fields=["title", "id"], name="song_title_id_idx"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 21:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0013_song_title_id_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="librarysyncstate",
+            name="library_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0014_librarysyncstate_library_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("spotify_integration", "0015_syncjob_heartbeat_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncjob",
+            name="tracks_removed",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
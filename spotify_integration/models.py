@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class BroadGenre(models.Model):
@@ -24,6 +25,9 @@ class Artist(models.Model):
     name = models.CharField(max_length=200)
 
     genres = models.ManyToManyField(SpecificGenre, related_name="artists_link")
+    # When `genres` was last fetched from Spotify; null for artists only
+    # known from a track payload
+    genres_fetched_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -47,21 +51,85 @@ class Song(models.Model):
         Album, on_delete=models.CASCADE, related_name="songs_on_album"
     )
     preview_url = models.URLField(max_length=500, blank=True, null=True)
-    user_id = models.CharField(max_length=100, null=True, blank=True)
+    # Broad genres of the song's artists, materialized by the sync and by
+    # the remap_genres command
+    broad_genre_set = models.ManyToManyField(
+        BroadGenre, through="SongBroadGenre", related_name="songs"
+    )
+    # The same genres as genre_utils.BROAD_GENRE_BITS flags, for bitwise
+    # genre-set filters in SQL. Not indexed: `mask & X` predicates are
+    # evaluated per row and cannot use an index.
+    broad_genre_mask = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        # Keyset pagination of the liked songs list orders by (title, id)
+        indexes = [models.Index(fields=["title", "id"], name="song_title_id_idx")]
 
     def __str__(self):
         return self.title
 
     @property
     def broad_genres(self):
-        from .genre_utils import map_specific_genres_to_broad
+        return sorted(broad_genre.name for broad_genre in self.broad_genre_set.all())
+
+
+class SongBroadGenre(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    broad_genre = models.ForeignKey(BroadGenre, on_delete=models.CASCADE)
 
-        all_specific_genres = set()
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["song", "broad_genre"], name="unique_song_broad_genre"
+            )
+        ]
+
+
+class UserLibraryEntry(models.Model):
+    # A song in one user's liked songs; songs, albums and artists are shared
+    user_id = models.CharField(max_length=255)
+    song = models.ForeignKey(
+        Song, on_delete=models.CASCADE, related_name="library_entries"
+    )
+    added_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "song"], name="unique_user_library_entry"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.song_id}"
+
+
+class SyncedSong(models.Model):
+    # Songs seen by a running sync, staged in the DB so unliked songs can be
+    # removed with an anti-join; cleared when the sync ends
+    sync_id = models.UUIDField()
+    song = models.ForeignKey(
+        Song, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+"
+    )
 
-        for artist in self.artists.all():
-            for specific_genre in artist.genres.all():
-                all_specific_genres.add(specific_genre.name)
-        return map_specific_genres_to_broad(list(all_specific_genres))
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["sync_id", "song"], name="unique_synced_song"
+            )
+        ]
+
+
+class GenreMappingVersion(models.Model):
+    # Genre mapping file versions applied to the stored genre links by
+    # remap_genres, with a snapshot of each mapping to diff against
+    version = models.PositiveIntegerField(unique=True)
+    mapping = models.JSONField()
+    bits = models.JSONField()
+    applied_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Genre mapping v{self.version}"
 
 
 class SpotifyToken(models.Model):
@@ -69,3 +137,66 @@ class SpotifyToken(models.Model):
     access_token = models.TextField()
     refresh_token = models.TextField()
     expires_at = models.DateTimeField()
+
+
+class LibrarySyncState(models.Model):
+    # Newest `added_at` and library total seen by the user's last sync
+    user_id = models.CharField(max_length=255, unique=True)
+    last_added_at = models.DateTimeField(null=True, blank=True)
+    library_total = models.PositiveIntegerField(default=0)
+    synced_at = models.DateTimeField(auto_now=True)
+    # Bumped whenever the user's songs or their genres may have changed;
+    # part of every library_cache key
+    library_version = models.PositiveIntegerField(default=0)
+
+
+class SyncJob(models.Model):
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    user_id = models.CharField(max_length=255, db_index=True)
+    force_full = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True
+    )
+    phase = models.CharField(max_length=50, blank=True)
+    pages_done = models.PositiveIntegerField(default=0)
+    pages_total = models.PositiveIntegerField(null=True, blank=True)
+    tracks_synced = models.PositiveIntegerField(default=0)
+    # Songs removed from the user's library because they are no longer liked
+    tracks_removed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Touched by the worker on claim and on every progress report; running
+    # jobs without a recent heartbeat belong to a dead worker
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Sync for {self.user_id} ({self.status})"
+
+    @property
+    def eta_seconds(self):
+        """
+        Estimated seconds left, extrapolated from the pages fetched so far.
+        """
+        if (
+            self.status != self.STATUS_RUNNING
+            or not self.started_at
+            or not self.pages_done
+            or not self.pages_total
+        ):
+            return None
+        elapsed = (timezone.now() - self.started_at).total_seconds()
+        pages_left = max(self.pages_total - self.pages_done, 0)
+        return round(elapsed / self.pages_done * pages_left)
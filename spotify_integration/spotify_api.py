@@ -0,0 +1,315 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import timedelta
+
+import spotipy
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from spotipy.oauth2 import SpotifyOAuth
+
+from .models import SpotifyToken
+from .transport import get_spotify_client, get_transport
+
+logger = logging.getLogger(__name__)
+
+# Spotify allows up to 50 IDs per GET /artists request.
+ARTIST_BATCH_SIZE = 50
+
+# Maximum page size for GET /me/tracks.
+SAVED_TRACKS_PAGE_SIZE = 50
+
+# Cached clients are dropped, and tokens refreshed, this long before expiry.
+TOKEN_EXPIRY_MARGIN = timedelta(seconds=60)
+
+_client_cache = {}  # user_id -> (spotipy client, access token, expires_at)
+_client_locks = {}  # user_id -> threading.Lock serialising loads/refreshes
+_client_cache_lock = threading.Lock()
+
+
+def get_spotify_auth():
+    return SpotifyOAuth(
+        client_id=settings.SPOTIPY_CLIENT_ID,
+        client_secret=settings.SPOTIPY_CLIENT_SECRET,
+        redirect_uri=settings.SPOTIPY_REDIRECT_URI,
+        scope="user-library-read playlist-modify-private playlist-modify-public",
+        requests_session=get_transport(),
+    )
+
+
+def _refresh_stored_token(user_id):
+    """
+    Refreshes the user's access token under a row lock. Another process may
+    have refreshed it while we waited for the lock, in which case its token
+    is used as is. Returns the up-to-date SpotifyToken, or None.
+    """
+    with transaction.atomic():
+        token = SpotifyToken.objects.select_for_update().filter(user_id=user_id).first()
+        if token is None or token.expires_at > timezone.now() + TOKEN_EXPIRY_MARGIN:
+            return token
+
+        logger.info(f"[TOKEN] Refreshing access token for user {user_id}.")
+        sp_oauth = get_spotify_auth()
+        refreshed_token = sp_oauth.refresh_access_token(token.refresh_token)
+
+        token.access_token = refreshed_token["access_token"]
+        token.expires_at = timezone.now() + timedelta(
+            seconds=refreshed_token["expires_in"]
+        )
+        update_fields = ["access_token", "expires_at"]
+        # Spotify may rotate the refresh token as well
+        if refreshed_token.get("refresh_token"):
+            token.refresh_token = refreshed_token["refresh_token"]
+            update_fields.append("refresh_token")
+        token.save(update_fields=update_fields)
+        return token
+
+
+def get_user_spotify_client(user_id):
+    """
+    Returns a Spotipy client for the given user_id.
+    Refreshes token if expired.
+
+    Clients are cached in memory until shortly before their token expires,
+    so hot request paths skip the token query. Refreshes are single-flight:
+    one per user within the process (per-user lock) and across processes
+    (row lock in _refresh_stored_token).
+    """
+    cached = _client_cache.get(user_id)
+    if cached and cached[2] > timezone.now() + TOKEN_EXPIRY_MARGIN:
+        return cached[0]
+
+    with _client_cache_lock:
+        user_lock = _client_locks.setdefault(user_id, threading.Lock())
+
+    with user_lock:
+        # Another thread may have loaded the client while we waited
+        cached = _client_cache.get(user_id)
+        if cached and cached[2] > timezone.now() + TOKEN_EXPIRY_MARGIN:
+            return cached[0]
+
+        token = SpotifyToken.objects.filter(user_id=user_id).first()
+        if token is None:
+            return None
+
+        # If token expired → refresh
+        if token.expires_at <= timezone.now() + TOKEN_EXPIRY_MARGIN:
+            token = _refresh_stored_token(user_id)
+            if token is None:
+                return None
+
+        client = get_spotify_client(auth=token.access_token)
+        _client_cache[user_id] = (client, token.access_token, token.expires_at)
+        return client
+
+
+def get_user_access_token(user_id):
+    """
+    Returns a valid access token for `user_id`, refreshing it through the
+    same cache as get_user_spotify_client(), or None if there is no token.
+    """
+    if get_user_spotify_client(user_id) is None:
+        return None
+    cached = _client_cache.get(user_id)
+    return cached[1] if cached else None
+
+
+def forget_user_spotify_client(user_id):
+    """
+    Drops the cached client for `user_id`; call after its token is replaced
+    or deleted.
+    """
+    _client_cache.pop(user_id, None)
+
+
+class ArtistFetchResult:
+    """
+    Outcome of fetch_artist_details(): merged artist payloads plus per-batch
+    timing and the batches that had to be skipped.
+    """
+
+    def __init__(self):
+        self.artists = {}  # spotify_id -> artist payload
+        self.batch_latencies = []  # (batch_start, seconds), in batch order
+        self.failed_batches = []  # (batch_start, exception), in batch order
+
+    @property
+    def total_latency(self):
+        return sum(seconds for _, seconds in self.batch_latencies)
+
+
+def _fetch_artist_batch(sp, batch):
+    started = time.monotonic()
+    try:
+        response = sp.artists(batch)
+    except Exception as e:
+        return None, e, time.monotonic() - started
+    return response, None, time.monotonic() - started
+
+
+def fetch_artist_details(sp, artist_ids, max_workers=None):
+    """
+    Fetches `sp.artists` details for `artist_ids` in batches of 50 over a
+    bounded thread pool. A failing batch is logged and skipped, except for a
+    401 which is re-raised since every other batch would fail the same way.
+    Results are merged in batch order so the outcome does not depend on
+    which request finishes first.
+    """
+    if max_workers is None:
+        max_workers = settings.SPOTIFY_API_CONCURRENCY
+
+    result = ArtistFetchResult()
+    artist_ids_list = sorted(set(artist_ids))
+    batches = [
+        (i, artist_ids_list[i : i + ARTIST_BATCH_SIZE])
+        for i in range(0, len(artist_ids_list), ARTIST_BATCH_SIZE)
+    ]
+    if not batches:
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            (i, executor.submit(_fetch_artist_batch, sp, batch)) for i, batch in batches
+        ]
+        for i, future in futures:
+            response, error, seconds = future.result()
+            result.batch_latencies.append((i, seconds))
+            end = i + ARTIST_BATCH_SIZE - 1
+
+            if isinstance(error, spotipy.exceptions.SpotifyException):
+                if error.http_status == 401:
+                    raise error
+                logger.warning(
+                    f"Spotify API error fetching artist details for batch (skipping {i}-{end}): {error}"
+                )
+                result.failed_batches.append((i, error))
+                continue
+            if error is not None:
+                logger.error(
+                    f"Unexpected error fetching artist details for batch (skipping {i}-{end}): {error}"
+                )
+                result.failed_batches.append((i, error))
+                continue
+
+            logger.debug(f"[ARTISTS] Batch {i}-{end} fetched in {seconds:.3f}s.")
+            for artist_detail in response["artists"]:
+                if artist_detail:  # Ensure artist_detail is not None
+                    result.artists[artist_detail["id"]] = artist_detail
+
+    logger.info(
+        f"[ARTISTS] Fetched {len(result.artists)} artists in {len(batches)} batches "
+        f"({len(result.failed_batches)} failed, {result.total_latency:.2f}s summed latency, "
+        f"{max_workers} workers)."
+    )
+    return result
+
+
+def _fetch_saved_tracks_page(sp, offset, page_size):
+    return sp.current_user_saved_tracks(limit=page_size, offset=offset)
+
+
+def iter_saved_track_pages(sp, max_workers=None, page_size=SAVED_TRACKS_PAGE_SIZE):
+    """
+    Yields every current_user_saved_tracks page payload in offset order.
+    The first page is read on its own to learn `total`, the remaining offsets
+    are fetched over a bounded thread pool (at most two pages in flight per
+    worker). After a 429 the rest of the library is paged serially; pages
+    that already arrived are still used.
+    """
+    if max_workers is None:
+        max_workers = settings.SPOTIFY_API_CONCURRENCY
+
+    first_page = _fetch_saved_tracks_page(sp, 0, page_size)
+    yield first_page
+
+    offsets = list(range(page_size, first_page.get("total") or 0, page_size))
+    if not offsets:
+        return
+
+    if max_workers <= 1:
+        for offset in offsets:
+            yield _fetch_saved_tracks_page(sp, offset, page_size)
+        return
+
+    rate_limited = False
+    pending = deque()  # (offset, future or None once rate limited)
+    remaining = iter(offsets)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def schedule(offset):
+        if rate_limited:
+            pending.append((offset, None))
+        else:
+            pending.append(
+                (
+                    offset,
+                    executor.submit(_fetch_saved_tracks_page, sp, offset, page_size),
+                )
+            )
+
+    try:
+        for offset in itertools.islice(remaining, max_workers * 2):
+            schedule(offset)
+
+        while pending:
+            offset, future = pending.popleft()
+            page = None
+
+            if future is not None and not future.cancelled():
+                try:
+                    page = future.result()
+                except spotipy.exceptions.SpotifyException as e:
+                    if e.http_status != 429:
+                        raise
+                    if not rate_limited:
+                        logger.warning(
+                            f"[SAVED_TRACKS] Rate limited at offset {offset}. Falling back to serial paging."
+                        )
+                        rate_limited = True
+                        for _, other in pending:
+                            other.cancel()
+
+            if page is None:
+                page = _fetch_saved_tracks_page(sp, offset, page_size)
+            yield page
+
+            next_offset = next(remaining, None)
+            if next_offset is not None:
+                schedule(next_offset)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def split_at_watermark(items, since):
+    """
+    Returns (items added after `since`, whether an item added at or before
+    `since` was reached) for one newest-first page of saved-track items.
+    """
+    new_items = []
+    for item in items:
+        added_at = parse_datetime(item.get("added_at") or "")
+        if since and added_at and added_at <= since:
+            return new_items, True
+        new_items.append(item)
+    return new_items, False
+
+
+def iter_saved_track_pages_since(sp, since):
+    """
+    Yields current_user_saved_tracks pages newest-first with their items
+    trimmed to those added after `since`, stopping at the first page that
+    reaches an item added at or before `since`. With since=None the whole
+    library is read.
+    """
+    with closing(iter_saved_track_pages(sp, max_workers=1)) as pages:
+        for page in pages:
+            new_items, reached_watermark = split_at_watermark(page["items"], since)
+            yield {**page, "items": new_items}
+            if reached_watermark:
+                return
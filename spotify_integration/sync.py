@@ -0,0 +1,865 @@
+import logging
+import math
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import genre_utils
+from .models import (
+    Song,
+    Artist,
+    Album,
+    SpecificGenre,
+    BroadGenre,
+    LibrarySyncState,
+    SongBroadGenre,
+    SyncedSong,
+    UserLibraryEntry,
+    GenreMappingVersion,
+)
+from .genre_utils import broad_genre_mask, resolve_genre
+from .library_cache import bump_library_version, bump_song_library_versions
+from .spotify_api import (
+    SAVED_TRACKS_PAGE_SIZE,
+    fetch_artist_details,
+    iter_saved_track_pages,
+    iter_saved_track_pages_since,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows per bulk INSERT/UPDATE and per "IN (...)" lookup. Kept well below
+# SQLite's bound-parameter limit.
+SYNC_BATCH_SIZE = 500
+
+# Artists remembered across pages of one sync before the oldest are evicted.
+SYNC_ARTIST_CACHE_SIZE = 10000
+
+
+def chunked(items, size=SYNC_BATCH_SIZE):
+    """
+    Yields successive lists of at most `size` items.
+    """
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def load_existing(model, key_field, keys):
+    """
+    Returns {key: instance} for every row of `model` whose `key_field` is in
+    `keys`, using one query per chunk of keys.
+    """
+    existing = {}
+    for batch in chunked(keys):
+        for obj in model.objects.filter(**{f"{key_field}__in": batch}):
+            existing[getattr(obj, key_field)] = obj
+    return existing
+
+
+def upsert_rows(model, key_field, rows, update_existing=True, changed_keys=None):
+    """
+    Inserts or updates `rows` ({key: {attname: value}}) in bulk and returns
+    {key: pk}. Existing rows are loaded once, new rows go through
+    bulk_create(update_conflicts=True) and only rows whose values actually
+    changed are passed to bulk_update. With update_existing=False rows that
+    already exist are left untouched (get_or_create semantics). If
+    `changed_keys` is a set, the keys of created and updated rows are added
+    to it.
+    """
+    if not rows:
+        return {}
+
+    existing = load_existing(model, key_field, rows.keys())
+    to_create = []
+    to_update = []
+    changed_fields = set()
+
+    for key, values in rows.items():
+        obj = existing.get(key)
+        if obj is None:
+            to_create.append(model(**{key_field: key}, **values))
+            continue
+
+        if not update_existing:
+            continue
+
+        changed = [
+            attname
+            for attname, value in values.items()
+            if getattr(obj, attname) != value
+        ]
+        if changed:
+            for attname in changed:
+                setattr(obj, attname, values[attname])
+            changed_fields.update(changed)
+            to_update.append(obj)
+
+    if to_create:
+        update_fields = []
+        if update_existing:
+            update_fields = [
+                model._meta.get_field(attname).name
+                for attname in next(iter(rows.values())).keys()
+            ]
+        model.objects.bulk_create(
+            to_create,
+            batch_size=SYNC_BATCH_SIZE,
+            # Another sync may have inserted the same row since we looked.
+            update_conflicts=bool(update_fields),
+            ignore_conflicts=not update_fields,
+            unique_fields=[key_field] if update_fields else None,
+            update_fields=update_fields or None,
+        )
+
+    if changed_keys is not None:
+        changed_keys.update(getattr(obj, key_field) for obj in to_create + to_update)
+
+    if to_update:
+        model.objects.bulk_update(
+            to_update,
+            [model._meta.get_field(attname).name for attname in changed_fields],
+            batch_size=SYNC_BATCH_SIZE,
+        )
+
+    pks = {key: obj.pk for key, obj in existing.items()}
+    missing = [key for key in rows if key not in pks]
+    for batch in chunked(missing):
+        pks.update(
+            model.objects.filter(**{f"{key_field}__in": batch}).values_list(
+                key_field, "pk"
+            )
+        )
+
+    logger.debug(
+        f"[SYNC] {model.__name__}: {len(to_create)} created, {len(to_update)} updated, "
+        f"{len(rows) - len(to_create) - len(to_update)} unchanged."
+    )
+    return pks
+
+
+def reconcile_links(through, source_field, target_field, desired, changed_sources=None):
+    """
+    Brings the M2M `through` table in line with `desired` ({source_pk:
+    {target_pk, ...}}) by deleting and inserting only the rows that differ.
+    Sources not present in `desired` are left alone; new rows are inserted
+    in the order of `desired`. Returns
+    (added_count, removed_count); if `changed_sources` is a set, the pks of
+    sources whose links changed are added to it.
+    """
+    if not desired:
+        return 0, 0
+
+    existing = {}  # (source_pk, target_pk) -> through row pk
+    for batch in chunked(desired.keys()):
+        for row_pk, source_pk, target_pk in through.objects.filter(
+            **{f"{source_field}__in": batch}
+        ).values_list("pk", source_field, target_field):
+            existing[(source_pk, target_pk)] = row_pk
+
+    wanted = dict.fromkeys(
+        (source_pk, target_pk)
+        for source_pk, target_pks in desired.items()
+        for target_pk in target_pks
+    )
+    to_remove = [row_pk for pair, row_pk in existing.items() if pair not in wanted]
+    to_add = [pair for pair in wanted if pair not in existing]
+    if changed_sources is not None:
+        changed_sources.update(pair[0] for pair in to_add)
+        changed_sources.update(pair[0] for pair in existing.keys() - wanted.keys())
+
+    for batch in chunked(to_remove):
+        through.objects.filter(pk__in=batch).delete()
+    through.objects.bulk_create(
+        [
+            through(**{source_field: source_pk, target_field: target_pk})
+            for source_pk, target_pk in to_add
+        ],
+        batch_size=SYNC_BATCH_SIZE,
+        # Another sync may have linked the same pair since we looked.
+        ignore_conflicts=True,
+    )
+
+    logger.debug(
+        f"[SYNC] {through.__name__}: {len(to_add)} links added, {len(to_remove)} removed."
+    )
+    return len(to_add), len(to_remove)
+
+
+def link_specific_genres(genre_names, relink=False):
+    """
+    Upserts SpecificGenre rows for `genre_names` and returns {name: pk}.
+    SpecificGenre doubles as the table of resolved genres: only genres that
+    are new to the DB are run through genre_utils.resolve_genre() and linked
+    to their broad genres; known genres keep their stored links unless
+    `relink` is set.
+    """
+    specific_pks = {
+        name: obj.pk
+        for name, obj in load_existing(SpecificGenre, "name", genre_names).items()
+    }
+    to_resolve = set(genre_names) if relink else set(genre_names) - specific_pks.keys()
+    specific_pks.update(
+        upsert_rows(
+            SpecificGenre,
+            "name",
+            {n: {} for n in to_resolve if n not in specific_pks},
+        )
+    )
+
+    broad_by_specific = {name: resolve_genre(name) for name in to_resolve}
+    broad_names = {b for broads in broad_by_specific.values() for b in broads}
+    broad_pks = upsert_rows(BroadGenre, "name", {n: {} for n in broad_names})
+
+    reconcile_links(
+        SpecificGenre.broad_genres.through,
+        "specificgenre_id",
+        "broadgenre_id",
+        {
+            specific_pks[specific]: {broad_pks[broad] for broad in broads}
+            for specific, broads in broad_by_specific.items()
+        },
+    )
+    return specific_pks
+
+
+def materialize_song_genres(song_pks):
+    """
+    Recomputes the SongBroadGenre rows and broad_genre_mask of `song_pks`
+    from their artists' specific genres and the SpecificGenre -> BroadGenre
+    links, so listing and filtering songs by broad genre needs no mapping
+    work. Songs are shared, so the cached library of every user with a
+    changed song is invalidated, in the caller's transaction. Returns
+    (added_count, removed_count) of SongBroadGenre rows and the set of pks
+    of songs whose broad genres changed.
+    """
+    added_count = removed_count = 0
+    changed_song_pks = set()
+    for batch in chunked(song_pks):
+        batch_changed = set()
+        desired = {song_pk: set() for song_pk in batch}
+        names = {song_pk: set() for song_pk in batch}
+        for song_pk, broad_pk, broad_name in (
+            Song.artists.through.objects.filter(
+                song_id__in=batch, artist__genres__broad_genres__isnull=False
+            )
+            .values_list(
+                "song_id",
+                "artist__genres__broad_genres",
+                "artist__genres__broad_genres__name",
+            )
+            .distinct()
+        ):
+            desired[song_pk].add(broad_pk)
+            names[song_pk].add(broad_name)
+        added, removed = reconcile_links(
+            SongBroadGenre,
+            "song_id",
+            "broad_genre_id",
+            desired,
+            changed_sources=batch_changed,
+        )
+        added_count += added
+        removed_count += removed
+
+        changed_masks = [
+            Song(pk=song_pk, broad_genre_mask=broad_genre_mask(names[song_pk]))
+            for song_pk, mask in Song.objects.filter(pk__in=batch).values_list(
+                "pk", "broad_genre_mask"
+            )
+            if mask != broad_genre_mask(names[song_pk])
+        ]
+        Song.objects.bulk_update(
+            changed_masks, ["broad_genre_mask"], batch_size=SYNC_BATCH_SIZE
+        )
+        batch_changed.update(song.pk for song in changed_masks)
+
+        bump_song_library_versions(batch_changed)
+        changed_song_pks |= batch_changed
+    return added_count, removed_count, changed_song_pks
+
+
+def parse_track(track_data):
+    """
+    Returns the fields needed to store a liked track, or None when the track
+    is missing critical metadata (title, album, album art or artists).
+    """
+    song_id = track_data.get("id")
+    song_title = track_data.get("name")
+    album_data = track_data.get("album")
+    artists_from_track = track_data.get("artists", [])
+
+    if not song_title:
+        logger.warning(f"Skipping song '{song_id}' due to missing title.")
+        return None
+
+    if not album_data:
+        logger.warning(
+            f"Skipping song '{song_title}' (ID: {song_id}) due to missing album data from Spotify."
+        )
+        return None
+
+    album_name = album_data.get("name")
+    if not album_name:
+        logger.warning(
+            f"Skipping song '{song_title}' (ID: {song_id}) due to missing album name."
+        )
+        return None
+
+    album_image_url = (
+        album_data["images"][0]["url"] if album_data.get("images") else None
+    )
+    if not album_image_url:
+        logger.warning(
+            f"Skipping song '{song_title}' (ID: {song_id}) due to missing album image URL."
+        )
+        return None
+
+    if not artists_from_track:
+        logger.warning(
+            f"Skipping song '{song_title}' (ID: {song_id}) due to missing artist data."
+        )
+        return None
+
+    return {
+        "id": song_id,
+        "title": song_title,
+        "preview_url": track_data.get("preview_url"),
+        "album_id": album_data["id"],
+        "album_name": album_name,
+        "album_image_url": album_image_url,
+        "artists": [(a["id"], a["name"]) for a in artists_from_track],
+    }
+
+
+class LibrarySync:
+    """
+    Writes one user's liked tracks and their artists/genres to the DB using a
+    fixed number of bulk queries per call instead of per-row get_or_create.
+    sync_page() handles one page of saved tracks in its own transaction;
+    artists resolved on earlier pages are remembered in a bounded cache so
+    they are not fetched from Spotify again.
+    """
+
+    def __init__(self, user_id, artist_cache_size=SYNC_ARTIST_CACHE_SIZE):
+        self.user_id = user_id
+        self.sync_id = uuid.uuid4()  # Key of this sync's SyncedSong rows
+        self.artist_pks = OrderedDict()  # Artist.spotify_id -> pk, LRU order
+        self.artist_cache_size = artist_cache_size
+        self.stale_artist_ids = set()
+
+    def remember_artists(self, artist_pks):
+        for artist_id, pk in artist_pks.items():
+            self.artist_pks[artist_id] = pk
+            self.artist_pks.move_to_end(artist_id)
+        while len(self.artist_pks) > self.artist_cache_size:
+            self.artist_pks.popitem(last=False)
+
+    def sync_page(self, sp, items):
+        """
+        Syncs one page of saved-track items: fetches details for artists not
+        resolved yet, then upserts artists, albums and songs and commits.
+        Returns the number of tracks on the page.
+        """
+        records, unseen_artist_ids = self.prepare_page(items)
+        artist_details = fetch_artist_details(sp, unseen_artist_ids).artists
+        return self.save_page(records, artist_details)
+
+    def prepare_page(self, items):
+        """
+        Parses a page of saved-track items and returns (records, IDs of
+        artists that still need fetching from Spotify).
+        """
+        records = []
+        for item in items:
+            record = parse_track(item["track"]) if item["track"] else None
+            if record:
+                record["added_at"] = parse_datetime(item.get("added_at") or "")
+                records.append(record)
+
+        page_artist_ids = {a for r in records for a, _ in r["artists"]}
+        # Keep this page's cached artists from being evicted while it is saved
+        self.remember_artists(
+            {a: self.artist_pks[a] for a in page_artist_ids if a in self.artist_pks}
+        )
+        unseen_artist_ids = page_artist_ids - self.artist_pks.keys()
+        unseen_artist_ids -= self.load_cached_artists(unseen_artist_ids).keys()
+        return records, unseen_artist_ids
+
+    def save_page(self, records, artist_details):
+        """
+        Saves fetched artists and a page's parsed records in one transaction.
+        Returns the number of songs saved.
+        """
+        with transaction.atomic():
+            touched_song_pks = self.save_artists(artist_details)
+            song_pks, entries_changed = self.save_tracks(records)
+            # The page is visible as soon as it commits, so cached pages of
+            # every library showing a changed song are invalidated with it.
+            # Songs, albums and artists are shared; library entries are not.
+            bump_song_library_versions(touched_song_pks | song_pks)
+            if entries_changed:
+                bump_library_version(self.user_id)
+        return len(records)
+
+    def load_cached_artists(self, artist_ids):
+        """
+        Returns {spotify_id: pk} for artists whose genres were already fetched
+        by any user's sync, so they need no Spotify request. Artists fetched
+        longer than SPOTIFY_ARTIST_GENRE_TTL_HOURS ago are still used, but are
+        queued for refresh_stale_artists() at the end of the sync.
+        """
+        fresh_after = timezone.now() - timedelta(
+            hours=settings.SPOTIFY_ARTIST_GENRE_TTL_HOURS
+        )
+        cached = {}
+        for batch in chunked(artist_ids):
+            for spotify_id, pk, genres_fetched_at in Artist.objects.filter(
+                spotify_id__in=batch, genres_fetched_at__isnull=False
+            ).values_list("spotify_id", "pk", "genres_fetched_at"):
+                cached[spotify_id] = pk
+                if genres_fetched_at < fresh_after:
+                    self.stale_artist_ids.add(spotify_id)
+        self.remember_artists(cached)
+        return cached
+
+    def refresh_stale_artists(self, sp):
+        """
+        Re-fetches genres for the stale artists found during the sync and
+        saves them in chunked transactions. Returns the number refreshed.
+        """
+        if not self.stale_artist_ids:
+            return 0
+
+        artist_details = fetch_artist_details(sp, self.stale_artist_ids).artists
+        for batch in chunked(artist_details.items()):
+            with transaction.atomic():
+                bump_song_library_versions(self.save_artists(dict(batch)))
+        self.stale_artist_ids.clear()
+        return len(artist_details)
+
+    def save_artists(self, artist_details):
+        """
+        Upserts artists from `sp.artists` payloads ({spotify_id: detail}),
+        their specific genres and the specific -> broad genre links. Songs
+        of artists whose genres changed get their broad genres recomputed.
+        Returns the pks of songs by renamed artists, whose listings changed.
+        """
+        if not artist_details:
+            return set()
+
+        genres_fetched_at = timezone.now()
+        specific_pks = link_specific_genres(
+            {
+                genre
+                for artist_data in artist_details.values()
+                for genre in artist_data.get("genres", [])
+            }
+        )
+
+        renamed_artists = set()
+        artist_pks = upsert_rows(
+            Artist,
+            "spotify_id",
+            {
+                artist_id: {"name": artist_data["name"]}
+                for artist_id, artist_data in artist_details.items()
+            },
+            changed_keys=renamed_artists,
+        )
+        # Stamped apart from the name: a refetch that finds nothing new must
+        # not invalidate any cached library
+        for batch in chunked(artist_pks.values()):
+            Artist.objects.filter(pk__in=batch).update(
+                genres_fetched_at=genres_fetched_at
+            )
+        self.remember_artists(artist_pks)
+
+        regenred_artist_pks = set()
+        added_count, removed_count = reconcile_links(
+            Artist.genres.through,
+            "artist_id",
+            "specificgenre_id",
+            {
+                artist_pks[artist_id]: {
+                    specific_pks[genre] for genre in artist_data.get("genres", [])
+                }
+                for artist_id, artist_data in artist_details.items()
+            },
+            changed_sources=regenred_artist_pks,
+        )
+        if regenred_artist_pks:
+            materialize_song_genres(
+                Song.artists.through.objects.filter(
+                    artist_id__in=regenred_artist_pks
+                ).values_list("song_id", flat=True)
+            )
+        if not renamed_artists:
+            return set()
+        return set(
+            Song.artists.through.objects.filter(
+                artist_id__in=[artist_pks[a] for a in renamed_artists]
+            ).values_list("song_id", flat=True)
+        )
+
+    def save_tracks(self, records):
+        """
+        Upserts albums and songs for prepare_page() records, links each song
+        to its artists and adds the songs to the user's library. Artists not
+        seen by save_artists() are created with just their name. Returns
+        (pks of songs whose own row, album or artist links were written,
+        whether any of the user's library entries were).
+        """
+        if not records:
+            return set(), False
+
+        changed_albums = set()
+        album_pks = upsert_rows(
+            Album,
+            "spotify_id",
+            {
+                r["album_id"]: {
+                    "name": r["album_name"],
+                    "image_url": r["album_image_url"],
+                }
+                for r in records
+            },
+            changed_keys=changed_albums,
+        )
+
+        fallback_artists = {}
+        for r in records:
+            for artist_id, artist_name in r["artists"]:
+                if artist_id not in self.artist_pks:
+                    fallback_artists[artist_id] = artist_name
+        if fallback_artists:
+            logger.warning(
+                f"  {len(fallback_artists)} artists not found in batch cache. Creating minimally."
+            )
+            self.remember_artists(
+                upsert_rows(
+                    Artist,
+                    "spotify_id",
+                    {a: {"name": name} for a, name in fallback_artists.items()},
+                    update_existing=False,
+                )
+            )
+
+        changed_songs = set()
+        song_pks = upsert_rows(
+            Song,
+            "spotify_id",
+            {
+                r["id"]: {
+                    "title": r["title"],
+                    "album_id": album_pks[r["album_id"]],
+                    "preview_url": r["preview_url"],
+                }
+                for r in records
+            },
+            changed_keys=changed_songs,
+        )
+
+        # Artist pks in credit order, so listings can show them that way
+        desired_artists = {}
+        for r in records:
+            desired_artists.setdefault(song_pks[r["id"]], {}).update(
+                dict.fromkeys(
+                    self.artist_pks[artist_id] for artist_id, _ in r["artists"]
+                )
+            )
+        touched_song_pks = {song_pks[key] for key in changed_songs}
+        reconcile_links(
+            Song.artists.through,
+            "song_id",
+            "artist_id",
+            desired_artists,
+            changed_sources=touched_song_pks,
+        )
+        if changed_albums:
+            touched_song_pks.update(
+                Song.objects.filter(
+                    album_id__in=[album_pks[a] for a in changed_albums]
+                ).values_list("pk", flat=True)
+            )
+        # Invalidates the libraries of songs whose genres changed itself
+        materialize_song_genres(song_pks.values())
+
+        entries_changed = self.save_library_entries(
+            {song_pks[r["id"]]: r["added_at"] for r in records}
+        )
+        SyncedSong.objects.bulk_create(
+            [SyncedSong(sync_id=self.sync_id, song_id=pk) for pk in song_pks.values()],
+            batch_size=SYNC_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        return touched_song_pks, bool(entries_changed)
+
+    def save_library_entries(self, added_at_by_song_pk):
+        """
+        Adds songs ({song_pk: added_at}) to the user's library, updating
+        `added_at` only where it changed. Returns the number of entries
+        created or updated.
+        """
+        existing = {}
+        for batch in chunked(added_at_by_song_pk.keys()):
+            for entry in UserLibraryEntry.objects.filter(
+                user_id=self.user_id, song_id__in=batch
+            ):
+                existing[entry.song_id] = entry
+
+        to_create = []
+        to_update = []
+        for song_pk, added_at in added_at_by_song_pk.items():
+            entry = existing.get(song_pk)
+            if entry is None:
+                to_create.append(
+                    UserLibraryEntry(
+                        user_id=self.user_id, song_id=song_pk, added_at=added_at
+                    )
+                )
+            elif entry.added_at != added_at:
+                entry.added_at = added_at
+                to_update.append(entry)
+
+        UserLibraryEntry.objects.bulk_create(
+            to_create,
+            batch_size=SYNC_BATCH_SIZE,
+            # Another sync of the same user may have added the song since we looked.
+            ignore_conflicts=True,
+        )
+        UserLibraryEntry.objects.bulk_update(
+            to_update, ["added_at"], batch_size=SYNC_BATCH_SIZE
+        )
+        logger.debug(
+            f"[SYNC] UserLibraryEntry: {len(to_create)} created, {len(to_update)} updated."
+        )
+        return len(to_create) + len(to_update)
+
+    def finish(self, full_sync, last_added_at, total):
+        """
+        Ends a sync: after a full pass removes the songs it did not see, then
+        stores the new `added_at` watermark and library total. Returns the
+        number of songs removed from the user's library. Pages that wrote
+        anything already invalidated the cached library, so it is only
+        invalidated again if songs were removed.
+        """
+        removed_count = 0
+        with transaction.atomic():
+            # Remove songs from DB that are no longer liked by the user OR were skipped during this run
+            if full_sync:
+                removed_count = self.remove_unliked_songs()
+
+            LibrarySyncState.objects.update_or_create(
+                user_id=self.user_id,
+                defaults={"last_added_at": last_added_at, "library_total": total},
+            )
+            if removed_count:
+                bump_library_version(self.user_id)
+        return removed_count
+
+    def remove_unliked_songs(self):
+        """
+        Removes songs that were not part of this sync (no longer liked by the
+        user or skipped because of missing metadata) from the user's library.
+        Songs left in no library at all are deleted. Both deletes are
+        anti-joins against this sync's SyncedSong rows, so no song IDs are
+        loaded into Python. Returns the number of library entries removed.
+        """
+        unliked = UserLibraryEntry.objects.filter(user_id=self.user_id).filter(
+            ~Exists(
+                SyncedSong.objects.filter(
+                    sync_id=self.sync_id, song_id=OuterRef("song_id")
+                )
+            )
+        )
+        orphaned_song_pks = unliked.filter(
+            ~Exists(
+                UserLibraryEntry.objects.filter(song_id=OuterRef("song_id")).exclude(
+                    user_id=self.user_id
+                )
+            )
+        ).values("song_id")
+
+        Song.artists.through.objects.filter(song_id__in=orphaned_song_pks).delete()
+        SongBroadGenre.objects.filter(song_id__in=orphaned_song_pks).delete()
+        # QuerySet.delete() would load every Song to cascade in Python; the
+        # only remaining references are the entries deleted right after.
+        orphaned_sql, params = orphaned_song_pks.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {Song._meta.db_table} "
+                f"WHERE {Song._meta.pk.column} IN ({orphaned_sql})",
+                params,
+            )
+            deleted_songs_count = cursor.rowcount
+        removed_count, _ = unliked.delete()
+
+        logger.info(
+            f"[SYNC] Removed {removed_count} songs (no longer liked by user or skipped "
+            f"during sync) from the library of user {self.user_id}; "
+            f"{deleted_songs_count} of them were in no other library and were deleted."
+        )
+        return removed_count
+
+    def clear_staged_songs(self):
+        SyncedSong.objects.filter(sync_id=self.sync_id).delete()
+
+
+def newest_added_at(items, current=None):
+    """
+    Returns the latest `added_at` among saved-track items and `current`.
+    """
+    newest = current
+    for item in items:
+        added_at = parse_datetime(item.get("added_at") or "")
+        if added_at and (newest is None or added_at > newest):
+            newest = added_at
+    return newest
+
+
+# Applied mapping version the mapping file did not hold when last checked
+_unavailable_genre_mapping_version = None
+
+
+def refresh_genre_mapping():
+    """
+    Reloads the genre mapping file when remap_genres has applied a version
+    other than the one this process loaded, so genres resolved by the sync
+    and genre filters agree with the stored links. Costs one small query
+    when nothing changed.
+
+    If the file does not hold the applied version (e.g. it was edited but
+    not applied yet) the loaded mapping is kept; this is logged once per
+    applied version.
+    """
+    global _unavailable_genre_mapping_version
+
+    applied_version = (
+        GenreMappingVersion.objects.order_by("-applied_at")
+        .values_list("version", flat=True)
+        .first()
+    )
+    if (
+        applied_version is None
+        or applied_version == genre_utils.GENRE_MAPPING_VERSION
+        or applied_version == _unavailable_genre_mapping_version
+    ):
+        return
+
+    file_mapping = genre_utils.read_genre_mapping_file()
+    if file_mapping[0] != applied_version:
+        logger.warning(
+            f"[SYNC] Genre mapping v{applied_version} was applied, but the mapping "
+            f"file holds v{file_mapping[0]}; keeping v{genre_utils.GENRE_MAPPING_VERSION}. "
+            "Run remap_genres to apply the file."
+        )
+        _unavailable_genre_mapping_version = applied_version
+        return
+
+    logger.info(
+        f"[SYNC] Genre mapping v{applied_version} was applied; reloading "
+        f"(this process had v{genre_utils.GENRE_MAPPING_VERSION})."
+    )
+    genre_utils.install_genre_mapping(*file_mapping)
+
+
+def needs_full_sync(user_id, sync_state):
+    """
+    A full library fetch is needed until the user has both library entries
+    and a sync watermark; after that only newly liked tracks are fetched.
+    """
+    if sync_state is None or sync_state.last_added_at is None:
+        logger.info(f"[SYNC] No sync watermark for user {user_id}. Full fetch.")
+        return True
+    if not UserLibraryEntry.objects.filter(user_id=user_id).exists():
+        logger.info(f"[SYNC] No songs for user {user_id}. Full fetch.")
+        return True
+    return False
+
+
+def sync_user_library(user_id, sp, force_full=False, progress=None):
+    """
+    Pulls the user's liked songs from Spotify and writes them to the DB one
+    page at a time, so memory stays bounded by the page size and the artist
+    cache and songs become visible while the sync is still running.
+
+    Only tracks added after the stored `added_at` watermark are fetched. A
+    full pass (which also removes songs that are no longer liked) happens
+    when there is no watermark yet, when `force_full` is set, or when the
+    library total does not add up with the new tracks, i.e. something was
+    unliked since the last sync. `progress`, if given, is called as
+    progress(phase, pages_done, pages_total) after every page. Returns
+    (tracks synced, songs removed from the user's library).
+    """
+
+    def report(phase, pages_done=None, pages_total=None):
+        if progress:
+            progress(phase, pages_done, pages_total)
+
+    refresh_genre_mapping()
+    sync_state = LibrarySyncState.objects.filter(user_id=user_id).first()
+    full_sync = force_full or needs_full_sync(user_id, sync_state)
+    library_sync = LibrarySync(user_id)
+    tracks_synced = 0
+    total = 0
+    last_added_at = None
+
+    try:
+        if not full_sync:
+            last_added_at = sync_state.last_added_at
+            new_items_count = 0
+            report("fetching_new_tracks")
+            for pages_done, page in enumerate(
+                iter_saved_track_pages_since(sp, sync_state.last_added_at), start=1
+            ):
+                total = page.get("total") or 0
+                new_items_count += len(page["items"])
+                last_added_at = newest_added_at(page["items"], last_added_at)
+                tracks_synced += library_sync.sync_page(sp, page["items"])
+                report("fetching_new_tracks", pages_done)
+
+            if sync_state.library_total + new_items_count != total:
+                logger.info(
+                    f"[SYNC] Library total for user {user_id} is {total}, expected "
+                    f"{sync_state.library_total + new_items_count}. Tracks were removed; "
+                    "falling back to a full reconcile."
+                )
+                full_sync = True
+            else:
+                logger.info(
+                    f"[SYNC] Incremental sync for user {user_id}: {new_items_count} new tracks."
+                )
+
+        if full_sync:
+            tracks_synced = 0
+            for pages_done, page in enumerate(iter_saved_track_pages(sp), start=1):
+                total = page.get("total") or 0
+                last_added_at = newest_added_at(page["items"], last_added_at)
+                tracks_synced += library_sync.sync_page(sp, page["items"])
+                report(
+                    "syncing_pages",
+                    pages_done,
+                    max(math.ceil(total / SAVED_TRACKS_PAGE_SIZE), 1),
+                )
+
+        logger.info(f"[SYNC] Synced {tracks_synced} liked songs from Spotify API.")
+
+        # Songs are already saved; stale cached artists only need fresh genres
+        if library_sync.stale_artist_ids:
+            report("refreshing_artists")
+            refreshed_count = library_sync.refresh_stale_artists(sp)
+            logger.info(f"[SYNC] Refreshed genres for {refreshed_count} stale artists.")
+
+        if full_sync:
+            report("removing_unliked")
+        tracks_removed = library_sync.finish(full_sync, last_added_at, total)
+        return tracks_synced, tracks_removed
+    finally:
+        library_sync.clear_staged_songs()
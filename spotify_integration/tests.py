@@ -1 +1,1506 @@
-from django.test import TestCase
+import base64
+import copy
+import csv
+import json
+import math
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+
+import requests
+import spotipy
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import genre_utils, sync
+from .async_sync import async_sync_user_library
+from .fake_spotify import FakeSpotifyServer, SyntheticLibrary
+from .genre_utils import (
+    broad_genre_mask,
+    map_specific_genres_to_broad,
+    parse_genre_expression,
+    resolve_genre,
+)
+from .jobs import claim_next_job, enqueue_sync, fail_stale_jobs, finish_job, run_job
+from .library_cache import LIBRARY_CACHE_ALIAS, get_library_version
+from .management.commands.sync_all_users import stale_user_ids
+from .models import (
+    Album,
+    Artist,
+    GenreMappingVersion,
+    LibrarySyncState,
+    Song,
+    SongBroadGenre,
+    SpecificGenre,
+    SpotifyToken,
+    SyncJob,
+    UserLibraryEntry,
+)
+from .spotify_api import (
+    SAVED_TRACKS_PAGE_SIZE,
+    fetch_artist_details,
+    forget_user_spotify_client,
+    get_user_access_token,
+    get_user_spotify_client,
+    iter_saved_track_pages,
+)
+from .transport import SharedWindowBudget, SpotifyTransport, TokenBucket
+
+# Tables of the many-to-many links an unchanged re-sync must leave alone
+LINK_TABLES = (
+    "spotify_integration_song_artists",
+    "spotify_integration_artist_genres",
+    "spotify_integration_songbroadgenre",
+)
+
+
+class EditedLibrary:
+    """
+    A SyntheticLibrary as seen after its owner liked `new_count` tracks on
+    top of it and unliked the tracks at the `unliked` positions.
+    """
+
+    def __init__(self, base, new_count=0, unliked=()):
+        self.base = base
+        self.new_count = new_count
+        self.artist_count = base.artist_count
+        self.positions = [p for p in range(base.track_count) if p not in unliked]
+        self.track_count = new_count + len(self.positions)
+
+    def artist(self, index):
+        return self.base.artist(index)
+
+    def track_item(self, position):
+        if position >= self.new_count:
+            return self.base.track_item(self.positions[position - self.new_count])
+        # Tracks past the end of the base library, liked after all of it
+        item = self.base.track_item(self.base.track_count + position)
+        item["added_at"] = (
+            self.base.newest_added_at + timedelta(minutes=self.new_count - position)
+        ).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return item
+
+
+class RegenredLibrary(EditedLibrary):
+    """
+    A SyntheticLibrary whose artists have all been re-genred as metal.
+    """
+
+    def artist(self, index):
+        return {**self.base.artist(index), "genres": ["metal"]}
+
+
+class RenamedLibrary(EditedLibrary):
+    """
+    A SyntheticLibrary in which some of the first track, the album of the
+    second track and the first artist of the third track (`renamed`, a
+    subset of {"track", "album", "artist"}) have been renamed.
+    """
+
+    def __init__(self, base, renamed):
+        super().__init__(base)
+        self.renamed = renamed
+        self.album_id = base.track_item(1)["track"]["album"]["id"]
+        self.artist_id = base.track_item(2)["track"]["artists"][0]["id"]
+
+    def artist(self, index):
+        artist = self.base.artist(index)
+        if "artist" in self.renamed and artist["id"] == self.artist_id:
+            artist["name"] += " & Co"
+        return artist
+
+    def track_item(self, position):
+        item = super().track_item(position)
+        track = item["track"]
+        if "track" in self.renamed and position == 0:
+            track["name"] += " (Remastered)"
+        if "album" in self.renamed and track["album"]["id"] == self.album_id:
+            track["album"]["name"] += " (Deluxe)"
+        for artist in track["artists"]:
+            if "artist" in self.renamed and artist["id"] == self.artist_id:
+                artist["name"] += " & Co"
+        return item
+
+
+class FakeSpotifyMixin:
+    """
+    Serves `library` from a local FakeSpotifyServer for the test case.
+    """
+
+    library = SyntheticLibrary(120, seed=7)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeSpotifyServer(cls.library).start()
+        cls.addClassCleanup(cls.server.stop)
+        settings_override = override_settings(
+            SPOTIFY_API_URL=cls.server.base_url,
+            SPOTIFY_API_RATE_PER_SECOND=1000,
+            SPOTIFY_API_BURST=1000,
+        )
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+
+    def setUp(self):
+        self.server.library = self.library
+        # Library versions restart with every test's database
+        caches[LIBRARY_CACHE_ALIAS].clear()
+
+    def store_token(self, user_id):
+        if not SpotifyToken.objects.filter(user_id=user_id).exists():
+            forget_user_spotify_client(user_id)
+            SpotifyToken.objects.create(
+                user_id=user_id,
+                access_token="fake-access-token",
+                refresh_token="fake-refresh-token",
+                expires_at=timezone.now() + timedelta(days=1),
+            )
+
+    def liked_spotify_ids(self, user_id):
+        return set(
+            UserLibraryEntry.objects.filter(user_id=user_id).values_list(
+                "song__spotify_id", flat=True
+            )
+        )
+
+    def library_ids(self, library):
+        return {
+            library.track_item(p)["track"]["id"] for p in range(library.track_count)
+        }
+
+
+class FakeSpotifyTestCase(FakeSpotifyMixin, TestCase):
+    """
+    Runs syncs through the job queue against a local FakeSpotifyServer.
+    """
+
+    def sync(self, user_id, force_full=False):
+        self.store_token(user_id)
+        enqueue_sync(user_id, force_full=force_full)
+        job = claim_next_job()
+        self.assertTrue(run_job(job), SyncJob.objects.get(pk=job.pk).error)
+        return SyncJob.objects.get(pk=job.pk)
+
+
+class SyncTests(FakeSpotifyTestCase):
+    def test_full_sync_saves_library(self):
+        job = self.sync("alice")
+
+        self.assertEqual(job.status, SyncJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.tracks_synced, self.library.track_count)
+        self.assertEqual(
+            self.liked_spotify_ids("alice"), self.library_ids(self.library)
+        )
+
+    def test_unchanged_resync_writes_no_links(self):
+        self.sync("alice")
+        link_writes = []
+
+        def record_link_writes(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            rowcount = context["cursor"].rowcount
+            if rowcount > 0 and not sql.lstrip().upper().startswith("SELECT"):
+                if any(table in sql for table in LINK_TABLES):
+                    link_writes.append(sql)
+            return result
+
+        with connection.execute_wrapper(record_link_writes):
+            self.sync("alice", force_full=True)
+
+        self.assertEqual(link_writes, [])
+
+    def test_incremental_sync_fetches_only_new_tracks(self):
+        self.sync("alice")
+        self.server.library = EditedLibrary(self.library, new_count=3)
+        requests_before = self.server.requests
+
+        self.sync("alice")
+
+        # One saved-tracks page, plus at most one batch of unseen artists
+        self.assertLessEqual(self.server.requests - requests_before, 2)
+        self.assertEqual(
+            self.liked_spotify_ids("alice"), self.library_ids(self.server.library)
+        )
+
+    def test_incremental_sync_falls_back_to_full_pass(self):
+        self.sync("alice")
+        self.server.library = EditedLibrary(self.library, new_count=2, unliked={5})
+
+        self.sync("alice")
+
+        # New tracks alone don't explain the total, so the unlike is found
+        liked = self.liked_spotify_ids("alice")
+        self.assertEqual(liked, self.library_ids(self.server.library))
+        self.assertNotIn(self.library.track_item(5)["track"]["id"], liked)
+
+    def test_users_share_songs_and_unlike_independently(self):
+        self.sync("alice")
+        self.sync("bob")
+        self.assertEqual(Song.objects.count(), self.library.track_count)
+
+        self.server.library = EditedLibrary(self.library, unliked={0})
+        self.sync("bob")
+
+        unliked_id = self.library.track_item(0)["track"]["id"]
+        self.assertNotIn(unliked_id, self.liked_spotify_ids("bob"))
+        self.assertIn(unliked_id, self.liked_spotify_ids("alice"))
+        self.assertTrue(Song.objects.filter(spotify_id=unliked_id).exists())
+
+    def test_unliked_song_is_removed(self):
+        self.sync("alice")
+        self.server.library = EditedLibrary(self.library, unliked={3})
+
+        job = self.sync("alice")
+
+        self.assertEqual(job.tracks_removed, 1)
+        unliked_id = self.library.track_item(3)["track"]["id"]
+        self.assertNotIn(unliked_id, self.liked_spotify_ids("alice"))
+        # No other library holds it, so the song and its links are gone
+        self.assertFalse(Song.objects.filter(spotify_id=unliked_id).exists())
+        self.assertFalse(
+            Song.artists.through.objects.filter(song__spotify_id=unliked_id).exists()
+        )
+        self.assertEqual(Song.objects.count(), self.library.track_count - 1)
+
+    def test_only_songs_of_regenred_artists_are_rematerialized(self):
+        self.sync("alice")
+        regenred, unchanged = (
+            Artist.objects.filter(genres__isnull=False)
+            .exclude(genres__name="metal")
+            .distinct()
+            .order_by("pk")[:2]
+        )
+
+        def details(artist, extra_genres=()):
+            genres = list(artist.genres.values_list("name", flat=True))
+            return {"name": artist.name, "genres": genres + list(extra_genres)}
+
+        with mock.patch(
+            "spotify_integration.sync.materialize_song_genres",
+            wraps=sync.materialize_song_genres,
+        ) as materialize:
+            sync.LibrarySync("alice").save_artists(
+                {
+                    regenred.spotify_id: details(regenred, ["metal"]),
+                    unchanged.spotify_id: details(unchanged),
+                }
+            )
+
+        materialize.assert_called_once()
+        self.assertEqual(
+            set(materialize.call_args.args[0]),
+            set(regenred.songs_link.values_list("pk", flat=True)),
+        )
+
+    def test_genre_masks_match_materialized_genres(self):
+        self.sync("alice")
+
+        names = {}
+        for song_pk, name in SongBroadGenre.objects.values_list(
+            "song_id", "broad_genre__name"
+        ):
+            names.setdefault(song_pk, set()).add(name)
+        self.assertTrue(names)
+        for song_pk, mask in Song.objects.values_list("pk", "broad_genre_mask"):
+            self.assertEqual(mask, broad_genre_mask(names.get(song_pk, ())))
+
+
+class ArtistGenreTtlTests(FakeSpotifyTestCase):
+    def genre_names(self, artist):
+        return sorted(artist.genres.values_list("name", flat=True))
+
+    def test_fresh_artists_are_not_fetched_again(self):
+        self.sync("alice")
+        fetched_at = dict(Artist.objects.values_list("pk", "genres_fetched_at"))
+        requests_before = self.server.requests
+
+        self.sync("bob")
+
+        # Only the saved-tracks pages, no artist batches
+        pages = math.ceil(self.library.track_count / SAVED_TRACKS_PAGE_SIZE)
+        self.assertEqual(self.server.requests - requests_before, pages)
+        self.assertEqual(
+            dict(Artist.objects.values_list("pk", "genres_fetched_at")), fetched_at
+        )
+
+    def test_stale_and_unfetched_artists_are_refetched(self):
+        self.sync("alice")
+        stale, unfetched, fresh = (
+            Artist.objects.exclude(genres__name="metal")
+            .filter(genres__isnull=False)
+            .distinct()
+            .order_by("pk")[:3]
+        )
+        long_ago = timezone.now() - timedelta(
+            hours=settings.SPOTIFY_ARTIST_GENRE_TTL_HOURS + 1
+        )
+        Artist.objects.filter(pk=stale.pk).update(genres_fetched_at=long_ago)
+        Artist.objects.filter(pk=unfetched.pk).update(genres_fetched_at=None)
+        fresh_genres = self.genre_names(fresh)
+        sync_started = timezone.now()
+
+        self.server.library = RegenredLibrary(self.library)
+        self.sync("bob")
+
+        for artist in (stale, unfetched):
+            artist.refresh_from_db()
+            self.assertEqual(self.genre_names(artist), ["metal"])
+            self.assertGreaterEqual(artist.genres_fetched_at, sync_started)
+        fetched_at = fresh.genres_fetched_at
+        fresh.refresh_from_db()
+        self.assertEqual(self.genre_names(fresh), fresh_genres)
+        self.assertEqual(fresh.genres_fetched_at, fetched_at)
+
+
+class StubArtistsClient:
+    """
+    Answers sp.artists() batches after a random delay so they finish out of
+    order. Batches containing an ID in `failing` raise a SpotifyException
+    with that ID's status.
+    """
+
+    def __init__(self, failing=None):
+        self.failing = failing or {}
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+
+    def artists(self, artist_ids):
+        with self._lock:
+            delay = self._random.uniform(0, 0.01)
+        time.sleep(delay)
+        for artist_id in artist_ids:
+            if artist_id in self.failing:
+                raise spotipy.exceptions.SpotifyException(
+                    self.failing[artist_id], -1, "error"
+                )
+        # Unknown IDs come back as null
+        return {
+            "artists": [
+                {"id": a, "name": a.upper(), "genres": []} if a != "missing" else None
+                for a in artist_ids
+            ]
+        }
+
+
+class ArtistDetailsTests(SimpleTestCase):
+    artist_ids = [f"artist{i:03d}" for i in range(220)]
+
+    def test_batches_are_merged_in_batch_order(self):
+        result = fetch_artist_details(
+            StubArtistsClient(), self.artist_ids + ["missing"], max_workers=4
+        )
+
+        self.assertEqual(list(result.artists), sorted(self.artist_ids))
+        self.assertEqual(result.artists["artist007"]["name"], "ARTIST007")
+        self.assertEqual(
+            [start for start, _ in result.batch_latencies], [0, 50, 100, 150, 200]
+        )
+        self.assertTrue(all(seconds > 0 for _, seconds in result.batch_latencies))
+        self.assertEqual(result.failed_batches, [])
+
+    def test_failed_batch_is_skipped(self):
+        sp = StubArtistsClient(failing={"artist060": 500})
+
+        result = fetch_artist_details(sp, self.artist_ids, max_workers=4)
+
+        self.assertEqual(
+            list(result.artists), self.artist_ids[:50] + self.artist_ids[100:]
+        )
+        self.assertEqual(
+            [(start, e.http_status) for start, e in result.failed_batches], [(50, 500)]
+        )
+        self.assertEqual(len(result.batch_latencies), 5)
+
+    def test_unauthorized_is_raised(self):
+        sp = StubArtistsClient(failing={"artist120": 401})
+
+        with self.assertRaises(spotipy.exceptions.SpotifyException) as raised:
+            fetch_artist_details(sp, self.artist_ids, max_workers=4)
+        self.assertEqual(raised.exception.http_status, 401)
+
+
+class StubSavedTracksClient:
+    """
+    Serves saved-track pages whose single item records the page's offset,
+    after a random delay so pool workers finish out of order. Requests at
+    `failing_offset` fail once with a SpotifyException of `failing_status`.
+    Calls are recorded as (offset, whether made on the calling thread).
+    """
+
+    def __init__(self, total, failing_offset=None, failing_status=429):
+        self.total = total
+        self.failing_offset = failing_offset
+        self.failing_status = failing_status
+        self.calls = []
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self._caller = threading.current_thread()
+
+    def current_user_saved_tracks(self, limit, offset):
+        with self._lock:
+            self.calls.append((offset, threading.current_thread() is self._caller))
+            delay = self._random.uniform(0, 0.01)
+            failing = offset == self.failing_offset
+            if failing:
+                self.failing_offset = None
+        if failing:
+            raise spotipy.exceptions.SpotifyException(self.failing_status, -1, "error")
+        time.sleep(delay)
+        return {"items": [{"offset": offset}], "total": self.total}
+
+
+class SavedTrackPagesTests(SimpleTestCase):
+    def page_offsets(self, sp, max_workers=2):
+        return [
+            page["items"][0]["offset"]
+            for page in iter_saved_track_pages(
+                sp, max_workers=max_workers, page_size=10
+            )
+        ]
+
+    def test_pages_are_yielded_in_offset_order(self):
+        sp = StubSavedTracksClient(total=200)
+
+        self.assertEqual(self.page_offsets(sp, max_workers=4), list(range(0, 200, 10)))
+        self.assertEqual(len(sp.calls), 20)
+
+    def test_rate_limit_falls_back_to_serial_paging(self):
+        # The first pooled page is rate limited while offsets 10-40 are queued
+        sp = StubSavedTracksClient(total=200, failing_offset=10)
+
+        self.assertEqual(self.page_offsets(sp), list(range(0, 200, 10)))
+
+        # Only the rate-limited page is requested twice; cancelled requests
+        # never reach the client
+        offsets = [offset for offset, _ in sp.calls]
+        self.assertEqual(offsets.count(10), 2)
+        self.assertEqual(sorted(set(offsets)), list(range(0, 200, 10)))
+        self.assertEqual(len(offsets), 21)
+        # Pages that were not queued before the 429 are paged serially
+        self.assertTrue(all(on_caller for offset, on_caller in sp.calls if offset > 40))
+
+    def test_other_errors_are_raised(self):
+        sp = StubSavedTracksClient(total=200, failing_offset=30, failing_status=500)
+
+        with self.assertRaises(spotipy.exceptions.SpotifyException):
+            self.page_offsets(sp)
+
+
+class JobQueueTests(TestCase):
+    def test_jobs_are_claimed_oldest_first(self):
+        first = enqueue_sync("alice")
+        second = enqueue_sync("bob")
+
+        self.assertEqual(claim_next_job().pk, first.pk)
+        self.assertEqual(claim_next_job().pk, second.pk)
+        self.assertIsNone(claim_next_job())
+        self.assertEqual(
+            SyncJob.objects.get(pk=first.pk).status, SyncJob.STATUS_RUNNING
+        )
+
+    def test_job_is_claimed_once_by_racing_workers(self):
+        job = enqueue_sync("alice")
+        other_claims = []
+
+        def claim_before_update(execute, sql, params, many, context):
+            # Another worker claims the job between our SELECT and UPDATE
+            if '"started_at" = ' in sql and not other_claims:
+                other_claims.append(None)
+                other_claims[0] = claim_next_job()
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(claim_before_update):
+            claimed = claim_next_job()
+
+        self.assertIsNone(claimed)
+        self.assertEqual(other_claims[0].pk, job.pk)
+
+    def test_jobs_without_heartbeat_are_failed(self):
+        stale = timezone.now() - timedelta(minutes=settings.SYNC_JOB_STALE_MINUTES + 1)
+        dead = SyncJob.objects.create(
+            user_id="alice",
+            status=SyncJob.STATUS_RUNNING,
+            started_at=stale,
+            heartbeat_at=stale,
+        )
+        legacy = SyncJob.objects.create(
+            user_id="bob", status=SyncJob.STATUS_RUNNING, started_at=stale
+        )
+        alive = SyncJob.objects.create(
+            user_id="carol",
+            status=SyncJob.STATUS_RUNNING,
+            started_at=stale,
+            heartbeat_at=timezone.now(),
+        )
+
+        self.assertEqual(fail_stale_jobs(), 2)
+        for job in (dead, legacy):
+            self.assertEqual(
+                SyncJob.objects.get(pk=job.pk).status, SyncJob.STATUS_FAILED
+            )
+        self.assertEqual(
+            SyncJob.objects.get(pk=alive.pk).status, SyncJob.STATUS_RUNNING
+        )
+
+    def test_enqueue_returns_the_active_job(self):
+        job = enqueue_sync("alice")
+
+        self.assertEqual(enqueue_sync("alice", force_full=True).pk, job.pk)
+        self.assertTrue(SyncJob.objects.get(pk=job.pk).force_full)
+
+        claim_next_job()
+        self.assertEqual(enqueue_sync("alice").pk, job.pk)
+
+        finish_job(job, tracks_synced=1)
+        self.assertNotEqual(enqueue_sync("alice").pk, job.pk)
+        self.assertEqual(SyncJob.objects.count(), 2)
+
+    def get_status(self, user_id):
+        session = self.client.session
+        session["spotify_user_id"] = user_id
+        session.save()
+        return self.client.get(reverse("spotify_integration:sync_status"))
+
+    def test_sync_status_reports_progress(self):
+        self.assertEqual(self.get_status("alice").json(), {"status": "none"})
+
+        job = SyncJob.objects.create(
+            user_id="alice",
+            status=SyncJob.STATUS_RUNNING,
+            phase="syncing_pages",
+            started_at=timezone.now() - timedelta(seconds=60),
+            pages_done=2,
+            pages_total=6,
+            tracks_synced=0,
+        )
+
+        self.assertEqual(
+            self.get_status("alice").json(),
+            {
+                "job_id": job.pk,
+                "status": SyncJob.STATUS_RUNNING,
+                "phase": "syncing_pages",
+                "pages_done": 2,
+                "pages_total": 6,
+                "tracks_synced": 0,
+                "tracks_removed": 0,
+                # 30s per page so far, 4 pages left
+                "eta_seconds": 120,
+                "error": "",
+            },
+        )
+
+    def test_sync_status_requires_session(self):
+        response = self.client.get(reverse("spotify_integration:sync_status"))
+        self.assertEqual(response.status_code, 401)
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self._respond()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.methods.append(self.command)
+        status, headers = self.server.script.pop(0) if self.server.script else (200, {})
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+
+class RecordingLimiter:
+    """
+    Request budget that never waits, recording acquires and pauses.
+    """
+
+    def __init__(self):
+        self.acquired = 0
+        self.pauses = []
+
+    def acquire(self):
+        self.acquired += 1
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+
+
+class TransportTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.httpd = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+        cls.httpd.daemon_threads = True
+        threading.Thread(target=cls.httpd.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.httpd.server_close)
+        cls.addClassCleanup(cls.httpd.shutdown)
+        host, port = cls.httpd.server_address[:2]
+        cls.base_url = f"http://{host}:{port}/v1/"
+        settings_override = override_settings(SPOTIFY_API_URL=cls.base_url)
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+
+    def setUp(self):
+        self.httpd.script = []
+        self.httpd.methods = []
+        self.limiter = RecordingLimiter()
+        self.transport = SpotifyTransport(
+            self.limiter, max_retries=2, pool_size=2, backoff_factor=0
+        )
+
+    def test_rate_limited_request_is_retried_after_shared_pause(self):
+        self.httpd.script = [(429, {"Retry-After": "3"})]
+
+        response = self.transport.get(self.base_url + "me/tracks")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.httpd.methods, ["GET", "GET"])
+        self.assertEqual(self.limiter.pauses, [3.0])
+        self.assertEqual(self.limiter.acquired, 2)
+        counters = self.transport.stats.snapshot()["GET /v1/me/tracks"]
+        self.assertEqual((counters["requests"], counters["rate_limited"]), (2, 1))
+
+    def test_rate_limit_is_returned_after_max_retries(self):
+        self.httpd.script = [(429, {"Retry-After": "1"})] * 3
+
+        response = self.transport.get(self.base_url + "me/tracks")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(self.httpd.methods), 3)
+        self.assertEqual(self.limiter.pauses, [1.0, 1.0])
+
+    def test_server_errors_are_retried_for_get_only(self):
+        self.httpd.script = [(503, {})]
+        response = self.transport.get(self.base_url + "me/tracks")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.httpd.methods, ["GET", "GET"])
+        # Every attempt, retries included, draws on the shared budget
+        self.assertEqual(self.limiter.acquired, 2)
+
+        self.httpd.methods = []
+        self.httpd.script = [(503, {})]
+        response = self.transport.post(
+            self.base_url + "playlists/p1/tracks", json=["spotify:track:1"]
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.httpd.methods, ["POST"])
+
+    def test_server_error_is_returned_after_max_retries(self):
+        self.httpd.script = [(502, {})] * 3
+
+        response = self.transport.get(self.base_url + "me/tracks")
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(self.httpd.methods), 3)
+        self.assertEqual(self.limiter.acquired, 3)
+        counters = self.transport.stats.snapshot()["GET /v1/me/tracks"]
+        self.assertEqual((counters["requests"], counters["errors"]), (3, 3))
+
+    def test_spotipy_sees_the_server_error_after_max_retries(self):
+        self.httpd.script = [(503, {})] * 3
+        sp = spotipy.Spotify(auth="token", requests_session=self.transport)
+        sp.prefix = self.base_url
+
+        with self.assertRaises(spotipy.exceptions.SpotifyException) as raised:
+            sp.current_user_saved_tracks()
+
+        self.assertEqual(raised.exception.http_status, 503)
+        self.assertEqual(len(self.httpd.methods), 3)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.patch(
+            "spotify_integration.transport.time.monotonic", lambda: self.now
+        )
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_bucket_throttles_to_its_rate_after_a_burst(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.1)
+
+        self.now += 0.1
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.1)
+
+    def test_pause_holds_back_every_caller(self):
+        bucket = TokenBucket(rate=10, capacity=5)
+        bucket.pause(2)
+
+        self.assertAlmostEqual(bucket.try_acquire(), 2)
+        self.now += 1.5
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+        # A shorter Retry-After does not cut a longer pause short
+        bucket.pause(0.1)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+        self.now += 0.5
+        self.assertEqual(bucket.try_acquire(), 0)
+
+
+class StubOAuth:
+    """
+    Stands in for SpotifyOAuth, counting refreshes. Each refresh takes a
+    moment so concurrent callers overlap, and rotates the refresh token.
+    """
+
+    def __init__(self):
+        self.refreshes = 0
+
+    def refresh_access_token(self, refresh_token):
+        self.refreshes += 1
+        time.sleep(0.05)
+        return {
+            "access_token": f"access-token-{self.refreshes}",
+            "expires_in": 3600,
+            "refresh_token": f"refresh-token-{self.refreshes}",
+        }
+
+
+# Worker threads use their own DB connections, so the token row must be
+# committed for them to see it
+class SpotifyClientCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.oauth = StubOAuth()
+        patcher = mock.patch(
+            "spotify_integration.spotify_api.get_spotify_auth", lambda: self.oauth
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        forget_user_spotify_client("alice")
+        self.addCleanup(forget_user_spotify_client, "alice")
+
+    def store_token(self, expires_in):
+        return SpotifyToken.objects.create(
+            user_id="alice",
+            access_token="stored-access-token",
+            refresh_token="stored-refresh-token",
+            expires_at=timezone.now() + expires_in,
+        )
+
+    def test_cached_client_skips_token_query(self):
+        self.store_token(timedelta(hours=1))
+        sp = get_user_spotify_client("alice")
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_user_spotify_client("alice"), sp)
+        self.assertEqual(self.oauth.refreshes, 0)
+
+    def test_expired_token_is_refreshed_once_for_concurrent_callers(self):
+        self.store_token(timedelta(seconds=-1))
+        clients = []
+
+        def get_client():
+            try:
+                clients.append(get_user_spotify_client("alice"))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=get_client) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.oauth.refreshes, 1)
+        self.assertEqual(len({id(sp) for sp in clients}), 1)
+        self.assertEqual(get_user_access_token("alice"), "access-token-1")
+
+    def test_rotated_refresh_token_is_stored(self):
+        self.store_token(timedelta(seconds=-1))
+
+        get_user_spotify_client("alice")
+
+        token = SpotifyToken.objects.get(user_id="alice")
+        self.assertEqual(token.access_token, "access-token-1")
+        self.assertEqual(token.refresh_token, "refresh-token-1")
+        self.assertGreater(token.expires_at, timezone.now() + timedelta(minutes=59))
+
+    def test_forget_evicts_cached_client(self):
+        token = self.store_token(timedelta(hours=1))
+        sp = get_user_spotify_client("alice")
+
+        token.access_token = "replaced-access-token"
+        token.save()
+        forget_user_spotify_client("alice")
+
+        with self.assertNumQueries(1):
+            self.assertIsNot(get_user_spotify_client("alice"), sp)
+        self.assertEqual(get_user_access_token("alice"), "replaced-access-token")
+
+
+# The async sync hands its DB work to other threads, which only see
+# committed rows
+class AsyncSyncTests(FakeSpotifyMixin, TransactionTestCase):
+    async def sync(self, user_id, force_full=False):
+        return await async_sync_user_library(
+            user_id, "fake-access-token", force_full=force_full
+        )
+
+    async def test_full_sync_saves_library(self):
+        result = await self.sync("alice")
+
+        self.assertEqual(result, (self.library.track_count, 0))
+        liked = await sync_to_async(self.liked_spotify_ids)("alice")
+        self.assertEqual(liked, self.library_ids(self.library))
+
+    async def test_incremental_sync_fetches_only_new_tracks(self):
+        await self.sync("alice")
+        self.server.library = EditedLibrary(self.library, new_count=3)
+        requests_before = self.server.requests
+
+        self.assertEqual(await self.sync("alice"), (3, 0))
+
+        # One saved-tracks page, plus at most one batch of unseen artists
+        self.assertLessEqual(self.server.requests - requests_before, 2)
+        liked = await sync_to_async(self.liked_spotify_ids)("alice")
+        self.assertEqual(liked, self.library_ids(self.server.library))
+
+    async def test_incremental_sync_falls_back_to_full_pass(self):
+        await self.sync("alice")
+        self.server.library = EditedLibrary(self.library, new_count=2, unliked={5})
+
+        self.assertEqual(await self.sync("alice"), (self.server.library.track_count, 1))
+
+        liked = await sync_to_async(self.liked_spotify_ids)("alice")
+        self.assertEqual(liked, self.library_ids(self.server.library))
+        self.assertNotIn(self.library.track_item(5)["track"]["id"], liked)
+
+    def post_sync(self, user_id):
+        self.store_token(user_id)
+        session = self.client.session
+        session["spotify_user_id"] = user_id
+        session.save()
+        return self.client.post(reverse("spotify_integration:sync_library_async"))
+
+    def test_view_records_sync_as_job(self):
+        response = self.post_sync("alice")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tracks_synced"], self.library.track_count)
+        job = SyncJob.objects.get(user_id="alice")
+        self.assertEqual(job.status, SyncJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.tracks_synced, self.library.track_count)
+
+    def test_view_refuses_while_a_sync_is_active(self):
+        job = enqueue_sync("alice")
+
+        response = self.post_sync("alice")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            list(SyncJob.objects.values_list("pk", "status")),
+            [(job.pk, SyncJob.STATUS_QUEUED)],
+        )
+
+
+class CreatePlaylistTests(FakeSpotifyTestCase):
+    # More songs than one 100-track add-items request takes
+    library = SyntheticLibrary(400, seed=7)
+
+    def setUp(self):
+        super().setUp()
+        self.server.playlist_items.clear()
+
+    def test_playlist_gets_every_song_of_the_genre(self):
+        self.sync("alice")
+        session = self.client.session
+        session["spotify_user_id"] = "alice"
+        session.save()
+
+        response = self.client.post(
+            reverse("spotify_integration:create_playlist"), {"genre": "Rock"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        rock_ids = set(
+            Song.objects.filter(
+                library_entries__user_id="alice", broad_genre_set__name="Rock"
+            ).values_list("spotify_id", flat=True)
+        )
+        self.assertGreater(len(rock_ids), 100)
+        self.assertEqual(
+            response.json()["message"],
+            f"Playlist 'Rock Playlist' created with {len(rock_ids)} songs!",
+        )
+        (uris,) = self.server.playlist_items.values()
+        self.assertEqual(len(uris), len(rock_ids))
+        self.assertEqual({uri.rsplit(":", 1)[1] for uri in uris}, rock_ids)
+
+    def test_items_are_read_from_object_body_and_query(self):
+        url = self.server.base_url + "playlists/p1/tracks"
+        requests.post(url, json={"uris": ["spotify:track:a"]}).raise_for_status()
+        requests.post(url, params={"uris": "spotify:track:b,spotify:track:c"})
+
+        self.assertEqual(
+            self.server.playlist_items["p1"],
+            ["spotify:track:a", "spotify:track:b", "spotify:track:c"],
+        )
+
+
+class GenreTests(TestCase):
+    def test_resolve_genre_prefers_exact_mapping(self):
+        self.assertEqual(resolve_genre("K-Pop"), ["Pop", "World"])
+        self.assertEqual(resolve_genre("pop punk"), ["Rock"])
+
+    def test_resolve_genre_drops_matches_inside_longer_matches(self):
+        self.assertEqual(resolve_genre("uk pop punk"), ["Rock"])
+
+    def test_resolve_genre_combines_separate_matches(self):
+        self.assertEqual(resolve_genre("pop metal"), ["Metal", "Pop"])
+
+    def test_resolve_genre_without_match(self):
+        self.assertEqual(resolve_genre("zzz"), [])
+
+    def test_map_specific_genres_to_broad_unions_resolved_genres(self):
+        self.assertEqual(
+            map_specific_genres_to_broad(["K-Pop", "pop metal", "zzz"]),
+            ["Metal", "Pop", "World"],
+        )
+        self.assertEqual(map_specific_genres_to_broad([]), [])
+
+    def test_parse_genre_expression(self):
+        bits = genre_utils.BROAD_GENRE_BITS
+        self.assertEqual(parse_genre_expression("rock"), (bits["Rock"], False))
+        self.assertEqual(
+            parse_genre_expression("Rock AND metal"),
+            (bits["Rock"] | bits["Metal"], True),
+        )
+        self.assertEqual(
+            parse_genre_expression("pop or Indie"),
+            (bits["Pop"] | bits["Indie"], False),
+        )
+
+    def test_parse_genre_expression_rejects_bad_input(self):
+        with self.assertRaises(ValueError):
+            parse_genre_expression("rock and pop or metal")
+        with self.assertRaises(ValueError):
+            parse_genre_expression("polka")
+
+
+class RemapGenresTests(FakeSpotifyTestCase):
+    # Genres moved to another broad genre by the edited mapping
+    new_broad_genre = "Jazz / Blues"
+
+    def setUp(self):
+        super().setUp()
+        # Runs last: back to the shipped mapping once the override is gone
+        self.addCleanup(genre_utils.load_genre_mapping)
+        reset_unavailable = mock.patch.object(
+            sync, "_unavailable_genre_mapping_version", None
+        )
+        reset_unavailable.start()
+        self.addCleanup(reset_unavailable.stop)
+
+        with open(settings.GENRE_MAPPING_FILE, encoding="utf-8") as f:
+            self.shipped = json.load(f)
+        mapping_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(mapping_dir.cleanup)
+        self.mapping_file = os.path.join(mapping_dir.name, "genre_mapping.json")
+        mapping_override = override_settings(GENRE_MAPPING_FILE=self.mapping_file)
+        mapping_override.enable()
+        self.addCleanup(mapping_override.disable)
+
+    def write_mapping(self, version, moved_genres=()):
+        data = copy.deepcopy(self.shipped)
+        data["version"] = version
+        for entry in data["broad_genres"].values():
+            entry["genres"] = [g for g in entry["genres"] if g not in moved_genres]
+        data["broad_genres"][self.new_broad_genre]["genres"] += list(moved_genres)
+        with open(self.mapping_file, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def song_genres(self):
+        names = {pk: set() for pk in Song.objects.values_list("pk", flat=True)}
+        for song_pk, name in SongBroadGenre.objects.values_list(
+            "song_id", "broad_genre__name"
+        ):
+            names[song_pk].add(name)
+        return names
+
+    def test_new_version_relinks_genres_and_songs(self):
+        self.write_mapping(self.shipped["version"])
+        call_command("remap_genres", stdout=StringIO())
+        self.sync("alice")
+        # The most common mapped genre that is not already in the target
+        moved_genre = (
+            SpecificGenre.objects.filter(broad_genres__isnull=False)
+            .exclude(broad_genres__name=self.new_broad_genre)
+            .annotate(song_count=Count("artists_link__songs_link"))
+            .order_by("-song_count", "name")
+            .values_list("name", flat=True)
+            .first()
+        )
+        moved_songs = set(
+            Song.objects.filter(artists__genres__name=moved_genre).values_list(
+                "pk", flat=True
+            )
+        )
+        before = self.song_genres()
+        version_before = get_library_version("alice")
+
+        self.write_mapping(self.shipped["version"] + 1, moved_genres=[moved_genre])
+        call_command("remap_genres", stdout=StringIO())
+
+        self.assertEqual(
+            list(
+                SpecificGenre.objects.get(name=moved_genre).broad_genres.values_list(
+                    "name", flat=True
+                )
+            ),
+            [self.new_broad_genre],
+        )
+        after = self.song_genres()
+        self.assertTrue(moved_songs)
+        for song_pk in moved_songs:
+            self.assertIn(self.new_broad_genre, after[song_pk])
+        for song_pk, names in after.items():
+            if song_pk not in moved_songs:
+                self.assertEqual(names, before[song_pk])
+        for song_pk, mask in Song.objects.values_list("pk", "broad_genre_mask"):
+            self.assertEqual(mask, broad_genre_mask(after[song_pk]))
+        # Cached pages of the user show the old genres
+        self.assertGreater(get_library_version("alice"), version_before)
+        self.assertTrue(
+            GenreMappingVersion.objects.filter(
+                version=self.shipped["version"] + 1
+            ).exists()
+        )
+
+    def test_applied_version_is_reloaded_from_the_file(self):
+        version = self.shipped["version"] + 1
+        self.write_mapping(version, moved_genres=["k-pop"])
+        GenreMappingVersion.objects.create(version=version, mapping={}, bits={})
+
+        sync.refresh_genre_mapping()
+
+        self.assertEqual(genre_utils.GENRE_MAPPING_VERSION, version)
+        self.assertEqual(resolve_genre("k-pop"), [self.new_broad_genre])
+
+    def test_mapping_is_kept_when_the_file_holds_another_version(self):
+        self.write_mapping(self.shipped["version"] + 1, moved_genres=["k-pop"])
+        GenreMappingVersion.objects.create(
+            version=self.shipped["version"] + 2, mapping={}, bits={}
+        )
+
+        sync.refresh_genre_mapping()
+
+        self.assertEqual(genre_utils.GENRE_MAPPING_VERSION, self.shipped["version"])
+        self.assertEqual(resolve_genre("k-pop"), ["Pop", "World"])
+
+
+def _acquire_from_budget(budget, attempts, granted):
+    # Runs in a child process
+    for _ in range(attempts):
+        if not budget.try_acquire():
+            with granted.get_lock():
+                granted.value += 1
+
+
+class GetUniqueGenresTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        kpop = SpecificGenre.objects.create(name="k-pop")
+        unmapped = SpecificGenre.objects.create(name="zzz")
+        solo = Artist.objects.create(spotify_id="a1", name="Solo")
+        duo = Artist.objects.create(spotify_id="a2", name="Duo")
+        solo.genres.add(kpop)
+        duo.genres.add(kpop, unmapped)
+
+        album = Album.objects.create(spotify_id="al1", name="Album")
+        songs = {}
+        for spotify_id, artists in [("s1", [solo]), ("s2", [duo]), ("s3", [solo, duo])]:
+            songs[spotify_id] = Song.objects.create(
+                spotify_id=spotify_id, title=spotify_id, album=album
+            )
+            songs[spotify_id].artists.add(*artists)
+        for user_id, spotify_ids in [("alice", ["s1"]), ("bob", ["s2", "s3"])]:
+            for spotify_id in spotify_ids:
+                UserLibraryEntry.objects.create(user_id=user_id, song=songs[spotify_id])
+
+    def get_unique_genres(self, *args):
+        stdout = StringIO()
+        call_command("get_unique_genres", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_counts_every_stored_artist_and_song(self):
+        rows = json.loads(self.get_unique_genres("--format", "json"))
+
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "genre": "k-pop",
+                    "artists": 2,
+                    "songs": 3,
+                    "mapped": True,
+                    "broad_genres": ["Pop", "World"],
+                },
+                {
+                    "genre": "zzz",
+                    "artists": 1,
+                    "songs": 2,
+                    "mapped": False,
+                    "broad_genres": [],
+                },
+            ],
+        )
+
+    def test_user_counts_only_their_library(self):
+        for user_id, expected in [
+            ("alice", {"k-pop": (1, 1)}),
+            ("bob", {"k-pop": (2, 2), "zzz": (1, 2)}),
+        ]:
+            rows = json.loads(
+                self.get_unique_genres("--user", user_id, "--format", "json")
+            )
+            self.assertEqual(
+                {row["genre"]: (row["artists"], row["songs"]) for row in rows},
+                expected,
+            )
+
+    def test_csv_output(self):
+        rows = list(csv.DictReader(StringIO(self.get_unique_genres("--format", "csv"))))
+
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "genre": "k-pop",
+                    "artists": "2",
+                    "songs": "3",
+                    "mapped": "True",
+                    "broad_genres": "Pop; World",
+                },
+                {
+                    "genre": "zzz",
+                    "artists": "1",
+                    "songs": "2",
+                    "mapped": "False",
+                    "broad_genres": "",
+                },
+            ],
+        )
+
+
+class SyncAllUsersTests(TestCase):
+    def test_stale_users_are_listed_stalest_first(self):
+        now = timezone.now()
+        for user_id, synced_ago in [
+            ("fresh", timedelta(hours=1)),
+            ("old", timedelta(days=2)),
+            ("never", None),
+            ("older", timedelta(days=5)),
+        ]:
+            SpotifyToken.objects.create(
+                user_id=user_id,
+                access_token="access-token",
+                refresh_token="refresh-token",
+                expires_at=now + timedelta(hours=1),
+            )
+            if synced_ago:
+                LibrarySyncState.objects.create(user_id=user_id)
+                # synced_at is auto_now, so backdate it with an update
+                LibrarySyncState.objects.filter(user_id=user_id).update(
+                    synced_at=now - synced_ago
+                )
+        # A sync state without a token is not synced
+        LibrarySyncState.objects.create(user_id="logged-out")
+
+        self.assertEqual(stale_user_ids(timedelta(hours=12)), ["never", "older", "old"])
+        self.assertEqual(
+            stale_user_ids(timedelta(hours=12), limit=2), ["never", "older"]
+        )
+
+    def test_budget_window_is_shared_across_processes(self):
+        context = multiprocessing.get_context()
+        budget = SharedWindowBudget(limit=10, window=60, context=context)
+        granted = context.Value("i", 0)
+
+        processes = [
+            context.Process(target=_acquire_from_budget, args=(budget, 5, granted))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self.assertEqual(granted.value, 10)
+        self.assertGreater(budget.try_acquire(), 0)
+
+    def test_budget_resets_after_its_window(self):
+        now = [1000.0]
+        with mock.patch("spotify_integration.transport.time.time", lambda: now[0]):
+            budget = SharedWindowBudget(limit=2, window=30)
+            self.assertEqual(budget.try_acquire(), 0)
+            now[0] += 10
+            self.assertEqual(budget.try_acquire(), 0)
+            # Full until 30s after the window's first request
+            self.assertAlmostEqual(budget.try_acquire(), 20)
+
+            now[0] += 20
+            self.assertEqual(budget.try_acquire(), 0)
+
+            budget.pause(5)
+            self.assertAlmostEqual(budget.try_acquire(), 5)
+
+
+class LikedSongsPageTests(FakeSpotifyTestCase):
+    def get_page(self, user_id, **params):
+        session = self.client.session
+        session["spotify_user_id"] = user_id
+        session.save()
+        return self.client.get(reverse("spotify_integration:liked_songs_page"), params)
+
+    def page_through(self, user_id, **params):
+        """
+        Follows next_cursor from the first page to the last; returns the
+        song IDs in order and the first page's response.
+        """
+        first = data = self.get_page(user_id, **params).json()
+        ids = [song["id"] for song in data["songs"]]
+        while data["next_cursor"]:
+            data = self.get_page(user_id, cursor=data["next_cursor"], **params).json()
+            self.assertNotIn("total", data)
+            ids += [song["id"] for song in data["songs"]]
+        return ids, first
+
+    def library_genres(self, user_id):
+        """
+        Returns {song spotify_id: {broad genre name, ...}} for the library.
+        """
+        genres = {
+            spotify_id: set()
+            for spotify_id in Song.objects.filter(
+                library_entries__user_id=user_id
+            ).values_list("spotify_id", flat=True)
+        }
+        for spotify_id, name in SongBroadGenre.objects.filter(
+            song__library_entries__user_id=user_id
+        ).values_list("song__spotify_id", "broad_genre__name"):
+            genres[spotify_id].add(name)
+        return genres
+
+    def ordered_ids(self, spotify_ids):
+        return list(
+            Song.objects.filter(spotify_id__in=spotify_ids)
+            .order_by("title", "pk")
+            .values_list("spotify_id", flat=True)
+        )
+
+    def test_cursor_pages_through_library_once(self):
+        self.sync("alice")
+
+        ids, cursor, pages = [], None, 0
+        while True:
+            params = {"limit": 50}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.get_page("alice", **params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [song["id"] for song in data["songs"]]
+            pages += 1
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(pages, 3)
+        expected = list(
+            Song.objects.filter(library_entries__user_id="alice")
+            .order_by("title", "pk")
+            .values_list("spotify_id", flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_bad_cursor_is_rejected(self):
+        self.sync("alice")
+        for cursor in ["garbage", base64.urlsafe_b64encode(b'["title", "1"]').decode()]:
+            response = self.get_page("alice", cursor=cursor)
+            self.assertEqual(response.status_code, 400)
+
+    def test_artists_are_listed_in_credit_order(self):
+        self.sync("alice")
+
+        songs = self.get_page("alice", limit=200).json()["songs"]
+
+        credits = {}
+        for position in range(self.library.track_count):
+            track = self.library.track_item(position)["track"]
+            credits[track["id"]] = ", ".join(a["name"] for a in track["artists"])
+        self.assertTrue(any(", " in artists for artists in credits.values()))
+        self.assertEqual({song["id"]: song["artist"] for song in songs}, credits)
+
+    def test_search_matches_title_album_and_artist(self):
+        self.sync("alice")
+        song = Song.objects.order_by("pk").first()
+        Song.objects.filter(pk=song.pk).update(title="Quokka Anthem")
+        album = Song.objects.order_by("-pk").first().album
+        Album.objects.filter(pk=album.pk).update(name="Wombat Sessions")
+        artist = Artist.objects.order_by("pk").first()
+        Artist.objects.filter(pk=artist.pk).update(name="The Numbats")
+
+        for query, expected in [
+            ("quokka", [song.spotify_id]),
+            ("WOMBAT", album.songs_on_album.values_list("spotify_id", flat=True)),
+            ("numbat", artist.songs_link.values_list("spotify_id", flat=True)),
+        ]:
+            ids, first = self.page_through("alice", q=query, limit=5)
+            self.assertEqual(ids, self.ordered_ids(expected))
+            self.assertEqual(first["total"], len(ids))
+
+    def test_first_page_carries_total_and_facets_for_the_filter(self):
+        self.sync("alice")
+        genres = self.library_genres("alice")
+        # "track 1" is only in titles: Track 1, 10-19 and 100-119
+        matching = {
+            spotify_id: genres[spotify_id]
+            for spotify_id in Song.objects.filter(
+                library_entries__user_id="alice", title__icontains="track 1"
+            ).values_list("spotify_id", flat=True)
+        }
+        facets = {}
+        for names in matching.values():
+            for name in names:
+                facets[name] = facets.get(name, 0) + 1
+
+        ids, first = self.page_through("alice", q="track 1", limit=10)
+        self.assertEqual(first["total"], len(matching))
+        self.assertEqual(ids, self.ordered_ids(matching))
+        self.assertEqual(first["facets"], facets)
+
+        # Facets count every genre matching ?q=, so the other genres stay
+        # selectable; the total counts only the selected genre
+        genre = max(facets, key=facets.get)
+        ids, first = self.page_through("alice", q="track 1", genre=genre, limit=10)
+        self.assertEqual(first["facets"], facets)
+        self.assertEqual(first["total"], facets[genre])
+        self.assertEqual(
+            ids,
+            self.ordered_ids(
+                spotify_id for spotify_id, names in matching.items() if genre in names
+            ),
+        )
+
+    def test_genre_expressions_combine_across_pages(self):
+        self.sync("alice")
+        genres = self.library_genres("alice")
+        facets = self.get_page("alice").json()["facets"]
+        first, second = sorted(facets, key=facets.get, reverse=True)[:2]
+
+        for operator, matches in [
+            ("AND", lambda names: {first, second} <= names),
+            ("OR", lambda names: bool({first, second} & names)),
+        ]:
+            expected = self.ordered_ids(
+                spotify_id for spotify_id, names in genres.items() if matches(names)
+            )
+            self.assertGreater(len(expected), 3)
+            ids, page = self.page_through(
+                "alice", genre=f"{first} {operator} {second}", limit=3
+            )
+            self.assertEqual(ids, expected)
+            self.assertEqual(page["total"], len(expected))
+
+    def test_cached_page_is_invalidated_by_sync(self):
+        self.sync("alice")
+        self.assertEqual(self.get_page("alice").json()["total"], 120)
+
+        self.server.library = EditedLibrary(self.library, new_count=4)
+        self.sync("alice")
+
+        self.assertEqual(self.get_page("alice").json()["total"], 124)
+
+    def test_unchanged_sync_keeps_cached_pages(self):
+        self.sync("alice")
+        self.get_page("alice")
+        version = get_library_version("alice")
+
+        self.sync("alice")
+        self.sync("alice", force_full=True)
+
+        self.assertEqual(get_library_version("alice"), version)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_page("alice").json()["total"], 120)
+        # The page comes from the cache
+        self.assertFalse([q for q in queries if "spotify_integration_song" in q["sql"]])
+
+    def test_renamed_songs_invalidate_other_users(self):
+        self.sync("alice")
+        self.sync("bob")
+
+        renamed = set()
+        for kind in ["track", "album", "artist"]:
+            self.get_page("bob", limit=200)
+            version = get_library_version("bob")
+            renamed.add(kind)
+            library = RenamedLibrary(self.library, renamed)
+            # Alice's sync refetches the stale artist with its new name
+            Artist.objects.filter(spotify_id=library.artist_id).update(
+                genres_fetched_at=timezone.now() - timedelta(days=365)
+            )
+            self.server.library = library
+            self.sync("alice", force_full=True)
+
+            self.assertGreater(get_library_version("bob"), version, kind)
+            songs = {
+                song["id"]: song
+                for song in self.get_page("bob", limit=200).json()["songs"]
+            }
+            for position in range(3):
+                track = library.track_item(position)["track"]
+                song = songs[track["id"]]
+                self.assertEqual(song["title"], track["name"])
+                self.assertEqual(song["album"], track["album"]["name"])
+                self.assertEqual(
+                    song["artist"], ", ".join(a["name"] for a in track["artists"])
+                )
+
+    def test_regenred_songs_invalidate_other_users(self):
+        self.sync("alice")
+        self.sync("bob")
+        metal = {"genre": "Metal"}
+        metal_before = self.get_page("bob", **metal).json()["total"]
+
+        # Alice's full sync refreshes the stale artists with their new genres
+        Artist.objects.update(genres_fetched_at=timezone.now() - timedelta(days=365))
+        self.server.library = RegenredLibrary(self.library)
+        self.sync("alice", force_full=True)
+
+        metal_after = self.get_page("bob", **metal).json()["total"]
+        self.assertLess(metal_before, metal_after)
+        self.assertEqual(metal_after, self.library.track_count)
@@ -0,0 +1,299 @@
+import logging
+import multiprocessing
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+import spotipy
+import urllib3
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Path segments following these collections are Spotify IDs; they are folded
+# into "{id}" so counters are kept per endpoint rather than per resource.
+_ID_SEGMENT_RE = re.compile(
+    r"/(users|playlists|albums|artists|tracks|shows|episodes)/[^/]+(?=/|$)"
+)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second with bursts
+    of up to `capacity`. pause() blocks every caller until the given number
+    of seconds has passed, which is how a Retry-After from one request slows
+    down all the others sharing the bucket.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Takes a token and returns 0 if one is available, otherwise returns
+        the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+
+            if self._paused_until > now:
+                return self._paused_until - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class SharedWindowBudget:
+    """
+    Request budget shared by several processes: at most `limit` requests per
+    `window` seconds across all of them. State lives in multiprocessing
+    shared memory, so the budget is created in the parent and passed to the
+    workers (see install_rate_limiter). Same interface as TokenBucket.
+    """
+
+    def __init__(self, limit, window, context=None):
+        context = context or multiprocessing.get_context()
+        self.limit = limit
+        self.window = window
+        self._lock = context.Lock()
+        self._window_start = context.RawValue("d", 0.0)
+        self._used = context.RawValue("i", 0)
+        self._paused_until = context.RawValue("d", 0.0)
+
+    def try_acquire(self):
+        with self._lock:
+            now = time.time()
+            if self._paused_until.value > now:
+                return self._paused_until.value - now
+            if now - self._window_start.value >= self.window:
+                self._window_start.value = now
+                self._used.value = 0
+            if self._used.value < self.limit:
+                self._used.value += 1
+                return 0
+            return self._window_start.value + self.window - now
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until.value = max(
+                self._paused_until.value, time.time() + seconds
+            )
+
+
+class EndpointStats:
+    """
+    Per-endpoint request counters shared by every thread in the process.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status_code, seconds):
+        with self._lock:
+            counters = self._counters.setdefault(
+                endpoint,
+                {"requests": 0, "rate_limited": 0, "errors": 0, "seconds": 0.0},
+            )
+            counters["requests"] += 1
+            counters["seconds"] += seconds
+            if status_code == 429:
+                counters["rate_limited"] += 1
+            elif status_code >= 400:
+                counters["errors"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(c) for endpoint, c in self._counters.items()}
+
+
+def endpoint_key(method, url):
+    """
+    Returns a counter key such as "GET /v1/playlists/{id}/tracks".
+    """
+    path = _ID_SEGMENT_RE.sub(r"/\1/{id}", urlsplit(url).path)
+    return f"{method.upper()} {path}"
+
+
+def parse_retry_after(response, default=1.0):
+    try:
+        return max(float(response.headers.get("Retry-After", default)), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class SpotifyTransport(requests.Session):
+    """
+    requests.Session shared by every Spotify client in the process. Calls to
+    the Web API wait for the app credential's token bucket, are retried
+    after the Retry-After delay on 429 and with backoff on transient server
+    errors, and are counted per endpoint. Other hosts (the accounts service)
+    only reuse the connection pool.
+    """
+
+    # POSTs (create playlist, add tracks) may already have taken effect when
+    # a 5xx comes back, so only idempotent methods are retried on status.
+    RETRY_METHODS = frozenset(["GET", "PUT", "DELETE"])
+    RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+    def __init__(self, limiter, max_retries, pool_size, backoff_factor=0.3):
+        super().__init__()
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.stats = EndpointStats()
+
+        # urllib3 only retries failed connects, which never reach Spotify
+        # and so cost no budget. Status retries happen in request() so each
+        # attempt waits for the limiter, and a 5xx that outlasts them is
+        # returned as-is rather than raised as a MaxRetryError.
+        retry = urllib3.Retry(
+            total=max_retries,
+            connect=None,
+            read=False,
+            status=0,
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if urlsplit(url).netloc != urlsplit(settings.SPOTIFY_API_URL).netloc:
+            return super().request(method, url, *args, **kwargs)
+
+        endpoint = endpoint_key(method, url)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            started = time.monotonic()
+            response = super().request(method, url, *args, **kwargs)
+            self.stats.record(
+                endpoint, response.status_code, time.monotonic() - started
+            )
+
+            if attempt == self.max_retries:
+                return response
+            if response.status_code == 429:
+                retry_after = parse_retry_after(response)
+                logger.warning(
+                    f"[TRANSPORT] 429 on {endpoint}; backing off {retry_after:.1f}s "
+                    f"(attempt {attempt + 1}/{self.max_retries})."
+                )
+                self.limiter.pause(retry_after)
+            elif (
+                response.status_code in self.RETRY_STATUSES
+                and method.upper() in self.RETRY_METHODS
+            ):
+                delay = self.backoff_factor * 2**attempt
+                logger.warning(
+                    f"[TRANSPORT] {response.status_code} on {endpoint}; retrying "
+                    f"in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})."
+                )
+                time.sleep(delay)
+            else:
+                return response
+        return response
+
+    def close(self):
+        # spotipy closes its session in __del__; keep the shared pool open.
+        pass
+
+
+_limiters = {}
+_transport = None
+_lock = threading.Lock()
+
+
+def get_rate_limiter(client_id=None):
+    """
+    Returns the token bucket for an app credential, creating it on first use.
+    """
+    client_id = client_id or settings.SPOTIPY_CLIENT_ID
+    with _lock:
+        if client_id not in _limiters:
+            _limiters[client_id] = TokenBucket(
+                rate=settings.SPOTIFY_API_RATE_PER_SECOND,
+                capacity=settings.SPOTIFY_API_BURST,
+            )
+        return _limiters[client_id]
+
+
+def install_rate_limiter(limiter, client_id=None):
+    """
+    Makes `limiter` the request budget of an app credential in this process,
+    e.g. a SharedWindowBudget in a sync_all_users worker.
+    """
+    client_id = client_id or settings.SPOTIPY_CLIENT_ID
+    with _lock:
+        _limiters[client_id] = limiter
+        if _transport is not None:
+            _transport.limiter = limiter
+
+
+def get_transport():
+    """
+    Returns the process-wide SpotifyTransport.
+    """
+    global _transport
+    if _transport is None:
+        limiter = get_rate_limiter()
+        with _lock:
+            if _transport is None:
+                _transport = SpotifyTransport(
+                    limiter,
+                    max_retries=settings.SPOTIFY_API_MAX_RETRIES,
+                    pool_size=max(settings.SPOTIFY_API_CONCURRENCY * 4, 10),
+                )
+    return _transport
+
+
+def get_spotify_client(auth=None, auth_manager=None):
+    """
+    Builds a Spotipy client that sends its requests through the shared
+    transport.
+    """
+    client = spotipy.Spotify(
+        auth=auth, auth_manager=auth_manager, requests_session=get_transport()
+    )
+    client.prefix = settings.SPOTIFY_API_URL
+    return client
+
+
+def get_endpoint_stats():
+    """
+    Returns a copy of the per-endpoint counters of the shared transport.
+    """
+    return get_transport().stats.snapshot()
@@ -10,5 +10,8 @@ urlpatterns = [
     path("auth/", views.auth_spotify, name="auth_spotify"),
     path("callback/", views.spotify_callback, name="spotify_callback"),
     path("liked_songs/", views.liked_songs, name="liked_songs"),
+    path("liked_songs/page/", views.liked_songs_page, name="liked_songs_page"),
+    path("sync_status/", views.sync_status, name="sync_status"),
+    path("sync_async/", views.sync_library_async, name="sync_library_async"),
     path("create_playlist/", views.create_playlist, name="create_playlist"),  # ✅ NEW
 ]
@@ -1,3 +1,5 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
 from datetime import timedelta
 from django.utils import timezone
 import os
@@ -5,42 +7,39 @@ import json
 from pyexpat.errors import messages
 from django.shortcuts import render, redirect
 from django.http import JsonResponse
-from django.conf import settings
-from spotipy.oauth2 import SpotifyOAuth
+from django.db.models import Count, Exists, F, OuterRef, Q, RowRange, Subquery, Window
 import spotipy
-from django.db import transaction
+from asgiref.sync import sync_to_async
 import logging
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from .models import Song, Artist, Album, SpecificGenre, BroadGenre, SpotifyToken
-from .genre_utils import BROAD_GENRE_MAPPING, map_specific_genres_to_broad
-import traceback
+from .models import (
+    Song,
+    Artist,
+    BroadGenre,
+    SpotifyToken,
+    SongBroadGenre,
+    SyncJob,
+    UserLibraryEntry,
+)
+from .genre_utils import parse_genre_expression
+from .aggregates import GroupConcat
+from .jobs import enqueue_sync, finish_job, job_progress, start_job
+from .library_cache import cached_library_data
+from .async_sync import async_sync_user_library
+from .sync import refresh_genre_mapping
+from .spotify_api import (
+    forget_user_spotify_client,
+    get_spotify_auth,
+    get_user_access_token,
+    get_user_spotify_client,
+)
+from .transport import get_spotify_client
 
 
 logger = logging.getLogger(__name__)
 
 
-def fetch_liked_songs_if_needed(user_id, sp):
-    existing_songs = Song.objects.filter(user_id=user_id)
-    if existing_songs.exists():
-        logger.info(
-            f"[CACHE HIT] Songs already exist for user {user_id}. Skipping fetch."
-        )
-        return False
-
-    logger.info(f"[CACHE MISS] No songs for user {user_id}. Fetching from Spotify...")
-    return True
-
-
-def get_spotify_auth():
-    return SpotifyOAuth(
-        client_id=settings.SPOTIPY_CLIENT_ID,
-        client_secret=settings.SPOTIPY_CLIENT_SECRET,
-        redirect_uri=settings.SPOTIPY_REDIRECT_URI,
-        scope="user-library-read playlist-modify-private playlist-modify-public",
-    )
-
-
 # Home page view
 def home(request):
     """
@@ -60,40 +59,16 @@ def auth_spotify(request):
     return redirect(auth_url)
 
 
-def get_user_spotify_client(user_id):
-    """
-    Returns a Spotipy client for the given user_id.
-    Refreshes token if expired.
-    """
-    try:
-        token = SpotifyToken.objects.get(user_id=user_id)
-    except SpotifyToken.DoesNotExist:
-        return None
-
-    # If token expired → refresh
-    if token.expires_at <= timezone.now():
-        sp_oauth = get_spotify_auth()
-        refreshed_token = sp_oauth.refresh_access_token(token.refresh_token)
-
-        token.access_token = refreshed_token["access_token"]
-        token.expires_at = timezone.now() + timedelta(
-            seconds=refreshed_token["expires_in"]
-        )
-        token.save(update_fields=["access_token", "expires_at"])
-
-    return spotipy.Spotify(auth=token.access_token)
-
-
 # Spotify Callback view for handling redirect after auth
 def spotify_callback(request):
     """
     Handles the callback from Spotify after user authorization.
     Exchanges code for token, stores tokens per user in DB,
-    fetches liked songs, and saves them to the local DB.
-    Includes logic to skip songs with critical missing metadata.
+    and queues a background job that syncs the liked songs to the local DB.
     """
     sp_oauth = get_spotify_auth()
     code = request.GET.get("code")
+    user_id = None
 
     if not code:
         error_message = request.GET.get("error", "No authorization code received.")
@@ -116,7 +91,7 @@ def spotify_callback(request):
 
         # --- 2. Fetch current user info ---
         print("DEBUG: Creating Spotify client...")
-        sp = spotipy.Spotify(auth=access_token)
+        sp = get_spotify_client(auth=access_token)
 
         print("DEBUG: Fetching current user info...")
         user_info = sp.current_user()
@@ -136,260 +111,22 @@ def spotify_callback(request):
             },
         )
         print("DEBUG: Tokens saved successfully for user:", user_id)
+        forget_user_spotify_client(user_id)
 
-        return JsonResponse({"status": "success", "user_id": user_id})
-
-    except Exception as e:
-        print("ERROR in spotify_callback:", str(e))
-        traceback.print_exc()
-
-        # --- 3. Check whether to fetch liked songs ---
-        should_fetch = fetch_liked_songs_if_needed(user_id, sp)
-        if not should_fetch:
-            return redirect("spotify_integration:liked_songs")
+        # --- 4. Queue the library sync; a run_sync_worker process picks it up ---
+        job = enqueue_sync(user_id, force_full=request.GET.get("sync") == "true")
+        logger.info(f"[SYNC] Queued sync job {job.pk} for user {user_id}.")
 
-        logger.info(f"[SYNC] Starting data sync for user {user_id}...")
-
-        # --- 4. Fetch all liked songs ---
-        all_liked_tracks_spotify_ids = set()
-        current_user_liked_tracks = []
-
-        results = sp.current_user_saved_tracks(limit=50)
-        while results:
-            for item in results["items"]:
-                track = item["track"]
-                if track:
-                    current_user_liked_tracks.append(track)
-                    all_liked_tracks_spotify_ids.add(track["id"])
-            results = sp.next(results) if results["next"] else None
-
-        logger.info(
-            f"[SYNC] Fetched {len(current_user_liked_tracks)} liked songs from Spotify API."
-        )
-        # Process and Save to DB within an atomic transaction
-        with transaction.atomic():
-            all_api_artist_ids = set()
-            for track_data in current_user_liked_tracks:
-                song_id = track_data.get("id")
-                song_title = track_data.get("name")
-                album_data = track_data.get("album")
-                album_image_url = (
-                    album_data["images"][0]["url"]
-                    if album_data and album_data.get("images")
-                    else None
-                )
-                artists_from_track = track_data.get("artists", [])
-
-                # Only add artists to the batch fetch if the song has critical data
-                if (
-                    song_title
-                    and album_data
-                    and album_data.get("name")
-                    and album_image_url
-                    and artists_from_track
-                ):
-                    for artist_data in artists_from_track:
-                        all_api_artist_ids.add(artist_data["id"])
-                else:
-                    logger.warning(
-                        f"Skipping artist ID collection for song '{song_title}' (ID: {song_id}) due to critical missing metadata."
-                    )
-
-            logger.info(
-                f"Collected {len(all_api_artist_ids)} unique artist IDs for genre fetching."
-            )
-
-            # Fetch detailed information for all unique artists in batches
-            artist_details_from_api = {}
-            artist_ids_list = list(all_api_artist_ids)
-            batch_size = 50
-            for i in range(0, len(artist_ids_list), batch_size):
-                batch = artist_ids_list[i : i + batch_size]
-                try:
-                    artists_batch_details = sp.artists(batch)
-                    for artist_detail in artists_batch_details["artists"]:
-                        if artist_detail:  # Ensure artist_detail is not None
-                            artist_details_from_api[artist_detail["id"]] = artist_detail
-                except spotipy.exceptions.SpotifyException as e:
-                    logger.warning(
-                        f"Spotify API error fetching artist details for batch (skipping {i}-{i + batch_size - 1}): {e}"
-                    )
-                except Exception as e:
-                    logger.error(
-                        f"Unexpected error fetching artist details for batch (skipping {i}-{i + batch_size - 1}): {e}"
-                    )
-
-            logger.info(
-                f"Fetched details for {len(artist_details_from_api)} artists from Spotify API for genre parsing."
-            )
-
-            # Save/Update Artists and their Specific Genres, then link to Broad Genres
-            saved_artists = {}
-            logger.info(
-                "Processing artists and genres (logging only artists with no genres)..."
-            )
-            for artist_id, artist_data in artist_details_from_api.items():
-                specific_genres_list = artist_data.get("genres", [])
-
-                if not specific_genres_list:
-                    logger.debug(
-                        f"  Processing Artist (No Genres Found): {artist_data['name']} (ID: {artist_id})"
-                    )
-                    logger.debug(
-                        f"    Specific genres from Spotify API: {specific_genres_list}"
-                    )
-
-                artist_obj, created = Artist.objects.get_or_create(
-                    spotify_id=artist_id, defaults={"name": artist_data["name"]}
-                )
-                if not created and artist_obj.name != artist_data["name"]:
-                    artist_obj.name = artist_data["name"]
-                    artist_obj.save(update_fields=["name"])
-                saved_artists[artist_id] = artist_obj
-
-                artist_obj.genres.clear()
-
-                for specific_genre_name in specific_genres_list:
-                    specific_genre_obj, created_sg = (
-                        SpecificGenre.objects.get_or_create(name=specific_genre_name)
-                    )
-
-                    artist_obj.genres.add(specific_genre_obj)
-
-                    broad_genres_for_specific = map_specific_genres_to_broad(
-                        [specific_genre_name]
-                    )
-                    for broad_genre_name in broad_genres_for_specific:
-                        broad_genre_obj, created_broad = (
-                            BroadGenre.objects.get_or_create(name=broad_genre_name)
-                        )
-                        specific_genre_obj.broad_genres.add(broad_genre_obj)
-
-            # Save/Update Albums and Songs, and link to Artists
-            logger.info(
-                "Processing songs and albums (logging only problematic ones that are skipped)..."
-            )
-            processed_songs_spotify_ids = (
-                set()
-            )  # Track songs actually processed and saved
-            for track_data in current_user_liked_tracks:
-                song_id = track_data.get("id")
-                song_title = track_data.get("name")
-                album_data = track_data.get("album")
-                artists_from_track = track_data.get("artists", [])
-
-                if not song_title:
-                    logger.warning(f"Skipping song '{song_id}' due to missing title.")
-                    continue
-
-                if not album_data:
-                    logger.warning(
-                        f"Skipping song '{song_title}' (ID: {song_id}) due to missing album data from Spotify."
-                    )
-                    continue
-
-                album_name = album_data.get("name")
-                if not album_name:
-                    logger.warning(
-                        f"Skipping song '{song_title}' (ID: {song_id}) due to missing album name."
-                    )
-                    continue
-
-                album_image_url = (
-                    album_data["images"][0]["url"] if album_data.get("images") else None
-                )
-                if not album_image_url:
-                    logger.warning(
-                        f"Skipping song '{song_title}' (ID: {song_id}) due to missing album image URL."
-                    )
-                    continue
-
-                if not artists_from_track:
-                    logger.warning(
-                        f"Skipping song '{song_title}' (ID: {song_id}) due to missing artist data."
-                    )
-                    continue
-
-                album_obj, created_album = Album.objects.get_or_create(
-                    spotify_id=album_data["id"],
-                    defaults={"name": album_data["name"], "image_url": album_image_url},
-                )
-                if not created_album:
-                    updated_album_fields = []
-                    if album_obj.name != album_data["name"]:
-                        album_obj.name = album_data["name"]
-                        updated_album_fields.append("name")
-                    if album_obj.image_url != album_image_url:
-                        album_obj.image_url = album_image_url
-                        updated_album_fields.append("image_url")
-                    if updated_album_fields:
-                        album_obj.save(update_fields=updated_album_fields)
-
-                song_obj, created_song = Song.objects.get_or_create(
-                    spotify_id=track_data["id"],
-                    defaults={
-                        "title": track_data["name"],
-                        "album": album_obj,
-                        "preview_url": track_data.get("preview_url"),
-                        "user_id": user_id,
-                    },
-                )
-                if not created_song and song_obj.user_id != user_id:
-                    song_obj.user_id = user_id
-                    song_obj.save(update_fields=["user_id"])
-                    updated_song_fields = []
-                    if song_obj.title != track_data["name"]:
-                        song_obj.title = track_data["name"]
-                        updated_song_fields.append("title")
-                    if song_obj.album != album_obj:
-                        song_obj.album = album_obj
-                        updated_song_fields.append("album")
-                    if song_obj.preview_url != track_data.get("preview_url"):
-                        song_obj.preview_url = track_data.get("preview_url")
-                        updated_song_fields.append("preview_url")
-                    if updated_song_fields:
-                        song_obj.save(update_fields=updated_song_fields)
-
-                song_obj.artists.clear()
-                for artist_data in artists_from_track:
-                    artist_id = artist_data["id"]
-                    if artist_id in saved_artists:
-                        song_obj.artists.add(saved_artists[artist_id])
-                    else:
-                        logger.warning(
-                            f"  Artist {artist_data['name']} (ID: {artist_id}) not found in batch cache for song {track_data['name']}. Creating minimally."
-                        )
-                        fallback_artist_obj, created_fb = Artist.objects.get_or_create(
-                            spotify_id=artist_id, defaults={"name": artist_data["name"]}
-                        )
-                        song_obj.artists.add(fallback_artist_obj)
-
-                processed_songs_spotify_ids.add(song_id)
-
-            # Remove songs from DB that are no longer liked by the user OR were skipped during this run
-            if request.GET.get("sync") == "true":
-                db_current_songs = set(
-                    Song.objects.values_list("spotify_id", flat=True)
-                )
-                songs_to_remove_ids = db_current_songs - processed_songs_spotify_ids
-                if songs_to_remove_ids:
-                    Song.objects.filter(spotify_id__in=songs_to_remove_ids).delete()
-                    logger.info(
-                        f"Removed {len(songs_to_remove_ids)} songs (no longer liked by user or skipped during sync) from DB."
-                    )
-                else:
-                    logger.info(
-                        "Skipping deletion of old songs because sync flag was not set."
-                    )
-
-        logger.info("[SYNC COMPLETE] Redirecting to liked songs page.")
+        logger.info("[SYNC QUEUED] Redirecting to liked songs page.")
         return redirect("spotify_integration:liked_songs")
 
     except spotipy.exceptions.SpotifyException as e:
         logger.error(f"Spotify API error during callback: {e}")
         if e.http_status == 401:
             logger.warning("Token expired or invalid. Removing stored token.")
-            SpotifyToken.objects.filter(user_id=user_id).delete()
+            if user_id:
+                SpotifyToken.objects.filter(user_id=user_id).delete()
+                forget_user_spotify_client(user_id)
             return redirect("spotify_integration:auth_spotify")
         return JsonResponse({"error": f"Spotify API error: {e}"}, status=e.http_status)
 
@@ -402,11 +139,152 @@ def spotify_callback(request):
         )
 
 
+LIKED_SONGS_PAGE_SIZE = 50
+LIKED_SONGS_MAX_PAGE_SIZE = 200
+# Separates the broad genre names aggregated by song_listing_rows
+GENRE_NAME_SEPARATOR = "\x1f"
+
+
+def encode_song_cursor(title, pk):
+    """
+    Returns an opaque cursor pointing just past the song with this title and
+    id in (title, id) order.
+    """
+    return urlsafe_b64encode(json.dumps([title, pk]).encode()).decode()
+
+
+def decode_song_cursor(cursor):
+    """
+    Returns the (title, id) encoded in `cursor`. Raises ValueError if the
+    cursor is malformed.
+    """
+    try:
+        title, pk = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError, UnicodeError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+    if not isinstance(title, str) or not isinstance(pk, int):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return title, pk
+
+
+def song_listing_rows(songs):
+    """
+    Returns `songs` as (title, id, spotify_id, preview_url, album name,
+    album image URL, artist names, broad genre names) tuples. Artist and
+    genre names are aggregated in SQL by correlated subqueries, so a page
+    of songs is one query and no model instances are built. Artists are
+    listed in the order they were linked to the song, i.e. as credited on
+    Spotify; GROUP_CONCAT only follows an order when run as a window.
+    """
+    artist_names = (
+        Song.artists.through.objects.filter(song=OuterRef("pk"))
+        .annotate(
+            names=Window(
+                GroupConcat("artist__name", ", "),
+                order_by=F("pk").asc(),
+                frame=RowRange(start=None, end=None),
+            )
+        )
+        .values("names")[:1]
+    )
+    genre_names = (
+        SongBroadGenre.objects.filter(song=OuterRef("pk"))
+        .values("song")
+        .annotate(names=GroupConcat("broad_genre__name", GENRE_NAME_SEPARATOR))
+        .values("names")
+    )
+    return songs.annotate(
+        artist_names=Subquery(artist_names), genre_names=Subquery(genre_names)
+    ).values_list(
+        "title",
+        "pk",
+        "spotify_id",
+        "preview_url",
+        "album__name",
+        "album__image_url",
+        "artist_names",
+        "genre_names",
+    )
+
+
+def song_row_to_dict(row):
+    """
+    Returns the template/JSON representation of a song_listing_rows tuple.
+    """
+    title, _, spotify_id, preview_url, album_name, image_url, artists, genres = row
+    broad_genres_for_song = sorted(genres.split(GENRE_NAME_SEPARATOR)) if genres else []
+
+    # Debug logging for problematic records
+    if not image_url or not broad_genres_for_song:
+        logger.debug(
+            f"[LIKED_SONGS:ISSUE] Song '{title}' (ID: {spotify_id})\n"
+            f"  Album: {album_name or 'N/A'}\n"
+            f"  Image URL: {image_url or 'N/A'}\n"
+            f"  Artists: {artists or ''}\n"
+            f"  Broad Genres: {broad_genres_for_song}\n" + "-" * 40
+        )
+
+    return {
+        "title": title,
+        "artist": artists or "Various Artists",
+        "album": album_name or "N/A",
+        "id": spotify_id,
+        "preview_url": preview_url,
+        "image_url": image_url or "/static/default_album_art.png",
+        "broad_genres": broad_genres_for_song,
+    }
+
+
+def library_songs(user_id, genre_mask=0, match_all=False, query=""):
+    """
+    Returns the songs in the user's library, optionally limited to those
+    matching a genre mask from parse_genre_expression and to those whose
+    title, album or an artist name contains `query`.
+    """
+    # Exists() rather than a join, so ordered queries walk song_title_id_idx
+    # and stop after one page instead of sorting the whole library
+    songs = Song.objects.filter(
+        Exists(UserLibraryEntry.objects.filter(user_id=user_id, song=OuterRef("pk")))
+    )
+    if genre_mask:
+        songs = songs.alias(genre_bits=F("broad_genre_mask").bitand(genre_mask))
+        if match_all:
+            songs = songs.filter(genre_bits=genre_mask)
+        else:
+            songs = songs.exclude(genre_bits=0)
+    if query:
+        songs = songs.filter(
+            Q(title__icontains=query)
+            | Q(album__name__icontains=query)
+            | Exists(
+                Artist.objects.filter(songs_link=OuterRef("pk"), name__icontains=query)
+            )
+        )
+    return songs
+
+
+def genre_facets(songs):
+    """
+    Returns [(broad genre name, song count)] over `songs`, sorted by name,
+    in one grouped query.
+    """
+    return list(
+        BroadGenre.objects.filter(songs__in=songs.values("pk"))
+        .annotate(song_count=Count("songs"))
+        .order_by("name")
+        .values_list("name", "song_count")
+    )
+
+
 # Liked Songs view
 def liked_songs(request):
     """
-    Displays the user's liked songs from the local database.
-    Uses DB-backed token management (no local cache).
+    Renders the liked songs page for the user in the session. Only the song
+    count and the genre filter options are queried here, and cached until
+    the next sync; the songs themselves are fetched page by page from
+    liked_songs_page as the user scrolls, filtered server-side.
+    The user's Spotify client comes from the in-memory client cache
+    (get_user_spotify_client).
     """
     # Resolve Spotify user ID from session
     spotify_user_id = request.session.get("spotify_user_id")
@@ -420,71 +298,193 @@ def liked_songs(request):
         logger.info("[LIKED_SONGS] No valid Spotify token, redirecting for auth.")
         return redirect("spotify_integration:auth_spotify")
 
-    # Pull songs for this user from local DB
-    songs_data = []
-    songs_from_db = (
-        Song.objects.filter(user_id=spotify_user_id)
-        .select_related("album")
-        .prefetch_related("artists__genres")
-        .order_by("title")
+    def load_summary():
+        total_songs = UserLibraryEntry.objects.filter(user_id=spotify_user_id).count()
+        # Build genre filter list with song counts
+        return total_songs, genre_facets(library_songs(spotify_user_id))
+
+    total_songs, sorted_broad_genres = cached_library_data(
+        spotify_user_id, "summary", load_summary
     )
 
-    logger.debug(
-        f"[LIKED_SONGS] Preparing to process {len(songs_from_db)} songs for template."
+    # Render template
+    return render(
+        request,
+        "spotify_integration/liked_songs.html",
+        {
+            "total_songs": total_songs,
+            "page_size": LIKED_SONGS_PAGE_SIZE,
+            "broad_genres_for_filter": sorted_broad_genres,
+        },
     )
 
-    for song_obj in songs_from_db:
-        artists_names = [artist.name for artist in song_obj.artists.all()]
-        broad_genres_for_song = song_obj.broad_genres
-
-        # Debug logging for problematic records
-        if (
-            not song_obj.album
-            or not song_obj.album.image_url
-            or not broad_genres_for_song
-        ):
-            logger.debug(
-                f"[LIKED_SONGS:ISSUE] Song '{song_obj.title}' (ID: {song_obj.spotify_id})\n"
-                f"  Album: {song_obj.album.name if song_obj.album else 'N/A'}\n"
-                f"  Image URL: {song_obj.album.image_url if song_obj.album else 'N/A'}\n"
-                f"  Artists: {', '.join(artists_names)}\n"
-                f"  Broad Genres: {broad_genres_for_song}\n" + "-" * 40
-            )
 
-        songs_data.append(
-            {
-                "title": song_obj.title,
-                "artist": ", ".join(artists_names)
-                if artists_names
-                else "Various Artists",
-                "album": song_obj.album.name if song_obj.album else "N/A",
-                "id": song_obj.spotify_id,
-                "preview_url": song_obj.preview_url,
-                "image_url": song_obj.album.image_url
-                if song_obj.album and song_obj.album.image_url
-                else "/static/default_album_art.png",
-                "broad_genres": broad_genres_for_song,
-            }
-        )
+def liked_songs_page(request):
+    """
+    Returns one page of the user's liked songs as JSON, ordered by
+    (title, id). Pass the returned `next_cursor` as ?cursor= to get the
+    next page; it is null on the last page. ?limit= sets the page size.
+
+    ?genre= filters by a broad genre expression such as "Rock" or
+    "Pop OR Indie", and ?q= by text in the title, album or artist names.
+    The first page (no cursor) also carries the number of matching songs
+    and per-genre counts ("facets") over the songs matching ?q=.
+    Responses are cached per user until the next sync.
+    """
+    spotify_user_id = request.session.get("spotify_user_id")
+    if not spotify_user_id:
+        return JsonResponse({"error": "Not authenticated"}, status=401)
 
-    logger.debug(
-        f"[LIKED_SONGS] Successfully prepared {len(songs_data)} songs for template render."
+    try:
+        limit = int(request.GET.get("limit", LIKED_SONGS_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({"error": "limit must be an integer"}, status=400)
+    limit = max(1, min(limit, LIKED_SONGS_MAX_PAGE_SIZE))
+
+    genre = request.GET.get("genre", "").strip()
+    query = request.GET.get("q", "").strip()
+    genre_mask, match_all = 0, False
+    if genre and genre.lower() != "all":
+        # Pick up a mapping applied by remap_genres since this process started
+        refresh_genre_mapping()
+        try:
+            genre_mask, match_all = parse_genre_expression(genre)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+    cursor = request.GET.get("cursor")
+    after = None
+    if cursor:
+        try:
+            after = decode_song_cursor(cursor)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+    return JsonResponse(
+        cached_library_data(
+            spotify_user_id,
+            f"page:{limit}:{genre_mask}:{match_all}:{after}:{query}",
+            lambda: build_liked_songs_page(
+                spotify_user_id, limit, genre_mask, match_all, query, after
+            ),
+        )
     )
 
-    # Build unique genre filter list
-    all_available_broad_genres = {
-        genre for song_item in songs_data for genre in song_item["broad_genres"]
+
+def build_liked_songs_page(user_id, limit, genre_mask, match_all, query, after):
+    """
+    Returns the liked_songs_page response for the songs after the
+    (title, id) in `after`, or for the first page if it is None.
+    """
+    songs_from_db = library_songs(user_id, genre_mask, match_all, query)
+    if after:
+        after_title, after_pk = after
+        page_songs = songs_from_db.filter(
+            Q(title__gt=after_title) | Q(title=after_title, pk__gt=after_pk)
+        )
+    else:
+        page_songs = songs_from_db
+
+    # Fetch one extra row to learn whether there is a next page
+    page = list(song_listing_rows(page_songs.order_by("title", "pk")[: limit + 1]))
+    has_next = len(page) > limit
+    page = page[:limit]
+
+    logger.debug(f"[LIKED_SONGS] Prepared {len(page)} songs for user {user_id}.")
+
+    response = {
+        "songs": [song_row_to_dict(row) for row in page],
+        "next_cursor": encode_song_cursor(*page[-1][:2]) if has_next else None,
     }
-    sorted_broad_genres = sorted(list(all_available_broad_genres))
+    if not after:
+        response["total"] = songs_from_db.count()
+        response["facets"] = dict(genre_facets(library_songs(user_id, query=query)))
+    return response
 
-    # Render template
-    return render(
-        request,
-        "spotify_integration/liked_songs.html",
+
+def sync_status(request):
+    """
+    Returns the progress of the current user's latest sync job as JSON.
+    Polled by the liked songs page while a sync is queued or running.
+    """
+    spotify_user_id = request.session.get("spotify_user_id")
+    if not spotify_user_id:
+        return JsonResponse({"error": "Not authenticated"}, status=401)
+
+    job = (
+        SyncJob.objects.filter(user_id=spotify_user_id).order_by("-created_at").first()
+    )
+    if not job:
+        return JsonResponse({"status": "none"})
+
+    return JsonResponse(
         {
-            "songs": songs_data,
-            "broad_genres_for_filter": sorted_broad_genres,
-        },
+            "job_id": job.pk,
+            "status": job.status,
+            "phase": job.phase,
+            "pages_done": job.pages_done,
+            "pages_total": job.pages_total,
+            "tracks_synced": job.tracks_synced,
+            "tracks_removed": job.tracks_removed,
+            "eta_seconds": job.eta_seconds,
+            "error": job.error,
+        }
+    )
+
+
+@csrf_exempt
+@require_POST
+async def sync_library_async(request):
+    """
+    Syncs the user's liked songs on the event loop and returns the result as
+    JSON. Served through asgi.py, Spotify pages and artist batches are fetched
+    concurrently without holding a thread per user; DB writes are handed off
+    in per-page chunks. Pass ?sync=true to force a full reconcile. The sync
+    is recorded as a SyncJob, so sync_status reports it, and is refused while
+    another sync of the user is queued or running.
+    """
+    spotify_user_id = await request.session.aget("spotify_user_id")
+    if not spotify_user_id:
+        return JsonResponse({"error": "Not authenticated"}, status=401)
+
+    access_token = await sync_to_async(get_user_access_token)(spotify_user_id)
+    if not access_token:
+        return JsonResponse({"error": "No valid Spotify token"}, status=401)
+
+    job = await sync_to_async(start_job)(
+        spotify_user_id, force_full=request.GET.get("sync") == "true"
+    )
+    if job is None:
+        return JsonResponse(
+            {"error": "A sync is already queued or running for this user."},
+            status=409,
+        )
+
+    try:
+        tracks_synced, tracks_removed = await async_sync_user_library(
+            spotify_user_id,
+            access_token,
+            force_full=job.force_full,
+            progress=job_progress(job),
+        )
+    except BaseException as e:
+        await sync_to_async(finish_job)(job, error=e)
+        if not isinstance(e, spotipy.exceptions.SpotifyException):
+            raise
+        logger.error(f"Spotify API error during async sync: {e}")
+        if e.http_status == 401:
+            logger.warning("Token expired or invalid. Removing stored token.")
+            await SpotifyToken.objects.filter(user_id=spotify_user_id).adelete()
+            forget_user_spotify_client(spotify_user_id)
+        return JsonResponse({"error": f"Spotify API error: {e}"}, status=e.http_status)
+
+    await sync_to_async(finish_job)(job, tracks_synced, tracks_removed)
+    return JsonResponse(
+        {
+            "status": "success",
+            "tracks_synced": tracks_synced,
+            "tracks_removed": tracks_removed,
+        }
     )
 
 
@@ -493,12 +493,18 @@ def liked_songs(request):
 def create_playlist(request):
     """
     Creates a new Spotify playlist for the given genre and populates it with
-    all songs mapped to that genre from the local DB.
+    all songs mapped to that genre from the local DB. `genre` may also
+    combine genres, e.g. "Rock AND Metal" or "Pop OR Indie".
     Uses DB-backed token management (multi-user ready).
     """
     genre = request.POST.get("genre", "").strip().lower()
     if not genre:
         return JsonResponse({"error": "Genre not provided"}, status=400)
+    refresh_genre_mapping()
+    try:
+        genre_mask, match_all = parse_genre_expression(genre)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
     # --- 1. Resolve Spotify user ---
     spotify_user_id = request.session.get("spotify_user_id")
@@ -522,21 +528,18 @@ def create_playlist(request):
     playlist_id = playlist["id"]
 
     # --- 4. Collect songs of this genre from DB (for this user only) ---
-    genre_songs = (
-        Song.objects.prefetch_related("artists__genres__broad_genres")
-        .filter(
-            artists__genres__broad_genres__name__iexact=genre, user_id=spotify_user_id
-        )
-        .distinct()
-    )
+    genre_songs = library_songs(spotify_user_id, genre_mask, match_all)
+
+    track_uris = [
+        f"spotify:track:{spotify_id}"
+        for spotify_id in genre_songs.values_list("spotify_id", flat=True)
+    ]
 
     logger.debug(f"[CREATE_PLAYLIST] Requested genre: '{genre}'")
     logger.debug(
-        f"[CREATE_PLAYLIST] Found {genre_songs.count()} songs with genre '{genre}'"
+        f"[CREATE_PLAYLIST] Found {len(track_uris)} songs with genre '{genre}'"
     )
 
-    track_uris = [f"spotify:track:{song.spotify_id}" for song in genre_songs]
-
     # --- 5. Add songs to playlist in batches (Spotify limit = 100) ---
     for i in range(0, len(track_uris), 100):
         sp.playlist_add_items(playlist_id, track_uris[i : i + 100])